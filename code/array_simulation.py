@@ -0,0 +1,397 @@
+from simulation import Simulation
+from pedestrian_stream import PedestrianStream
+from signal_scheduler import SignalScheduler
+import numpy as np
+import matplotlib.pyplot as plt
+
+class ArraySimulation(Simulation):
+    """
+    Performs the cellular automata simulation with its state held in NumPy
+    arrays indexed by dense node and pedestrian ids, instead of in Node and
+    Pedestrian objects. Pedestrians follow the grid's routing table, and every
+    pedestrian moving in a step is handled at once.
+    """
+
+    # Marks an empty node, or a pedestrian that hasn't entered the grid.
+    NONE = -1
+
+    """
+    Creates a new ArraySimulation. Takes the same parameters as Simulation.
+
+    The grid must have been preprocessed in trees mode (or loaded from a
+    routing table), since pedestrians may need a route from any node.
+
+    """
+    def __init__(self, grid, params = {}):
+        # Build the per-node arrays before the pedestrians are seeded.
+        self.initialize_nodes(grid)
+
+        Simulation.__init__(self, grid, params)
+
+        # Generator used for breaking ties between pedestrians competing for
+        # the same node. Kept apart from numpy's global generator, which
+        # draws pedestrian arrivals.
+        self.tie_rng = np.random.RandomState(self.movement_seed)
+
+    # Builds the arrays describing the nodes of the grid.
+    def initialize_nodes(self, grid):
+        self.routing_table = grid.get_routing_table()
+
+        # Dense node indexes are the positions of node_ids in the routing
+        # table.
+        self.node_ids = np.asarray(self.routing_table.node_ids)
+
+        if not np.array_equal(self.node_ids, grid.csr.node_ids):
+            raise ValueError('Routing table does not cover the nodes of the grid.')
+
+        nodes = [grid.node_dict[int(node_id)] for node_id in self.node_ids]
+
+        self.is_exit = np.array([node.node_type == grid.type_map['exit']
+                                 for node in nodes], dtype=bool)
+        self.pixx = np.array([node.pixx for node in nodes])
+        self.pixy = np.array([node.pixy for node in nodes])
+
+        # Neighbors of each node as dense indexes, padded with NONE.
+        self.neighbors = grid.csr.padded_neighbors()
+
+        # Nodes that pedestrians can't step onto. Starts from the current
+        # availability of the grid's nodes.
+        self.blocked = np.array([not node.available for node in nodes], dtype=bool)
+
+        # Dense node indexes of each intersection's nodes, and whether it is
+        # open.
+        self.intersection_nodes = {}
+        self.intersection_open = {}
+
+        for int_id, intersection in grid.intersections_dict.iteritems():
+            member_ids = [node.node_id for node in intersection.nodes]
+            self.intersection_nodes[int_id] = np.searchsorted(self.node_ids, member_ids)
+            self.intersection_open[int_id] = intersection.is_open
+
+    # Seeds the simulation with pedestrians, stored as arrays of entrance
+    # nodes, destinations and speeds. Draws from the random number generator
+    # in the same order as Simulation, so the same seed gives the same
+    # pedestrians.
+    def seed_pedestrians(self):
+        stream = PedestrianStream(self.grid, self.rng, self.num_pedestrians,
+                                  self.generate_speed_distribution(),
+                                  speed_rng=self.speed_rng)
+        entrance_nodes, destination_nodes, speeds = stream.sample(self.num_pedestrians)
+
+        entrance_ids = np.array([node.node_id for node in entrance_nodes], dtype=np.int32)
+        destination_ids = np.array([node.node_id for node in destination_nodes], dtype=np.int32)
+        self.speeds = np.array(speeds, dtype=np.int32)
+
+        self.entrances = np.searchsorted(self.node_ids, entrance_ids).astype(np.int32)
+
+        # Each pedestrian's destination, as a row of the routing table.
+        destination_index = self.routing_table.destination_index
+        self.destination_rows = np.array([destination_index[int(dest_id)]
+                                          for dest_id in destination_ids],
+                                         dtype=np.int32)
+
+        if self.num_pedestrians > 0 and (self.routing_table.next_hops[self.destination_rows, self.entrances] < 0).any():
+            raise ValueError('Some pedestrians cannot reach their destination.')
+
+        # Index of the next pedestrian in the queue to enter the grid.
+        self.queue_head = 0
+
+    # Moves a set of pedestrians to new nodes. Those reaching an exit leave
+    # the grid.
+    def move_peds(self, peds, new_positions):
+        self.num_moves += len(peds)
+
+        self.occupant[self.positions[peds]] = self.NONE
+        self.positions[peds] = new_positions
+
+        exiting = self.is_exit[new_positions]
+        self.in_grid[peds[exiting]] = False
+
+        if self.collect_pedestrians:
+            self.ped_path_length[peds] += 1
+            self.ped_egress[peds[exiting]] = self.timestep
+
+        staying = ~exiting
+        self.occupant[new_positions[staying]] = peds[staying]
+
+    # Returns the pedestrians that win the nodes they compete for: one
+    # pedestrian, chosen at random, for each distinct node. Returns the
+    # indexes of the winners within *peds*.
+    def resolve_conflicts(self, peds, targets):
+        order = self.tie_rng.permutation(len(peds))
+        first = np.unique(targets[order], return_index=True)[1]
+
+        return order[first]
+
+    # Performs one sub-step of movement for the given pedestrians: each tries
+    # to step to the next node on its route, swapping places with a
+    # pedestrian coming the other way, or stepping aside to a free neighbor if
+    # its next node is taken.
+    def step(self, peds):
+        next_hops = self.routing_table.next_hops
+        distances = self.routing_table.distances
+
+        current = self.positions[peds]
+        rows = self.destination_rows[peds]
+        targets = next_hops[rows, current]
+
+        # Record every mover's target so swaps can be found.
+        self.target_of[peds] = targets
+
+        occupants = self.occupant[targets]
+        swapping = occupants != self.NONE
+        swapping[swapping] = self.target_of[occupants[swapping]] == current[swapping]
+
+        free = (occupants == self.NONE) & ~self.blocked[targets]
+
+        self.target_of[peds] = self.NONE
+
+        # Pedestrians swapping places both move.
+        if swapping.any():
+            self.move_peds(peds[swapping], targets[swapping])
+            self.num_swaps += int(swapping.sum())
+
+        # One pedestrian moves onto each free target.
+        candidates = np.flatnonzero(free)
+        moved = np.zeros(len(peds), dtype=bool)
+        moved[swapping] = True
+
+        if len(candidates):
+            winners = candidates[self.resolve_conflicts(peds[candidates], targets[candidates])]
+            self.move_peds(peds[winners], targets[winners])
+            moved[winners] = True
+
+        # Everyone else steps aside to the free neighbor nearest their
+        # destination, as long as it is no further away than where they
+        # stand.
+        blocked_peds = np.flatnonzero(~moved)
+
+        if len(blocked_peds) == 0:
+            return
+
+        current = current[blocked_peds]
+        rows = rows[blocked_peds]
+        neighbors = self.neighbors[current]
+
+        valid = neighbors != self.NONE
+        safe_neighbors = np.where(valid, neighbors, 0)
+        valid &= (self.occupant[safe_neighbors] == self.NONE) & ~self.blocked[safe_neighbors]
+
+        neighbor_distances = distances[rows[:, None], safe_neighbors].astype(np.float64)
+        neighbor_distances[~valid] = np.inf
+
+        # Break ties between equally near neighbors at random.
+        neighbor_distances += self.tie_rng.random_sample(neighbor_distances.shape) * 1e-3
+
+        choice = np.argmin(neighbor_distances, axis=1)
+        best = neighbor_distances[np.arange(len(choice)), choice]
+        stepping = np.flatnonzero(best <= distances[rows, current] + 1e-3)
+
+        if len(stepping) == 0:
+            self.num_failed_moves += len(blocked_peds)
+            return
+
+        detours = safe_neighbors[stepping, choice[stepping]]
+        winners = self.resolve_conflicts(stepping, detours)
+        self.move_peds(peds[blocked_peds[stepping[winners]]], detours[winners])
+
+        self.num_failed_moves += len(blocked_peds) - len(winners)
+
+    # Opens and closes intersections, given as a list of (int_id, is_open).
+    # The nodes of all the intersections opening, and of all those closing,
+    # are each updated at once.
+    def apply_signal_changes(self, changes):
+        opening = []
+        closing = []
+
+        for int_id, is_open in changes:
+            self.intersection_open[int_id] = is_open
+
+            if is_open:
+                opening.append(self.intersection_nodes[int_id])
+            else:
+                closing.append(self.intersection_nodes[int_id])
+
+        if opening:
+            self.blocked[np.concatenate(opening)] = False
+
+        if closing:
+            self.blocked[np.concatenate(closing)] = True
+
+    # Orchestrates the simulation.
+    def run_simulation(self):
+        num_nodes = len(self.node_ids)
+
+        # Pedestrian occupying each node.
+        self.occupant = np.empty(num_nodes, dtype=np.int32)
+        self.occupant.fill(self.NONE)
+
+        # Position of each pedestrian, whether it is in the grid, and the
+        # target it is moving toward in the current sub-step.
+        self.positions = np.empty(self.num_pedestrians, dtype=np.int32)
+        self.positions.fill(self.NONE)
+        self.in_grid = np.zeros(self.num_pedestrians, dtype=bool)
+        self.target_of = np.empty(self.num_pedestrians, dtype=np.int32)
+        self.target_of.fill(self.NONE)
+
+        self.num_moves = 0
+        self.num_swaps = 0
+        self.num_failed_moves = 0
+
+        # Pedestrians enter in queue order, so their per-pedestrian outputs
+        # are indexed by their position in the queue.
+        if self.collect_pedestrians:
+            self.init_pedestrian_outputs()
+
+        max_speed = int(self.speeds.max()) if self.num_pedestrians > 0 else 0
+
+        # If visualization has been selected, initialize the plot.
+        if self.visualization:
+            self.init_viz()
+
+        # If recording has been selected, open the trajectory file.
+        trajectory = self.init_trajectory()
+
+        # Create the calendar of signal changes.
+        signals = SignalScheduler(self.signal_plans)
+
+        profiler = self.profiler
+
+        if profiler:
+            start_time = profiler.clock()
+
+        # Create a timestep counter.
+        timesteps = 0
+
+        # If we're doing additional data collection for verification purposes,
+        # initialize a list container for the data.
+        if self.verification_logging:
+            peds_entering_sim = []
+
+        while True:
+            # The current timestep, for recording when pedestrians leave.
+            self.timestep = timesteps
+
+            if self.verification_logging:
+                num_peds_entering_sim = 0
+
+            active_peds = np.flatnonzero(self.in_grid)
+            ped_queue_length = self.num_pedestrians - self.queue_head
+
+            # If our pedestrian queue is empty and we have no remaining
+            # active pedestrians, break.
+            if ped_queue_length == 0 and len(active_peds) == 0:
+                print('Finished!')
+                break
+
+            if profiler:
+                phase_start = profiler.clock()
+
+            # Add a number of pedestrians to our SUI corresponding to our
+            # computed entry rate, for as long as the entrance of the
+            # pedestrian at the head of the queue is free.
+            if ped_queue_length > 0:
+                for each_ped in range(0, next(self.arrival_counts)):
+                    if self.queue_head == self.num_pedestrians:
+                        break
+
+                    if self.verification_logging:
+                        num_peds_entering_sim += 1
+
+                    entrance = self.entrances[self.queue_head]
+
+                    if self.occupant[entrance] == self.NONE and not self.blocked[entrance]:
+                        self.positions[self.queue_head] = entrance
+                        self.occupant[entrance] = self.queue_head
+                        self.in_grid[self.queue_head] = True
+
+                        if self.collect_pedestrians:
+                            self.ped_entry[self.queue_head] = timesteps
+
+                        self.queue_head += 1
+
+                active_peds = np.flatnonzero(self.in_grid)
+
+            if profiler:
+                phase_start = profiler.add('arrivals', phase_start)
+
+            # Print the remaining pedestrians, and pedestrian queue count.
+            if timesteps % 10 == 0:
+                print('%d active peds remaining to evacuate. Ped queue count '
+                      'is %d.' % (len(active_peds),
+                                  self.num_pedestrians - self.queue_head))
+
+            if profiler:
+                phase_start = profiler.add('printing', phase_start)
+
+            # Change the state of the signalized intersections due to change
+            # this timestep.
+            changes = signals.due(timesteps)
+
+            if changes:
+                self.apply_signal_changes(changes)
+
+            if profiler:
+                phase_start = profiler.add('signals', phase_start)
+
+            # Move pedestrians one cell at a time, up to their speed.
+            for sub_step in range(max_speed):
+                movers = active_peds[(self.speeds[active_peds] > sub_step) &
+                                     self.in_grid[active_peds]]
+
+                if len(movers) == 0:
+                    break
+
+                self.step(movers)
+
+            if profiler:
+                phase_start = profiler.add('movement', phase_start)
+
+            # Record the positions of the peds still in the SUI.
+            if trajectory:
+                trajectory.record(timesteps,
+                                  self.node_ids[self.positions[np.flatnonzero(self.in_grid)]])
+
+                if profiler:
+                    phase_start = profiler.add('recording', phase_start)
+
+            # Update viz.
+            if self.visualization and timesteps % 10 == 0:
+                in_grid = self.positions[np.flatnonzero(self.in_grid)]
+                self.update_viz(self.pixx[in_grid], self.pixy[in_grid])
+
+                if profiler:
+                    profiler.add('visualization', phase_start)
+
+            # If we are doing additional verification logging, append the number
+            # of peds that entered the simulation that time step to the
+            # list.
+            if self.verification_logging and num_peds_entering_sim > 0:
+                peds_entering_sim.append(num_peds_entering_sim)
+
+            # Increment our timesteps.
+            timesteps += 1
+
+        print('Simulation completed in %d timesteps.' % timesteps)
+
+        if trajectory:
+            trajectory.close()
+
+        if profiler:
+            profiler.add('total', start_time)
+            profiler.count('moves', self.num_moves)
+            profiler.count('timesteps', timesteps)
+            profiler.count('swaps', self.num_swaps)
+            profiler.count('failed_moves', self.num_failed_moves)
+            profiler.report()
+
+        # Close the plot.
+        if self.visualization:
+            plt.close()
+
+        retval = [self.seed, timesteps]
+
+        if self.verification_logging:
+            retval.append(peds_entering_sim)
+
+        return retval
@@ -0,0 +1,234 @@
+import sys
+import os
+import getopt
+import json
+import time
+import platform
+import subprocess
+import matplotlib
+matplotlib.use('Agg')
+from map_generator import MapGenerator
+from grid import Grid
+from routing_table import RoutingTable
+from simulation import Simulation
+from array_simulation import ArraySimulation
+
+class Benchmark:
+    """
+    Measures the throughput of the simulator on generated city-block maps:
+    grid load time, preprocessing time, routing load time, and the
+    timesteps and pedestrian moves per second of each engine for several
+    crowd sizes.
+    """
+
+    TYPE_MAP = { 'sidewalk': 1, 'crosswalk': 2, 'entrance': 3, 'exit': 4 }
+
+    """
+    Creates a new Benchmark.
+
+    Args:
+      map_sizes: List. (blocks_x, blocks_y) of each map to benchmark.
+      crowd_sizes: List. Numbers of pedestrians to simulate on each map.
+      engines: List. Simulation engines to run, 'objects' and/or 'arrays'.
+      seed: Integer. Seed of every simulation.
+      work_dir: String. Directory the maps and routing tables are written to.
+      block_size: Integer. Width of each block in cells.
+      street_width: Integer. Width of each street in cells.
+
+    Returns:
+      A new Benchmark object.
+
+    """
+    def __init__(self, map_sizes, crowd_sizes, engines, seed, work_dir,
+                 block_size=10, street_width=4):
+        self.map_sizes = map_sizes
+        self.crowd_sizes = crowd_sizes
+        self.engines = engines
+        self.seed = seed
+        self.work_dir = work_dir
+        self.block_size = block_size
+        self.street_width = street_width
+
+    # Runs the benchmark on every map. Returns the results.
+    def run(self):
+        results = {
+            'commit': self.git_commit(),
+            'python': platform.python_version(),
+            'seed': self.seed,
+            'maps': [self.run_map(blocks_x, blocks_y) for blocks_x, blocks_y in self.map_sizes],
+        }
+
+        return results
+
+    # Returns the commit the benchmark is run on, if it is run in a git
+    # repository.
+    def git_commit(self):
+        code_dir = os.path.dirname(os.path.abspath(__file__))
+
+        with open(os.devnull, 'w') as devnull:
+            try:
+                return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=code_dir,
+                                               stderr=devnull).strip()
+            except (OSError, subprocess.CalledProcessError):
+                return None
+
+    # Creates a grid for the map in map_dir.
+    def create_grid(self, map_dir, routing):
+        opts = {
+            'node_file': os.path.join(map_dir, 'nodes.csv'),
+            'edge_file': os.path.join(map_dir, 'edges.csv'),
+            'intersection_file': os.path.join(map_dir, 'intersections.csv'),
+            'closed_intersections': [],
+            'type_map': self.TYPE_MAP,
+            'routing': routing,
+            # Parse the map every time, so every step pays the same cost for
+            # loading it.
+            'map_cache_dir': None,
+        }
+
+        return Grid(opts)
+
+    # Generates a map and benchmarks it. Returns its results.
+    def run_map(self, blocks_x, blocks_y):
+        map_dir = os.path.join(self.work_dir, 'map_%dx%d' % (blocks_x, blocks_y))
+        paths_file = os.path.join(map_dir, 'paths.rtab')
+
+        print('---> Benchmarking a %dx%d block map.' % (blocks_x, blocks_y))
+
+        generator = MapGenerator(blocks_x, blocks_y, self.block_size, self.street_width)
+        generator.generate().write(map_dir)
+
+        result = generator.summary()
+
+        # Time loading the graph alone.
+        start_time = time.time()
+        grid = self.quietly(self.create_grid, map_dir, 'none')
+        result['grid_load_s'] = time.time() - start_time
+
+        if os.path.exists(paths_file):
+            os.remove(paths_file)
+
+        # Time building the routing table on the loaded grid, and loading it
+        # back in, around those steps alone.
+        grid.routing = 'trees'
+        grid.new_paths_file = paths_file
+
+        start_time = time.time()
+        self.quietly(grid.set_paths)
+        result['preprocessing_s'] = time.time() - start_time
+
+        start_time = time.time()
+        self.quietly(RoutingTable.load, paths_file)
+        result['routing_load_s'] = time.time() - start_time
+
+        # Set the grid up with the table written, as a batch would.
+        self.quietly(grid.set_topology, {
+            'closed_intersections': [],
+            'routing': 'trees',
+            'paths_file': paths_file,
+        })
+
+        result['runs'] = []
+
+        for engine in self.engines:
+            for num_pedestrians in self.crowd_sizes:
+                grid.reset()
+                result['runs'].append(self.run_simulation(grid, engine, num_pedestrians))
+
+        return result
+
+    # Runs one simulation. Returns its results.
+    def run_simulation(self, grid, engine, num_pedestrians):
+        params = {
+            'num_pedestrians': num_pedestrians,
+            'seed': self.seed,
+        }
+
+        start_time = time.time()
+
+        if engine == 'arrays':
+            simulation = ArraySimulation(grid, params)
+        else:
+            simulation = Simulation(grid, params)
+
+        timesteps = self.quietly(simulation.run)[1]
+        elapsed = time.time() - start_time
+
+        print('%-8s %7d peds: %6d timesteps in %8.2f s, %10.0f timesteps/s, %10.0f moves/s'
+              % (engine, num_pedestrians, timesteps, elapsed, timesteps / elapsed,
+                 simulation.num_moves / elapsed))
+
+        return {
+            'engine': engine,
+            'num_pedestrians': num_pedestrians,
+            'timesteps': timesteps,
+            'moves': simulation.num_moves,
+            'wall_s': elapsed,
+            'timesteps_per_s': timesteps / elapsed,
+            'moves_per_s': simulation.num_moves / elapsed,
+        }
+
+    # Calls a function with its printed output discarded, so printing
+    # doesn't count toward the time measured. Returns what it returns.
+    def quietly(self, function, *args):
+        stdout = sys.stdout
+
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+
+            try:
+                return function(*args)
+            finally:
+                sys.stdout = stdout
+
+# Parses a comma separated list of map sizes such as '4x4,8x6'.
+def parse_map_sizes(arg):
+    return [tuple(int(n) for n in size.split('x')) for size in arg.split(',')]
+
+def main(argv):
+    map_sizes = [(4, 4), (8, 8), (16, 16)]
+    crowd_sizes = [500, 2000]
+    engines = ['objects', 'arrays']
+    seed = 1
+    work_dir = './benchmark_maps'
+    output_file = None
+
+    help_message = ('benchmark.py -m <mapSizes, e.g. 4x4,8x8> -p <crowdSizes, e.g. 500,2000> '
+                    '-e <engines, e.g. objects,arrays> -s <int seed> '
+                    '-d <workDirectory> -o <jsonOutputFile>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'hm:p:e:s:d:o:',['help', 'maps=', 'peds=',
+                                                       'engines=', 'seed=', 'dir=',
+                                                       'output='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-m', '--maps'):
+            map_sizes = parse_map_sizes(arg)
+        elif opt in ('-p', '--peds'):
+            crowd_sizes = [int(n) for n in arg.split(',')]
+        elif opt in ('-e', '--engines'):
+            engines = arg.split(',')
+        elif opt in ('-s', '--seed'):
+            seed = int(arg)
+        elif opt in ('-d', '--dir'):
+            work_dir = arg
+        elif opt in ('-o', '--output'):
+            output_file = arg
+
+    results = Benchmark(map_sizes, crowd_sizes, engines, seed, work_dir).run()
+
+    if output_file:
+        with open(output_file, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
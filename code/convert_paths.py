@@ -0,0 +1,68 @@
+import sys
+import getopt
+from node_reader import NodeReader
+from edge_reader import EdgeReader
+from routing_table import RoutingTable
+
+# Converts a pickle paths file into a binary routing table.
+def convert(paths_file, table_file, node_file, edge_file):
+    node_ids = NodeReader(node_file).node_dict.keys()
+
+    # Build an undirected neighbors dict, for looking up edge weights along
+    # stored paths.
+    neighbors_dict = dict((node_id, {}) for node_id in node_ids)
+
+    for edge in EdgeReader(edge_file).edges:
+        if edge.node_a in neighbors_dict and edge.node_b in neighbors_dict:
+            neighbors_dict[edge.node_a][edge.node_b] = edge.weight
+            neighbors_dict[edge.node_b][edge.node_a] = edge.weight
+
+    table = RoutingTable.from_pickle(paths_file, node_ids, neighbors_dict)
+    table.save(table_file)
+
+    print('---> Wrote routing table for %d nodes and %d destinations to %s.'
+          % (len(table.node_ids), len(table.destination_ids), table_file))
+
+def main(argv):
+    paths_file = None
+    table_file = None
+    node_file = './map/nodes.csv'
+    edge_file = './map/edges.csv'
+
+    help_message = ('convert_paths.py -f <pickle pathsFile> -o <rtab outputFile> '
+                    '-n <nodesCsv> -e <edgesCsv>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'hf:o:n:e:',['help', 'pfile=', 'output=',
+                                                    'nodes=', 'edges='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-f', '--pfile'):
+            paths_file = arg
+        elif opt in ('-o', '--output'):
+            table_file = arg
+        elif opt in ('-n', '--nodes'):
+            node_file = arg
+        elif opt in ('-e', '--edges'):
+            edge_file = arg
+
+    if paths_file == None or table_file == None:
+        print(help_message)
+        sys.exit(2)
+
+    if not RoutingTable.is_table_file(table_file):
+        print('output file must end in .rtab')
+        sys.exit(2)
+
+    convert(paths_file, table_file, node_file, edge_file)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
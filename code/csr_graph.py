@@ -0,0 +1,288 @@
+import heapq
+import itertools
+import numpy as np
+
+class CSRGraph(object):
+    """
+    Compressed sparse row (CSR) adjacency for the pedestrian graph. The
+    neighbors of the node with dense index i are indices[indptr[i]:indptr[i+1]],
+    with edge weights at the same positions in weights. Dense indexes are
+    positions in the sorted node_ids array.
+    """
+
+
+    """
+    Creates a new CSRGraph.
+
+    Args:
+      node_ids: Array. Sorted node_ids of every node in the graph.
+      indptr: Array. Offsets into indices and weights for each node, with one
+        extra entry at the end.
+      indices: Array. Dense indexes of each node's neighbors.
+      weights: Array. Weight of each edge.
+
+    Returns:
+      A new CSRGraph object.
+
+    """
+    def __init__(self, node_ids, indptr, indices, weights):
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    # Number of nodes in the graph.
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    # Returns the dense index of a node_id, or -1 if it isn't in the graph.
+    def index_of(self, node_id):
+        indx = int(np.searchsorted(self.node_ids, node_id))
+
+        if indx < len(self.node_ids) and self.node_ids[indx] == node_id:
+            return indx
+
+        return -1
+
+    # Returns the dense indexes of the neighbors of the node with the given
+    # dense index, and the weights of the edges to them.
+    def neighbors_of(self, indx):
+        start, end = self.indptr[indx], self.indptr[indx+1]
+
+        return self.indices[start:end], self.weights[start:end]
+
+    # Returns the degree of every node.
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    # Returns the neighbors of every node as a dense matrix with one row per
+    # node, padded with -1.
+    def padded_neighbors(self):
+        degrees = self.degrees()
+        padded = np.empty((self.num_nodes(), max(int(degrees.max()) if len(degrees) else 0, 1)),
+                          dtype=np.int32)
+        padded.fill(-1)
+
+        # Column of each entry within its row.
+        rows = np.repeat(np.arange(self.num_nodes()), degrees)
+        columns = np.arange(len(self.indices)) - np.repeat(self.indptr[:-1], degrees)
+        padded[rows, columns] = self.indices
+
+        return padded
+
+    # Returns the subgraph of the nodes for which the given boolean mask,
+    # indexed by dense index, is true, leaving out every edge to or from the
+    # other nodes. The graph itself is returned if the mask keeps every node.
+    def masked(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+
+        if mask.all():
+            return self
+
+        # Keep the edges whose ends are both kept.
+        rows = np.repeat(np.arange(self.num_nodes()), self.degrees())
+        kept = mask[rows] & mask[self.indices]
+
+        degrees = np.bincount(rows[kept], minlength=self.num_nodes())[mask]
+        indptr = np.zeros(len(degrees) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+
+        # Dense index of each kept node in the subgraph.
+        new_indexes = (np.cumsum(mask) - 1).astype(np.int32)
+
+        return CSRGraph(self.node_ids[mask], indptr, new_indexes[self.indices[kept]],
+                        self.weights[kept])
+
+    # Runs Dijkstra's algorithm from the node with the given dense index over
+    # the whole graph. Returns lists of distances (inf if unreachable) and
+    # predecessors (-1 if none), indexed by dense index.
+    def dijkstra(self, source):
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        weights = self.weights.tolist()
+
+        distances = [float('inf')] * self.num_nodes()
+        predecessors = [-1] * self.num_nodes()
+        done = [False] * self.num_nodes()
+
+        distances[source] = 0.0
+        heap = [(0.0, source)]
+
+        while heap:
+            distance, v = heapq.heappop(heap)
+
+            if done[v]:
+                continue
+
+            done[v] = True
+
+            for k in range(indptr[v], indptr[v+1]):
+                w = indices[k]
+                vw_distance = distance + weights[k]
+
+                if vw_distance < distances[w]:
+                    distances[w] = vw_distance
+                    predecessors[w] = v
+                    heapq.heappush(heap, (vw_distance, w))
+
+        return distances, predecessors
+
+    # Writes the graph to a file in NumPy's .npz format.
+    def save(self, filename):
+        np.savez(filename, node_ids=self.node_ids, indptr=self.indptr,
+                 indices=self.indices, weights=self.weights)
+
+    # Reads a graph written by save.
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+
+        return cls(data['node_ids'], data['indptr'], data['indices'], data['weights'])
+
+    # Builds a graph from a neighbors dict, in the format used by
+    # ShortestPath.
+    @classmethod
+    def from_neighbors(cls, neighbors_dict):
+        node_ids = np.array(sorted(neighbors_dict), dtype=np.int32)
+
+        degrees = np.array([len(neighbors_dict[node_id]) for node_id in node_ids.tolist()],
+                           dtype=np.int64)
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+
+        neighbor_ids = np.empty(int(indptr[-1]), dtype=np.int32)
+        weights = np.empty(int(indptr[-1]), dtype=np.float32)
+
+        for indx, node_id in enumerate(node_ids.tolist()):
+            neighbors = neighbors_dict[node_id]
+            start, end = indptr[indx], indptr[indx+1]
+            neighbor_ids[start:end] = neighbors.keys()
+            weights[start:end] = neighbors.values()
+
+        indices = np.searchsorted(node_ids, neighbor_ids).astype(np.int32)
+
+        return cls(node_ids, indptr, indices, weights)
+
+class Adjacency(object):
+    """
+    A read-only view of a CSRGraph whose dense indexes are node_ids, in the
+    format of a neighbors dict: adjacency[node_id] gives the neighbors of a
+    node, with the weights of the edges to them. It stands in for one dict per
+    node, which take far more memory on large maps. Neighbors are listed in
+    the order of the graph's rows.
+
+    The edges are kept as one list of (neighbor node_id, weight) pairs, in
+    row order, so a search can walk a node's row as a plain list slice. Each
+    node_id and each distinct weight is a single shared object.
+    """
+
+
+    """
+    Creates a new Adjacency.
+
+    Args:
+      csr: CSRGraph. Graph whose node_ids are 0 to num_nodes - 1.
+      weights: Array. Optional weight of each edge, in place of the graph's
+        own float32 weights, such as the weights as read from the map.
+
+    Returns:
+      A new Adjacency object.
+
+    """
+    def __init__(self, csr, weights=None):
+        self.indptr = np.asarray(csr.indptr).tolist()
+
+        node_ids = range(len(self.indptr) - 1)
+        distinct_weights = {}
+
+        self.edges = [(node_ids[w], distinct_weights.setdefault(weight, weight))
+                      for w, weight in itertools.izip(
+                          np.asarray(csr.indices).tolist(),
+                          np.asarray(csr.weights if weights is None else weights).tolist())]
+
+    # Returns the neighbors of a node_id.
+    def __getitem__(self, node_id):
+        if not 0 <= node_id < len(self):
+            raise KeyError(node_id)
+
+        return Neighbors(self.edges[self.indptr[node_id]:self.indptr[node_id+1]])
+
+    # Returns the (neighbor node_id, weight) pairs of a node_id, as a list.
+    def row(self, node_id):
+        return self.edges[self.indptr[node_id]:self.indptr[node_id+1]]
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __contains__(self, node_id):
+        return 0 <= node_id < len(self)
+
+    def __iter__(self):
+        return iter(xrange(len(self)))
+
+    # Returns every node_id.
+    def keys(self):
+        return range(len(self))
+
+class Neighbors(object):
+    """
+    The neighbors of one node and the weights of the edges to them, with the
+    read-only interface of a dict of neighbor node_id -> weight.
+    """
+
+    __slots__ = ('pairs',)
+
+
+    """
+    Creates a new Neighbors.
+
+    Args:
+      pairs: List. (node_id, weight) pair of each neighbor.
+
+    Returns:
+      A new Neighbors object.
+
+    """
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    # Returns the weight of the edge to a neighbor.
+    def __getitem__(self, node_id):
+        for neighbor_id, weight in self.pairs:
+            if neighbor_id == node_id:
+                return weight
+
+        raise KeyError(node_id)
+
+    # Returns the weight of the edge to a neighbor, or default if it isn't
+    # one.
+    def get(self, node_id, default=None):
+        try:
+            return self[node_id]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __contains__(self, node_id):
+        return any(neighbor_id == node_id for neighbor_id, weight in self.pairs)
+
+    def __iter__(self):
+        return iter([neighbor_id for neighbor_id, weight in self.pairs])
+
+    # Returns the neighbor node_ids.
+    def keys(self):
+        return [neighbor_id for neighbor_id, weight in self.pairs]
+
+    # Returns the weights of the edges to the neighbors.
+    def values(self):
+        return [weight for neighbor_id, weight in self.pairs]
+
+    # Returns (node_id, weight) pairs.
+    def items(self):
+        return list(self.pairs)
+
+    # Iterates over (node_id, weight) pairs.
+    def iteritems(self):
+        return iter(self.pairs)
@@ -1,7 +1,13 @@
+import numpy as np
+
 class CustomRandom():
     """
     Implements a custom random number generator for use in simulation.
     Uses the Lehmer pseudorandom number generator.
+
+    Besides drawing one number at a time, it can draw a batch of numbers as
+    a NumPy array, equal to the same number of single draws, and can jump
+    ahead in its sequence to hand out non-overlapping substreams.
     """
 
 
@@ -11,6 +17,13 @@ class CustomRandom():
     Q = 44488
     R = 3399
 
+    # Number of draws in each substream.
+    SUBSTREAM_LENGTH = 2**22
+
+    # Powers A^1, A^2, ... (mod M), shared by every generator and extended as
+    # larger batches are drawn.
+    powers = np.array([A], dtype=np.int64)
+
     """
     Creates a new CustomRandom object.
 
@@ -24,6 +37,27 @@ class CustomRandom():
     def __init__(self, seed):
         self.seed = seed
 
+    # Returns A^1 ... A^n (mod M) as an int64 array. Products of two numbers
+    # below M fit in an int64, so the powers are exact.
+    @classmethod
+    def powers_of_a(cls, n):
+        powers = cls.powers
+
+        if len(powers) < n:
+            extended = np.empty(n, dtype=np.int64)
+            filled = len(powers)
+            extended[:filled] = powers
+
+            # A^(filled+j+1) = A^(j+1) * A^filled.
+            while filled < n:
+                count = min(filled, n - filled)
+                extended[filled:filled+count] = extended[:count] * extended[filled-1] % cls.M
+                filled += count
+
+            cls.powers = powers = extended
+
+        return powers[:n]
+
     # Generates a pseudorandom number using Lehmer's algorithm.
     def next(self):
         rand = self.A * (self.seed % self.Q) - self.R * (self.seed / self.Q)
@@ -43,4 +77,60 @@ class CustomRandom():
     # Generates an uniformly distributed integer random number in the range
     # (min, max).
     def random_in_range(self, min, max):
-        return min + int(self.uniform_random() * ((max - min) + 1))
\ No newline at end of file
+        return min + int(self.uniform_random() * ((max - min) + 1))
+
+    # Generates the next n pseudorandom numbers as an int64 array, equal to
+    # n calls to next(). The seed must be in the range [1, M-1].
+    def next_batch(self, n):
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+
+        values = np.int64(self.seed) * self.powers_of_a(n) % self.M
+        self.seed = int(values[-1])
+
+        return values
+
+    # Generates n uniformly distributed floating point random numbers in the
+    # range (0,1) as an array, equal to n calls to uniform_random().
+    def uniform_batch(self, n):
+        return self.next_batch(n) / float(self.M)
+
+    # Generates n uniformly distributed integer random numbers in the range
+    # (min, max) as an array, equal to n calls to random_in_range().
+    def random_in_range_batch(self, min, max, n):
+        return min + (self.uniform_batch(n) * ((max - min) + 1)).astype(np.int64)
+
+    # Advances the generator by n draws without generating them.
+    def jump(self, n):
+        self.seed = self.seed * pow(self.A, n, self.M) % self.M
+
+    # Returns the number of substreams of the default length that fit in the
+    # period of the generator.
+    @classmethod
+    def num_substreams(cls):
+        return (cls.M - 1) // cls.SUBSTREAM_LENGTH
+
+    # Returns a new generator for the given substream: the part of this
+    # generator's sequence starting index * length draws ahead. Substreams
+    # with different indexes don't overlap as long as each takes no more
+    # than length draws.
+    def substream(self, index, length = None):
+        if length == None:
+            length = self.SUBSTREAM_LENGTH
+
+        # The sequence repeats after M-1 draws.
+        if (index + 1) * length > self.M - 1:
+            raise ValueError('Substream %d of length %d runs past the period '
+                             'of the generator.' % (index, length))
+
+        generator = CustomRandom(self.seed)
+        generator.jump(index * length)
+
+        return generator
+
+    # Returns the antithetic generator of this one, whose numbers are M minus
+    # this generator's, so its uniform draws are 1 minus this one's. Since
+    # M - x follows the same recurrence as x, it is just the generator seeded
+    # with M - seed, and its substreams are the antithetic substreams.
+    def antithetic(self):
+        return CustomRandom(self.M - self.seed)
@@ -1,105 +1,382 @@
 from custom_random import CustomRandom
 import numpy as np
 import sys
-# Import Python's random number generator, only for generating seeds for our
-# own custom generator.
+import getopt
+import json
+import math
+import time
+import multiprocessing
+# Import Python's random number generator, only for generating a master seed
+# for our own custom generator.
 import random
 
 class CustomRandomTest():
     """
     Tests a custom random number generator for use in simulation.
+
+    Each iteration draws a sample from its own substream of the generator and
+    runs every test on it: the chi-square test of uniformity, the serial test
+    on non-overlapping pairs, the runs up and down test, the gap test and the
+    spectral (discrete Fourier transform) test. Each test fails an iteration
+    with probability alpha when the generator is good, so the generator fails
+    the suite if a test's failure rate strays too far from alpha. Iterations
+    are spread over a pool of worker processes, with whole blocks of samples
+    drawn and tested at once.
     """
 
     # Use K bins.
     K = 100
 
+    # Use D x D cells for the serial test.
+    D = 10
+
+    # The gap test counts gaps between numbers in [0, GAP_BETA), grouping
+    # gaps of GAP_CATEGORIES-1 or more together.
+    GAP_BETA = 0.5
+    GAP_CATEGORIES = 6
+
+    # Number of iterations each worker runs at a time.
+    BLOCK_SIZE = 500
+
+    TESTS = ['chi_square', 'serial', 'runs', 'gap', 'spectral']
+
     """
     Creates a new CustomRandomTest object.
 
     Args:
-      num_iterations: Number of iterations to perform the chi-square test.
-      n_samples: Number of random number samples to collect.
-      critical_value: The chi-square critical value to test against.
+      num_iterations: Number of iterations to perform the tests.
+      n_samples: Number of random number samples to collect in each iteration.
+      alpha: Significance level of each test.
+      seed: Master seed. Iteration i uses substream i of a generator seeded
+        with it.
+      workers: Number of worker processes.
 
     Returns:
       A new CustomRandomTest object.
 
     """
-    def __init__(self, num_iterations, n_samples, critical_value):
+    def __init__(self, num_iterations, n_samples, alpha, seed, workers):
         self.num_iterations = num_iterations
         self.n_samples = n_samples
-        self.critical_value = critical_value
-        self.samples = []
+        self.alpha = alpha
+        self.seed = seed
+        self.workers = workers
+
+        # Critical values of each test. Statistics above them fail.
+        z = normal_quantile(1 - alpha / 2.0)
 
-    # Perform all tests.
+        self.critical_values = {
+            'chi_square': chi_square_critical_value(self.K - 1, alpha),
+            'serial': chi_square_critical_value(self.D**2 - 1, alpha),
+            'runs': z,
+            'gap': chi_square_critical_value(self.GAP_CATEGORIES - 1, alpha),
+            'spectral': z,
+        }
+
+    # Perform all tests. Returns the results.
     def test(self):
-        print(("Starting tests. Performing %d iterations, please bear with "
-               "us.") % self.num_iterations)
+        print(("Starting tests. Performing %d iterations on %d workers, please "
+               "bear with us.") % (self.num_iterations, self.workers))
 
-        self.perform_tests()
+        return self.perform_tests()
 
     def perform_tests(self):
-        # Initialize a container for our failure count.
-        failure_count = 0
+        start_time = time.time()
+
+        blocks = [(self, first, min(self.BLOCK_SIZE, self.num_iterations - first))
+                  for first in range(0, self.num_iterations, self.BLOCK_SIZE)]
 
-        # Compute the expected value for each bin.
-        e_i = self.n_samples / float(self.K)
+        failures = dict((name, 0) for name in self.TESTS)
+        test_seconds = dict((name, 0.0) for name in self.TESTS)
+        generator_seconds = 0.0
 
-        # For the number of iterations we've been given,
-        for i in range(self.num_iterations):
-            # Generate a histogram, segmented into K bins, containing frequencies
-            # of random numbers generated with our random number generator.
-            self.generate_histogram()
+        if self.workers > 1:
+            pool = multiprocessing.Pool(self.workers)
 
-            # Initialize a container for our chi-square value.
-            score = 0
+            try:
+                block_results = pool.imap_unordered(run_block, blocks)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+        else:
+            pool = None
+            block_results = (run_block(block) for block in blocks)
 
-            # Compute the chi-square value.
-            for frequency in self.hist:
-                score += (((frequency - e_i)**2)/e_i)
+        try:
+            for i, (block_failures, block_seconds, block_generator_seconds) in enumerate(block_results):
+                for name in self.TESTS:
+                    failures[name] += block_failures[name]
+                    test_seconds[name] += block_seconds[name]
 
-            # If our chi-square value exceeds the critical value specified,
-            if score > self.critical_value:
-                # Increment the failure count.
-                failure_count += 1
+                generator_seconds += block_generator_seconds
 
-            if i > 0 and i % 1000 == 0:
-                print("---> Finished with iteration %d." % i)
+                if (i + 1) % 20 == 0:
+                    print("---> Finished with %d of %d blocks." % (i + 1, len(blocks)))
+        finally:
+            if pool:
+                pool.join()
 
-        # Prepare a total failure percentage.
-        total_failure = (failure_count/float(self.num_iterations))*100
+        elapsed = time.time() - start_time
+
+        # A test's failure count is binomial, with probability alpha for a
+        # good generator. Allow four standard deviations either way.
+        tolerance = 4 * math.sqrt(self.alpha * (1 - self.alpha) / self.num_iterations)
+
+        results = {
+            'num_iterations': self.num_iterations,
+            'n_samples': self.n_samples,
+            'alpha': self.alpha,
+            'seed': self.seed,
+            'workers': self.workers,
+            'elapsed_s': elapsed,
+            'samples_per_s': self.num_iterations * self.n_samples / generator_seconds,
+            'tests': {},
+        }
+
+        for name in self.TESTS:
+            failure_rate = failures[name] / float(self.num_iterations)
+
+            results['tests'][name] = {
+                'critical_value': self.critical_values[name],
+                'failures': failures[name],
+                'failure_rate': failure_rate,
+                'passed': abs(failure_rate - self.alpha) <= tolerance,
+                'cpu_s': test_seconds[name],
+            }
+
+        results['passed'] = all(res['passed'] for res in results['tests'].values())
 
         # Print the result to the user.
-        print(("In %d tests, the random number generator failed to pass the "
-               "chi-square test %.2f%% of the time.") % (self.num_iterations, total_failure))
+        for name in self.TESTS:
+            res = results['tests'][name]
+            print(("%-10s failed %6.2f%% of %d iterations (expected %.2f%%). %s")
+                  % (name, 100 * res['failure_rate'], self.num_iterations,
+                     100 * self.alpha, 'PASS' if res['passed'] else 'FAIL'))
 
-    def generate_histogram(self):
-        # Generate a seed for our generator using Python's random number
-        # generator.
-        seed = random.randrange(1, 2**31-1)
-        # Initialize our random number generator.
-        generator = CustomRandom(seed)
+        print("Generated %.0f samples/s. Finished in %.1f s."
+              % (results['samples_per_s'], elapsed))
 
-        # Clear the samples list.
-        self.samples = []
+        return results
 
-        # Generate n_samples of a random number using our custom generator.
-        self.samples.extend([generator.uniform_random() for i in range(self.n_samples)])
+    # Draws the samples of a block of iterations: one row per iteration.
+    # Iteration i takes n_samples draws starting at substream i of the
+    # master generator, so the rows of a block are one batch of draws.
+    def generate_samples(self, first, count):
+        generator = CustomRandom(self.seed).substream(first, self.n_samples)
 
-        # Prepare a histogram of the bin counts.
-        self.hist = np.histogram(self.samples, bins=self.K)[0]
+        return generator.uniform_batch(count * self.n_samples).reshape(count, self.n_samples)
 
-if __name__ == '__main__':
-    # Perform the test 100,000 times.
+    # Counts the values in each row of a 2D array of integers in [0, bins),
+    # returning a (rows, bins) array.
+    def count_rows(self, values, bins):
+        rows = values.shape[0]
+        offsets = np.arange(rows)[:, np.newaxis] * bins
+
+        return np.bincount((values + offsets).ravel(), minlength=rows * bins).reshape(rows, bins)
+
+    # Counts values in [0, bins) belonging to the given rows, returning a
+    # (num_rows, bins) array.
+    def count_rows_from(self, rows, values, num_rows, bins):
+        return np.bincount(rows * bins + values, minlength=num_rows * bins).reshape(num_rows, bins)
+
+    # Chi-square statistic of each row of observed counts against the
+    # expected counts.
+    def chi_square(self, observed, expected):
+        return (((observed - expected)**2) / expected).sum(axis=1)
+
+    # Chi-square test of uniformity over K equal bins.
+    def chi_square_test(self, samples):
+        hist = self.count_rows((samples * self.K).astype(np.int64), self.K)
+
+        return self.chi_square(hist, self.n_samples / float(self.K))
+
+    # Serial test: chi-square test of uniformity of non-overlapping pairs of
+    # samples over D x D cells.
+    def serial_test(self, samples):
+        num_pairs = self.n_samples // 2
+        cells = (samples[:, :2 * num_pairs] * self.D).astype(np.int64)
+        pair_cells = cells[:, 0::2] * self.D + cells[:, 1::2]
+        hist = self.count_rows(pair_cells, self.D**2)
+
+        return self.chi_square(hist, num_pairs / float(self.D**2))
+
+    # Runs up and down test: the absolute z-score of the number of runs of
+    # increasing and decreasing samples.
+    def runs_test(self, samples):
+        n = self.n_samples
+        increasing = np.diff(samples, axis=1) > 0
+        runs = 1 + (increasing[:, 1:] != increasing[:, :-1]).sum(axis=1)
+
+        mean = (2 * n - 1) / 3.0
+        variance = (16 * n - 29) / 90.0
+
+        return np.abs(runs - mean) / math.sqrt(variance)
+
+    # Gap test: chi-square test of the lengths of the gaps between samples
+    # falling in [0, GAP_BETA), which are geometrically distributed.
+    def gap_test(self, samples):
+        count, n = samples.shape
+        last = self.GAP_CATEGORIES - 1
+
+        # Positions of the samples in the interval, across the whole block.
+        positions = np.flatnonzero(samples < self.GAP_BETA)
+        rows = positions // n
+
+        # Gaps between consecutive samples in the interval in the same row.
+        same_row = rows[1:] == rows[:-1]
+        gaps = np.minimum(np.diff(positions) - 1, last)[same_row]
+        hist = self.count_rows_from(rows[1:][same_row], gaps, count, self.GAP_CATEGORIES)
+
+        # Probability of each gap length, with the last category holding
+        # every gap of that length or more.
+        p = self.GAP_BETA
+        probabilities = np.array([p * (1 - p)**k for k in range(last)] + [(1 - p)**last])
+        expected = hist.sum(axis=1)[:, np.newaxis] * probabilities
+
+        return self.chi_square(hist, np.maximum(expected, 1e-12))
+
+    # Spectral test (NIST SP 800-22): the absolute z-score of the number of
+    # peaks in the discrete Fourier transform of the sample signs that fall
+    # below the 95% threshold. The number of peaks is discrete, and only
+    # fails good generators close to alpha of the time for power of two
+    # lengths, so the test uses the largest power of two samples available.
+    def spectral_test(self, samples):
+        n = 2**int(math.log(self.n_samples, 2))
+        samples = samples[:, :n]
+        signs = np.where(samples < 0.5, -1.0, 1.0)
+        magnitudes = np.abs(np.fft.fft(signs, axis=1)[:, :n // 2])
+
+        threshold = math.sqrt(math.log(1 / 0.05) * n)
+        expected = 0.95 * n / 2.0
+        below = (magnitudes < threshold).sum(axis=1)
+
+        return np.abs(below - expected) / math.sqrt(n * 0.95 * 0.05 / 4)
+
+# The test procedure run in each worker process.
+def run_block(block):
+    tester, first, count = block
+
+    start_time = time.time()
+    samples = tester.generate_samples(first, count)
+    generator_seconds = time.time() - start_time
+
+    failures = {}
+    seconds = {}
+
+    for name in tester.TESTS:
+        start_time = time.time()
+        statistics = getattr(tester, name + '_test')(samples)
+        seconds[name] = time.time() - start_time
+        failures[name] = int((statistics > tester.critical_values[name]).sum())
+
+    return failures, seconds, generator_seconds
+
+# Returns the p-quantile of the standard normal distribution, by bisection.
+def normal_quantile(p):
+    low, high = -10.0, 10.0
+
+    for i in range(100):
+        middle = (low + high) / 2
+
+        if 0.5 * math.erfc(-middle / math.sqrt(2)) < p:
+            low = middle
+        else:
+            high = middle
+
+    return (low + high) / 2
+
+# Returns the chi-square critical value for the given degrees of freedom and
+# significance level, using the Wilson-Hilferty approximation.
+def chi_square_critical_value(dof, alpha):
+    z = normal_quantile(1 - alpha)
+    c = 2.0 / (9 * dof)
+
+    return dof * (1 - c + z * math.sqrt(c))**3
+
+def main(argv):
+    # Perform the tests 100,000 times.
     num_iterations = 100000
 
     # For each test, grab 1000 samples from our RNG.
     n_samples = 1000
 
-    # The chi-square critical value for 99 degrees of freedom and a p-value of
-    # 0.05.
-    critical_value = 123.225
+    # Significance level of each test.
+    alpha = 0.05
+
+    seed = None
+    workers = multiprocessing.cpu_count()
+    output_file = None
+    baseline_file = None
+
+    # Fail if the generator is this much slower than in the baseline.
+    speed_tolerance = 0.5
+
+    help_message = ('custom_random_test.py -i <int iterations> -n <int samples> '
+                    '-a <float alpha> -s <int seed> -w <int workers> '
+                    '-o <jsonOutputFile> -b <jsonBaselineFile> '
+                    '-t <float speedTolerance>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'hi:n:a:s:w:o:b:t:',['help', 'iterations=',
+                                                           'samples=', 'alpha=', 'seed=',
+                                                           'workers=', 'output=',
+                                                           'baseline=', 'tolerance='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-i', '--iterations'):
+            num_iterations = int(arg)
+        elif opt in ('-n', '--samples'):
+            n_samples = int(arg)
+        elif opt in ('-a', '--alpha'):
+            alpha = float(arg)
+        elif opt in ('-s', '--seed'):
+            seed = int(arg)
+        elif opt in ('-w', '--workers'):
+            workers = int(arg)
+        elif opt in ('-o', '--output'):
+            output_file = arg
+        elif opt in ('-b', '--baseline'):
+            baseline_file = arg
+        elif opt in ('-t', '--tolerance'):
+            speed_tolerance = float(arg)
+
+    if seed == None:
+        seed = random.randrange(1, 2**31-1)
 
     # Test.
-    tester = CustomRandomTest(num_iterations, n_samples, critical_value)
-    tester.test()
\ No newline at end of file
+    tester = CustomRandomTest(num_iterations, n_samples, alpha, seed, workers)
+    results = tester.test()
+
+    # Compare the generator's speed with a previous run.
+    if baseline_file:
+        with open(baseline_file) as infile:
+            baseline = json.load(infile)
+
+        min_speed = baseline['samples_per_s'] * (1 - speed_tolerance)
+        results['baseline_samples_per_s'] = baseline['samples_per_s']
+        results['speed_passed'] = results['samples_per_s'] >= min_speed
+
+        if not results['speed_passed']:
+            print("Generator speed regressed: %.0f samples/s against %.0f in the baseline."
+                  % (results['samples_per_s'], baseline['samples_per_s']))
+
+        results['passed'] = results['passed'] and results['speed_passed']
+
+    if output_file:
+        with open(output_file, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if not results['passed']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+import array
+import sys
+
+class DetourCache(object):
+    """
+    A bounded cache of the detour paths found when pedestrians are blocked,
+    shared by every node in the grid. Once the cached paths take up more than
+    the memory cap, the least recently used ones are evicted.
+    """
+
+    # Approximate bytes used by each entry on top of its path array: the key
+    # tuple and the cache's own bookkeeping.
+    ENTRY_OVERHEAD = 200
+
+    """
+    Creates a new DetourCache.
+
+    Args:
+      find_path: Function. Called with (start node_id, end node_id) to find a
+        path on a cache miss.
+      max_bytes: Integer. Approximate memory cap for the cached paths.
+
+    Returns:
+      A new DetourCache object.
+
+    """
+    def __init__(self, find_path, max_bytes):
+        self.find_path = find_path
+        self.max_bytes = max_bytes
+
+        # Paths keyed by (start, end), least recently used first.
+        self.paths = OrderedDict()
+        self.size_bytes = 0
+
+        self.reset_stats()
+
+    # Clears the hit, miss and eviction counters.
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Drops every cached path, for when the paths of the grid change.
+    def clear(self):
+        self.paths.clear()
+        self.size_bytes = 0
+
+    # Returns the shortest path from start to end as an array of node_ids,
+    # from the cache if possible. Paths are stored as arrays so that their
+    # size, node_ids included, is measured exactly.
+    def get(self, start, end):
+        key = (start, end)
+        path = self.paths.pop(key, None)
+
+        if path is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            path = array.array('i', self.find_path(start, end))
+            self.size_bytes += self.entry_size(path)
+
+        # (Re)insert the path as the most recently used.
+        self.paths[key] = path
+
+        # Evict the least recently used paths until we are under the cap,
+        # always keeping the path just used.
+        while self.size_bytes > self.max_bytes and len(self.paths) > 1:
+            old_key, old_path = self.paths.popitem(last=False)
+            self.size_bytes -= self.entry_size(old_path)
+            self.evictions += 1
+
+        return path
+
+    # Approximate memory used by a cache entry.
+    def entry_size(self, path):
+        return sys.getsizeof(path) + self.ENTRY_OVERHEAD
+
+    # Returns the counters and current size of the cache.
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.paths),
+            'size_bytes': self.size_bytes,
+        }
+
+    # Prints the counters and current size of the cache.
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = (100.0 * self.hits / lookups) if lookups else 0.0
+
+        print('Detour cache: %d hits, %d misses (%.1f%% hit rate), %d evictions. '
+              '%d paths cached in %.1f of %.1f MB.'
+              % (self.hits, self.misses, hit_rate, self.evictions, len(self.paths),
+                 self.size_bytes / float(2**20), self.max_bytes / float(2**20)))
@@ -1,6 +1,8 @@
-class Edge:
+class Edge(object):
     """ Implementation of the edge structure in our graph. """
 
+    __slots__ = ('node_a', 'node_b', 'weight')
+
 
     """
     Creates a new edge.
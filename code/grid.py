@@ -1,14 +1,25 @@
-from node_reader import NodeReader
-from edge_reader import EdgeReader
-from intersection_reader import IntersectionReader
+from node import Node
+from intersection import Intersection
+from map_data import MapData
 from printer import Printer
 from shortest_path import ShortestPath
+from shortest_path_tree import ShortestPathTree
+from routing_table import RoutingTable
+from paths_file import PathsFile
+from csr_graph import CSRGraph, Adjacency
+from detour_cache import DetourCache
 
-import pickle
+import itertools
+import time
+import numpy as np
 
 class Grid:
     """
     Builds a grid used for translating the graph into a meaningful 2D arrangement.
+
+    The map is loaded once, with every node and edge in it. Closed
+    intersections are masked out of it rather than removed, so the same grid
+    can be set up for any set of closed intersections with set_topology.
     """
 
 
@@ -16,130 +27,410 @@ class Grid:
         # Save some important attributes.
         self.node_file = params['node_file']
         self.intersection_file = params['intersection_file']
-        self.closed_intersections = params['closed_intersections']
         self.edge_file = params['edge_file']
         self.type_map = params['type_map']
-        self.paths_file = params.get('paths_file', None)
-        self.new_paths_file = params.get('new_paths_file', None)
+
+        # Memory cap, in bytes, for detour paths found during simulations.
+        self.detour_cache_bytes = params.get('detour_cache_bytes', 64 * 2**20)
+
+        # State recorded by snapshot, restored by reset.
+        self.saved_available = []
+        self.saved_intersections = []
+
+        # Directory of the binary grid cache for the map files, or None not to
+        # use one. By default, it is kept next to the map files.
+        self.map_cache_dir = params.get('map_cache_dir',
+                                        MapData.cache_dir_for(self.node_file, self.edge_file,
+                                                              self.intersection_file))
 
         # Perform initialization of the gridspace.
+        self.load_map()
         self.initialize_nodes()
         self.initialize_intersections()
         self.initialize_edges()
+
+        # Cache the map's arrays, along with its adjacency, for the next run.
+        if self.map_cache_dir and not self.map_data.cached:
+            self.map_data.save(self.map_cache_dir)
+
+        # Detour paths are shared by every node, and kept across simulations
+        # on this grid.
+        self.detour_cache = DetourCache(self.find_path, self.detour_cache_bytes)
+
+        self.set_topology(params)
+
+    # Sets up the grid for a set of closed intersections, and loads or builds
+    # its paths, from the given parameters: closed_intersections, and
+    # optionally routing, paths_file, new_paths_file, base_paths_file and
+    # paths_key, as taken by the constructor. The map itself is left as it
+    # was loaded.
+    def set_topology(self, params):
+        # Return the nodes and intersections to their initial state, in case
+        # a simulation has been run on the previous topology.
+        self.reset()
+
+        self.closed_intersections = params['closed_intersections'] or []
+        self.paths_file = params.get('paths_file', None)
+        self.new_paths_file = params.get('new_paths_file', None)
+
+        # Routing table built for the map with every intersection open. If
+        # given, and no paths file is, the routing table for the closed
+        # intersections is repaired from it rather than built from scratch.
+        self.base_paths_file = params.get('base_paths_file', None)
+
+        # Key identifying the map and closed intersections, recorded in
+        # routing tables and paths files written by this grid.
+        self.paths_key = params.get('paths_key', None)
+
+        # Key recorded in the paths file loaded, if it records one.
+        self.paths_file_key = None
+
+        # Preprocessing mode. 'pairs' finds a shortest path for every
+        # (entrance, destination) pair; 'trees' builds one shortest path tree
+        # per destination, covering every node in the graph; 'none' skips
+        # preprocessing, for tools that only need the graph.
+        self.routing = params.get('routing', 'pairs')
+
+        # Dict of destination node_id -> ShortestPathTree, when routing with
+        # trees.
+        self.path_trees = {}
+
+        # RoutingTable, when routing with a binary routing table file.
+        self.routing_table = None
+
+        # Dict of entrance node_id -> dict of destination node_id -> path,
+        # when routing with pairs.
+        self.node_paths = {}
+
+        self.apply_closures()
         self.set_paths()
 
-    def initialize_nodes(self):
-        reader = NodeReader(self.node_file)
+        # So were the detour paths.
+        self.detour_cache.clear()
 
-        # Save the node dict for later lookups.
-        self.node_dict = reader.node_dict
+        # Record the initial state of the grid, so it can be reset between
+        # simulations instead of being rebuilt.
+        self.snapshot()
 
-        # Save off the node array.
-        self.nodes = reader.nodes
+    # Reads the map's arrays, from the grid cache if possible.
+    def load_map(self):
+        self.map_data = MapData.load(self.node_file, self.edge_file,
+                                     self.intersection_file, self.map_cache_dir)
+
+    def initialize_nodes(self):
+        map_data = self.map_data
 
-        # Initialize a list container of entrance nodes.
-        self.entrance_nodes = []
+        # Create a Node for every row of the node file. The node_id of a node
+        # is its row.
+        self.nodes = [Node(node_id, node_type, x, y, pixx, pixy)
+                      for node_id, (node_type, (x, y), (pixx, pixy))
+                      in enumerate(zip(map_data.node_types.tolist(), map_data.node_xy.tolist(),
+                                       map_data.node_pix.tolist()))]
 
-        # Initialize a list container of destination nodes.
-        self.destination_nodes = []
+        # Save the node dict of every node in the map, including those of
+        # closed intersections.
+        self.base_node_dict = dict(enumerate(self.nodes))
 
-        # Iterate through the returned nodes,
-        for node in self.nodes:
-            # If the node is an entrance node, add it to the entrance nodes list.
-            if node.node_type == self.type_map['entrance']:
-                self.entrance_nodes.append(node)
-            # If the node is an exit node, add it to the exit nodes list.
-            elif node.node_type == self.type_map['exit']:
-                self.destination_nodes.append(node)
+        # Save the entrance and exit nodes.
+        self.entrance_nodes = [self.nodes[node_id] for node_id in
+                               np.flatnonzero(map_data.node_types == self.type_map['entrance']).tolist()]
+
+        self.destination_nodes = [self.nodes[node_id] for node_id in
+                                  np.flatnonzero(map_data.node_types == self.type_map['exit']).tolist()]
 
     def initialize_intersections(self):
-        reader = IntersectionReader(self.intersection_file, self.node_dict)
+        # Save every intersection in the map, open or closed, in the order
+        # they first appear in the intersection file.
+        self.base_intersections_dict = {}
+        self.intersections = []
 
-        self.intersections_dict = reader.intersections_dict
-        self.intersections = reader.intersections
-        for int_id in self.closed_intersections:
-            nodes_list = self.intersections_dict.get(int_id).nodes
-            for node in nodes_list:
-                del self.node_dict[node.node_id]
-            del self.intersections_dict[int_id]
+        for int_id, node_id in self.map_data.intersections.tolist():
+            intersection = self.base_intersections_dict.get(int_id)
 
-    def initialize_edges(self):
-        reader = EdgeReader(self.edge_file)
+            if intersection is None:
+                intersection = Intersection(int_id, [])
+                self.intersections.append(intersection)
+                self.base_intersections_dict[int_id] = intersection
+
+            intersection.nodes.append(self.base_node_dict.get(node_id))
 
-        # Save off the edges array.
-        edges = reader.edges
+    def initialize_edges(self):
+        map_data = self.map_data
+        num_nodes = len(self.nodes)
 
-        for edge in edges:
-            # Look up the first node.
-            node_a = self.node_dict.get(edge.node_a)
+        # Skip edges to nodes that don't exist.
+        node_a, node_b = map_data.edges[:, 0], map_data.edges[:, 1]
+        valid = (node_a >= 0) & (node_a < num_nodes) & (node_b >= 0) & (node_b < num_nodes)
+        node_a, node_b, weights = node_a[valid], node_b[valid], map_data.edge_weights[valid]
 
-            # Look up the second node to make sure it exists.
-            node_b = self.node_dict.get(edge.node_b)
+        # Build a compressed sparse row copy of the adjacency, over dense node
+        # indexes, unless the grid cache holds one. Routing and the array
+        # engine use its open nodes.
+        if map_data.csr is None:
+            neighbors = [{} for node_id in xrange(num_nodes)]
 
-            if node_a is not None and node_b is not None:
-                # Add a new entry to node a's neighbors dict for node b, setting it
-                # to the weight.
-                node_a.neighbors[node_b.node_id] = edge.weight
+            for a, b, weight in zip(node_a.tolist(), node_b.tolist(), weights.tolist()):
+                # Add a new entry to node a's neighbors dict for node b,
+                # setting it to the weight.
+                neighbors[a][b] = weight
 
                 # Added to make undirected.
-                node_b.neighbors[node_a.node_id] = edge.weight
+                neighbors[b][a] = weight
+
+            map_data.csr = CSRGraph.from_neighbors(dict(enumerate(neighbors)))
+
+        self.base_csr = map_data.csr
+
+        # The CSR graph's weights are float32, so look up each edge's weight
+        # as read from the map. If an edge is listed twice, its last weight is
+        # the one used.
+        pairs = np.minimum(node_a, node_b).astype(np.int64) * num_nodes + np.maximum(node_a, node_b)
+        pairs, last = np.unique(pairs[::-1], return_index=True)
+        last = len(node_a) - 1 - last
+
+        rows = np.repeat(np.arange(num_nodes), self.base_csr.degrees())
+        columns = np.asarray(self.base_csr.indices)
+        csr_pairs = np.minimum(rows, columns).astype(np.int64) * num_nodes + np.maximum(rows, columns)
+        csr_weights = weights[last][np.searchsorted(pairs, csr_pairs)]
+
+        # Lookup table of node_id -> neighbors, in the format of a dict of
+        # neighbor node_id -> edge weight, shared by every node.
+        self.neighbors_dict = Adjacency(self.base_csr, csr_weights)
+
+        # Save the grid coordinates of every node, indexed by node_id, for A*
+        # searches.
+        self.coordinates = map(tuple, map_data.node_xy.tolist())
+
+        # The A* heuristic scales straight-line distance by the smallest ratio
+        # of edge weight to edge length, so that it never overestimates the
+        # remaining distance.
+        xy = np.asarray(map_data.node_xy, dtype=np.float64)
+        lengths = np.hypot(xy[node_b[last], 0] - xy[node_a[last], 0],
+                           xy[node_b[last], 1] - xy[node_a[last], 1])
+        positive = lengths > 0
+
+        if positive.any():
+            self.heuristic_scale = float((weights[last][positive] / lengths[positive]).min())
+        else:
+            self.heuristic_scale = 0.0
+
+    # Masks the nodes of the closed intersections out of the grid. node_dict
+    # and intersections_dict only hold open nodes and intersections, and csr
+    # is the subgraph of the open nodes. Routing only searches open nodes, and
+    # pedestrians only step onto them.
+    def apply_closures(self):
+        closed_ids = set()
+
+        for int_id in self.closed_intersections:
+            intersection = self.base_intersections_dict.get(int_id)
 
-        # Initialize a dictionary to store just the neighbors.
-        self.neighbors_dict = {}
+            if intersection is None:
+                raise ValueError('Intersection %d is not in %s.'
+                                 % (int_id, self.intersection_file))
 
-        # For every entry in the node dictionary,
-        for node_id, node_obj in self.node_dict.iteritems():
-            # Save just the neighbors.
-            self.neighbors_dict[node_id] = node_obj.neighbors
+            closed_ids.update(node.node_id for node in intersection.nodes)
+
+        self.node_dict = dict((node_id, node) for node_id, node in self.base_node_dict.iteritems()
+                              if node_id not in closed_ids)
+
+        self.intersections_dict = dict((int_id, intersection) for int_id, intersection
+                                       in self.base_intersections_dict.iteritems()
+                                       if int_id not in self.closed_intersections)
+
+        # Whether each node of base_csr is open, by dense index.
+        self.node_mask = ~np.in1d(self.base_csr.node_ids, sorted(closed_ids))
+        self.csr = self.base_csr.masked(self.node_mask)
 
     def set_paths(self):
+        # If we've been given a binary routing table, map it in. There is
+        # nothing else to load.
+        if self.paths_file and RoutingTable.is_table_file(self.paths_file):
+            self.routing = 'table'
+            self.routing_table = RoutingTable.load(self.paths_file)
+            self.paths_file_key = self.routing_table.key
+
         # If we already have an existing file containing the paths data in
         # pickle format, read it in and update the paths attributes on our
         # nodes.
-        if self.paths_file:
+        elif self.paths_file:
             # Load the data.
-            with open(self.paths_file, 'rb') as f:
-                paths_data = pickle.load(f)
+            paths_data, self.paths_file_key = PathsFile.read(self.paths_file)
+
+            # Paths files written in 'trees' mode are tagged as such.
+            if paths_data.get('routing') == 'trees':
+                self.routing = 'trees'
+
+                for node_id, tree_data in paths_data['trees'].iteritems():
+                    self.path_trees[node_id] = ShortestPathTree.from_data(node_id, tree_data)
+            else:
+                self.routing = 'pairs'
 
                 for node in self.entrance_nodes:
                     data_for_node = paths_data.get(node.node_id, None)
 
                     if data_for_node:
-                        node.paths = data_for_node
+                        self.node_paths[node.node_id] = data_for_node
 
-        else:
-            # Initialize a paths container that we will write to a file.
-            paths_dict = {}
-
-            Printer.pp('Performing preprocessing step to find shortest paths. Please bear with us.')
+        elif self.routing == 'none':
+            return
 
-            num_nodes = len(self.entrance_nodes)
+        elif self.base_paths_file:
+            self.repair_paths()
 
-            # Iterate through every entrance node, updating the *paths*
-            # dictionary attribute to include the shortest path to every
-            # destination node.
-            for indx, node in enumerate(self.entrance_nodes):
-                node_id = node.node_id
+        else:
+            Printer.pp('Performing preprocessing step to find shortest paths. Please bear with us.')
 
-                # Compute the paths for every possible destination.
-                for destination in self.destination_nodes:
-                    destination_node_id = destination.node_id
+            if self.routing == 'trees':
+                paths_data = self.build_path_trees()
+            else:
+                paths_data = self.build_pair_paths()
 
-                    node.paths[destination_node_id] = ShortestPath(self.neighbors_dict,
-                                                                   node_id,
-                                                                   destination_node_id).path
+            # Routing tables can only be written from trees, which cover
+            # every node.
+            if self.new_paths_file and RoutingTable.is_table_file(self.new_paths_file):
+                if self.routing != 'trees':
+                    raise ValueError('Routing table files can only be written in trees mode.')
 
-                paths_dict[node_id] = node.paths
+                self.routing = 'table'
+                self.routing_table = RoutingTable.from_trees(self.node_dict.keys(),
+                                                             self.path_trees,
+                                                             self.paths_key)
+                self.routing_table.save(self.new_paths_file)
+                self.path_trees = {}
 
-                percent_done = ((indx+1)/float(num_nodes))*100
-                print('%.2f percent done.' % percent_done)
+                print('---> Wrote routing table to %s.' % self.new_paths_file)
 
             # If we've specified a file to write our shortest paths to,
-            if self.new_paths_file:
-                # Write the paths to a file.
-                with open(self.new_paths_file, 'wb') as f:
-                    pickle.dump(paths_dict, f, -1)
+            elif self.new_paths_file:
+                # Write the paths to a file, recording the map and closed
+                # intersections they were found for in its header.
+                PathsFile.write(self.new_paths_file, paths_data, self.paths_key)
 
                 print('---> Dumped paths to %s.' % self.new_paths_file)
 
         print('---> Preprocessing done.')
+
+    # Builds the routing table for the grid from the table of the map with
+    # every intersection open, repairing only the routes that pass through
+    # closed intersections, and writes it to the new paths file if given.
+    def repair_paths(self):
+        start_time = time.time()
+
+        base_table = RoutingTable.load(self.base_paths_file)
+        self.routing_table, num_repaired = base_table.repaired(self.csr, self.paths_key)
+        self.routing = 'table'
+
+        print('---> Repaired %d of %d routes from %s in %.3f s.'
+              % (num_repaired, self.routing_table.next_hops.size,
+                 self.base_paths_file, time.time() - start_time))
+
+        if self.new_paths_file:
+            self.routing_table.save(self.new_paths_file)
+
+            print('---> Wrote routing table to %s.' % self.new_paths_file)
+
+    # Finds the shortest path from every entrance node to every destination
+    # node, one search per pair. Returns the paths data to be written to a
+    # paths file.
+    def build_pair_paths(self):
+        # Initialize a paths container that we will write to a file.
+        paths_dict = {}
+
+        num_nodes = len(self.entrance_nodes)
+
+        # Iterate through every entrance node, storing the shortest path to
+        # every destination node in the *node_paths* table.
+        for indx, node in enumerate(self.entrance_nodes):
+            node_id = node.node_id
+            paths = {}
+
+            # Compute the paths for every possible destination.
+            for destination in self.destination_nodes:
+                destination_node_id = destination.node_id
+
+                paths[destination_node_id] = self.find_path(node_id,
+                                                            destination_node_id)
+
+            self.node_paths[node_id] = paths
+            paths_dict[node_id] = paths
+
+            percent_done = ((indx+1)/float(num_nodes))*100
+            print('%.2f percent done.' % percent_done)
+
+        return paths_dict
+
+    # Builds a shortest path tree rooted at every destination node, giving a
+    # route to that destination from every node in the graph. Returns the
+    # paths data to be written to a paths file.
+    def build_path_trees(self):
+        trees_dict = {}
+
+        num_trees = len(self.destination_nodes)
+        start_time = time.time()
+
+        for indx, destination in enumerate(self.destination_nodes):
+            tree_start = time.time()
+
+            tree = ShortestPathTree.from_csr(self.csr, destination.node_id)
+            self.path_trees[destination.node_id] = tree
+            trees_dict[destination.node_id] = tree.to_data()
+
+            print('Tree %d of %d (destination %d): reached %d nodes in %.3f s.'
+                  % (indx+1, num_trees, destination.node_id,
+                     len(tree.distances), time.time() - tree_start))
+
+        print('Built %d trees in %.3f s.' % (num_trees, time.time() - start_time))
+
+        return { 'routing': 'trees', 'trees': trees_dict }
+
+    # Searches for the shortest path, as a list of node_ids, between two
+    # nodes, using A* over the grid coordinates.
+    def find_path(self, start_id, end_id):
+        return ShortestPath(self.neighbors_dict, start_id, end_id,
+                            coordinates=self.coordinates,
+                            heuristic_scale=self.heuristic_scale,
+                            nodes=self.node_dict).path
+
+    # Returns a RoutingTable covering every node in the grid, building it from
+    # the shortest path trees if the grid wasn't loaded from one.
+    def get_routing_table(self):
+        if self.routing_table is None:
+            if self.routing != 'trees':
+                raise ValueError('A routing table needs shortest path trees. '
+                                 'Preprocess paths in trees mode.')
+
+            self.routing_table = RoutingTable.from_trees(self.node_dict.keys(),
+                                                         self.path_trees,
+                                                         self.paths_key)
+
+        return self.routing_table
+
+    # Returns the shortest path, as a list of node_ids, from the given start
+    # node to the given destination node.
+    def shortest_path(self, start_id, destination_id):
+        if self.routing == 'table':
+            return self.routing_table.path(start_id, destination_id)
+
+        if self.routing == 'trees':
+            return self.path_trees[destination_id].path_from(start_id)
+
+        return self.node_paths[start_id][destination_id]
+
+    # Records the mutable state of the grid: node occupancy and intersection
+    # states. Closed nodes and intersections are recorded too, so they are in
+    # their initial state when reopened.
+    def snapshot(self):
+        self.saved_available = [node.available for node in self.nodes]
+
+        self.saved_intersections = [(intersection, intersection.is_open)
+                                    for intersection in self.intersections]
+
+    # Restores the state recorded by the last snapshot, clearing any
+    # pedestrians left behind by a simulation.
+    def reset(self):
+        for node, available in itertools.izip(self.nodes, self.saved_available):
+            node.available = available
+            node.current_ped = None
+
+        for intersection, is_open in self.saved_intersections:
+            intersection.is_open = is_open
@@ -1,8 +1,10 @@
-class Intersection:
+class Intersection(object):
     """
     Implements an intersection, used for parametrically limiting pedestrian flow.
     """
 
+    __slots__ = ('int_id', 'nodes', 'is_open')
+
 
     """
     Creates a new intersection.
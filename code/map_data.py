@@ -0,0 +1,306 @@
+from csr_graph import CSRGraph
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+import warnings
+import numpy as np
+
+class MapData(object):
+    """
+    The contents of a map's node, edge and intersection CSV files as typed
+    NumPy arrays, parsed in bulk rather than row by row.
+
+    Once parsed, the arrays are written to a binary grid cache next to the
+    CSV files, along with the map's CSR adjacency. Later loads of the same
+    files memory-map the cache instead of parsing them. The cache records the
+    size, modification time and SHA-1 hash of each CSV file, and is rebuilt
+    if any of them changes.
+    """
+
+    # Bump to invalidate every existing cache when the cache format changes.
+    FORMAT_VERSION = 1
+
+    # Arrays making up the map, saved to the cache as <name>.npy.
+    ARRAYS = ['node_xy', 'node_pix', 'node_types', 'edges', 'edge_weights',
+              'intersections', 'csr_indptr', 'csr_indices', 'csr_weights']
+
+    """
+    Creates a new MapData.
+
+    Args:
+      node_xy: Array. Grid x and y coordinates of each node, as int32. The
+        node_id of a node is its row.
+      node_pix: Array. Pixel-space x and y coordinates of each node.
+      node_types: Array. Node type of each node, as int32.
+      edges: Array. node_a and node_b of each edge, as int32.
+      edge_weights: Array. Weight of each edge.
+      intersections: Array. int_id and node_id of each intersection node, as
+        int32.
+      csr: CSRGraph. Optional adjacency of the map, if already built.
+      sources: List. Optional path, size, mtime and sha1 of each CSV file the
+        arrays were read from, as recorded in the grid cache.
+
+    Returns:
+      A new MapData object.
+
+    """
+    def __init__(self, node_xy, node_pix, node_types, edges, edge_weights,
+                 intersections, csr=None, sources=None):
+        self.node_xy = node_xy
+        self.node_pix = node_pix
+        self.node_types = node_types
+        self.edges = edges
+        self.edge_weights = edge_weights
+        self.intersections = intersections
+        self.csr = csr
+        self.sources = sources
+
+        # Whether the arrays were loaded from the grid cache.
+        self.cached = False
+
+    # Number of nodes in the map.
+    def num_nodes(self):
+        return len(self.node_types)
+
+    # Parses the map's CSV files.
+    @classmethod
+    def from_csv(cls, node_file, edge_file, intersection_file):
+        # Record the files before reading them, so that a file changed while
+        # it is read makes the cache invalid rather than stale.
+        sources = [source_info(filename) for filename in
+                   [node_file, edge_file, intersection_file]]
+
+        # Columns 4 and 5 of the node file are unused.
+        nodes = read_table(node_file, [0, 1, 2, 3, 6])
+        edges = read_table(edge_file, [0, 1, 2])
+        intersections = read_table(intersection_file, [0, 1])
+
+        return cls(nodes[:, 0:2].astype(np.int32), nodes[:, 2:4].copy(),
+                   nodes[:, 4].astype(np.int32), edges[:, 0:2].astype(np.int32),
+                   edges[:, 2].copy(), intersections.astype(np.int32),
+                   sources=sources)
+
+    # Returns the map's arrays, memory-mapped from the grid cache in cache_dir
+    # if it is valid for the given files, or parsed from the CSV files
+    # otherwise. If cache_dir is None, the files are always parsed.
+    @classmethod
+    def load(cls, node_file, edge_file, intersection_file, cache_dir=None):
+        source_files = [node_file, edge_file, intersection_file]
+
+        manifest = cls.read_manifest(cache_dir, source_files) if cache_dir else None
+
+        if manifest:
+            arrays = dict((name, np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r'))
+                          for name in cls.ARRAYS)
+
+            csr = CSRGraph(np.arange(len(arrays['node_types']), dtype=np.int32),
+                           arrays['csr_indptr'], arrays['csr_indices'], arrays['csr_weights'])
+
+            map_data = cls(arrays['node_xy'], arrays['node_pix'], arrays['node_types'],
+                           arrays['edges'], arrays['edge_weights'], arrays['intersections'],
+                           csr, manifest['sources'])
+            map_data.cached = True
+
+            print('---> Loaded map from grid cache %s.' % cache_dir)
+
+            return map_data
+
+        return cls.from_csv(node_file, edge_file, intersection_file)
+
+    # Returns the grid cache directory for the given map files: a directory
+    # under grid_cache, next to the node file, named after the three files.
+    @staticmethod
+    def cache_dir_for(node_file, edge_file, intersection_file):
+        digest = hashlib.sha1()
+
+        for filename in [node_file, edge_file, intersection_file]:
+            digest.update(os.path.abspath(filename) + ';')
+
+        return os.path.join(os.path.dirname(os.path.abspath(node_file)), 'grid_cache',
+                            digest.hexdigest()[:16])
+
+    # Returns the manifest of the grid cache in cache_dir if the cache is
+    # complete and was built from the given files as they are now, or None
+    # otherwise. Files whose modification time has changed are hashed, and
+    # the cache stays valid if their contents haven't.
+    @classmethod
+    def read_manifest(cls, cache_dir, source_files):
+        manifest_file = os.path.join(cache_dir, 'manifest.json')
+
+        try:
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if manifest.get('version') != cls.FORMAT_VERSION:
+            return None
+
+        sources = manifest.get('sources', [])
+
+        if [source['path'] for source in sources] != [os.path.abspath(filename)
+                                                       for filename in source_files]:
+            return None
+
+        touched = False
+
+        for source in sources:
+            try:
+                stat = os.stat(source['path'])
+            except OSError:
+                return None
+
+            if stat.st_size != source['size']:
+                return None
+
+            if stat.st_mtime != source['mtime']:
+                if file_hash(source['path']) != source['sha1']:
+                    return None
+
+                source['mtime'] = stat.st_mtime
+                touched = True
+
+        if not all(os.path.exists(os.path.join(cache_dir, name + '.npy')) for name in cls.ARRAYS):
+            return None
+
+        # Record the new modification times, so the files aren't hashed again
+        # next time.
+        if touched:
+            try:
+                write_json(manifest_file, manifest)
+            except (IOError, OSError):
+                pass
+
+        return manifest
+
+    # Writes the arrays and the CSR adjacency to a grid cache in cache_dir.
+    # The cache is written to a temporary directory first, so a run never
+    # sees a partial cache. Failing to write it only prints a warning.
+    def save(self, cache_dir):
+        pending_dir = cache_dir + '.tmp%d' % os.getpid()
+
+        arrays = {
+            'node_xy': self.node_xy,
+            'node_pix': self.node_pix,
+            'node_types': self.node_types,
+            'edges': self.edges,
+            'edge_weights': self.edge_weights,
+            'intersections': self.intersections,
+            'csr_indptr': self.csr.indptr,
+            'csr_indices': self.csr.indices,
+            'csr_weights': self.csr.weights,
+        }
+
+        try:
+            if os.path.exists(pending_dir):
+                shutil.rmtree(pending_dir)
+
+            os.makedirs(pending_dir)
+
+            for name in self.ARRAYS:
+                np.save(os.path.join(pending_dir, name + '.npy'), np.asarray(arrays[name]))
+
+            write_json(os.path.join(pending_dir, 'manifest.json'),
+                       { 'version': self.FORMAT_VERSION, 'sources': self.sources })
+
+            if os.path.exists(cache_dir):
+                shutil.rmtree(cache_dir)
+
+            os.rename(pending_dir, cache_dir)
+        except (IOError, OSError) as e:
+            print('WARNING: could not write grid cache %s: %s' % (cache_dir, e))
+
+            if os.path.exists(pending_dir):
+                shutil.rmtree(pending_dir, ignore_errors=True)
+
+            return
+
+        print('---> Wrote grid cache %s.' % cache_dir)
+
+# Reads the given columns of a CSV file with a header line into a float64
+# array with one row per line. Files that are entirely numeric are parsed in
+# bulk; anything else, such as quoted fields, text in unused columns or blank
+# lines, is parsed line by line, like the CSV readers do.
+def read_table(filename, columns):
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        body = f.read()
+
+    num_columns = header.count(',') + 1
+
+    if num_columns <= max(columns):
+        raise ValueError('%s has %d columns, expected at least %d.'
+                         % (filename, num_columns, max(columns) + 1))
+
+    body = body.replace('\r', '').strip()
+
+    if not body:
+        return np.empty((0, len(columns)))
+
+    num_rows = body.count('\n') + 1
+
+    # NumPy warns, and stops, at the first value it can't parse.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        values = np.fromstring(body.replace('\n', ','), sep=',')
+
+    if len(values) == num_rows * num_columns:
+        return values.reshape(num_rows, num_columns)[:, columns]
+
+    return read_rows(filename, columns)
+
+# Reads the given columns of a CSV file with a header line into a float64
+# array, one line at a time, skipping blank lines.
+def read_rows(filename, columns):
+    rows = []
+
+    with open(filename, 'rb') as csvfile:
+        # Skip the first line.
+        next(csvfile)
+
+        for line_number, row in enumerate(csv.reader(csvfile, delimiter=','), 2):
+            if not any(field.strip() for field in row):
+                continue
+
+            try:
+                rows.append([float(row[column]) for column in columns])
+            except (IndexError, ValueError):
+                raise ValueError('Could not parse line %d of %s: %r'
+                                 % (line_number, filename, ','.join(row)))
+
+    return np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+
+# Returns the path, size, modification time and SHA-1 hash of a file, as
+# recorded in the grid cache.
+def source_info(filename):
+    stat = os.stat(filename)
+
+    return {
+        'path': os.path.abspath(filename),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha1': file_hash(filename),
+    }
+
+# Returns the SHA-1 hash of a file's contents.
+def file_hash(filename):
+    digest = hashlib.sha1()
+
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+# Writes a JSON file through a temporary file, so it is never seen partly
+# written.
+def write_json(filename, data):
+    pending_file = filename + '.tmp%d' % os.getpid()
+
+    with open(pending_file, 'w') as f:
+        json.dump(data, f)
+
+    os.rename(pending_file, filename)
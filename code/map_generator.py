@@ -0,0 +1,212 @@
+import sys
+import getopt
+import os
+import numpy as np
+
+class MapGenerator:
+    """
+    Generates a synthetic city-block map in the CSV formats read by
+    NodeReader, EdgeReader and IntersectionReader.
+
+    The map is a blocks_x by blocks_y grid of square city blocks separated by
+    streets. Pedestrians walk on the sidewalk ring around each block, and
+    cross streets on crosswalks that continue the first and last rows (or
+    columns) of the sidewalk across the street. Each crosswalk is its own
+    intersection. The sidewalk of the central block is made of entrance
+    nodes, like the gates of a venue, and the sidewalk along the outer edge
+    of the map is made of exit nodes.
+    """
+
+    # Node types, as in the type map used by the simulation.
+    SIDEWALK = 1
+    CROSSWALK = 2
+    ENTRANCE = 3
+    EXIT = 4
+
+    """
+    Creates a new MapGenerator.
+
+    Args:
+      blocks_x: Integer. Number of blocks across the map. At least 3.
+      blocks_y: Integer. Number of blocks down the map. At least 3.
+      block_size: Integer. Width of each block in cells, sidewalk included.
+      street_width: Integer. Width of each street in cells.
+      cell_pixels: Float. Width of a cell in pixels, for plotting.
+      weight: Float. Weight of each edge between neighboring cells.
+
+    Returns:
+      A new MapGenerator object.
+
+    """
+    def __init__(self, blocks_x, blocks_y, block_size=10, street_width=4,
+                 cell_pixels=2.0, weight=1.0):
+        if blocks_x < 3 or blocks_y < 3:
+            raise ValueError('Maps must be at least 3 blocks across and down.')
+
+        if block_size < 2 or street_width < 1:
+            raise ValueError('Blocks must be at least 2 cells wide and streets 1 cell wide.')
+
+        self.blocks_x = blocks_x
+        self.blocks_y = blocks_y
+        self.block_size = block_size
+        self.street_width = street_width
+        self.cell_pixels = cell_pixels
+        self.weight = weight
+
+    # Builds the map. Sets nodes (array of rows of x, y, pixx, pixy,
+    # node_type), edges (array of rows of node_a, node_b) and intersections
+    # (array of rows of int_id, node_id).
+    def generate(self):
+        period = self.block_size + self.street_width
+        width = self.blocks_x * period - self.street_width
+        height = self.blocks_y * period - self.street_width
+
+        y, x = np.mgrid[0:height, 0:width]
+
+        # Position of each cell within its block and street, and the block
+        # (or the street after it) it falls in.
+        bx = x % period
+        by = y % period
+        block_x = x // period
+        block_y = y // period
+        last = self.block_size - 1
+
+        in_block_x = bx < self.block_size
+        in_block_y = by < self.block_size
+
+        sidewalk = (in_block_x & in_block_y &
+                    ((bx == 0) | (bx == last) | (by == 0) | (by == last)))
+
+        # Crosswalks across the streets running down and across the map.
+        crossing_x = ~in_block_x & in_block_y & ((by == 0) | (by == last))
+        crossing_y = in_block_x & ~in_block_y & ((bx == 0) | (bx == last))
+        crosswalk = crossing_x | crossing_y
+
+        walkable = sidewalk | crosswalk
+
+        node_type = np.where(crosswalk, self.CROSSWALK, self.SIDEWALK)
+
+        venue = (sidewalk & (block_x == self.blocks_x // 2) &
+                 (block_y == self.blocks_y // 2))
+        node_type[venue] = self.ENTRANCE
+
+        border = (x == 0) | (x == width - 1) | (y == 0) | (y == height - 1)
+        node_type[sidewalk & border] = self.EXIT
+
+        # Node ids are the positions of the walkable cells in row-major order.
+        node_ids = np.cumsum(walkable.ravel()).reshape(walkable.shape) - 1
+
+        self.nodes = np.column_stack([x[walkable], y[walkable],
+                                      x[walkable] * self.cell_pixels,
+                                      y[walkable] * self.cell_pixels,
+                                      node_type[walkable]])
+
+        # Edges join neighboring walkable cells.
+        across = walkable[:, :-1] & walkable[:, 1:]
+        down = walkable[:-1, :] & walkable[1:, :]
+
+        self.edges = np.vstack([
+            np.column_stack([node_ids[:, :-1][across], node_ids[:, 1:][across]]),
+            np.column_stack([node_ids[:-1, :][down], node_ids[1:, :][down]]),
+        ])
+
+        # Each crosswalk is identified by the street it crosses, the block
+        # beside it and which end of the block it is at.
+        crosswalk_keys = np.where(crossing_x,
+                                  ((block_y * self.blocks_x + block_x) * 2 + (by == last)) * 2,
+                                  ((block_y * self.blocks_x + block_x) * 2 + (bx == last)) * 2 + 1)
+        keys = crosswalk_keys[walkable & crosswalk]
+        int_ids = np.unique(keys, return_inverse=True)[1] + 1
+
+        self.intersections = np.column_stack([int_ids, node_ids[walkable & crosswalk]])
+        order = np.argsort(self.intersections[:, 0], kind='mergesort')
+        self.intersections = self.intersections[order]
+
+        return self
+
+    # Writes nodes.csv, edges.csv and intersections.csv to a directory.
+    def write(self, out_dir):
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+        # Columns 4 and 5 are not read by NodeReader.
+        nodes = np.column_stack([self.nodes[:, :4], np.zeros((len(self.nodes), 2)),
+                                 self.nodes[:, 4]])
+        np.savetxt(os.path.join(out_dir, 'nodes.csv'), nodes,
+                   fmt=['%d', '%d', '%.2f', '%.2f', '%d', '%d', '%d'], delimiter=',',
+                   header='x,y,pixx,pixy,unused,unused,node_type', comments='')
+
+        edges = np.column_stack([self.edges, np.empty(len(self.edges))])
+        edges[:, 2] = self.weight
+        np.savetxt(os.path.join(out_dir, 'edges.csv'), edges,
+                   fmt=['%d', '%d', '%g'], delimiter=',',
+                   header='node_a,node_b,weight', comments='')
+
+        np.savetxt(os.path.join(out_dir, 'intersections.csv'), self.intersections,
+                   fmt='%d', delimiter=',', header='int_id, node_id', comments='')
+
+    # Returns a summary of the generated map.
+    def summary(self):
+        node_types = self.nodes[:, 4]
+
+        return {
+            'blocks_x': self.blocks_x,
+            'blocks_y': self.blocks_y,
+            'block_size': self.block_size,
+            'street_width': self.street_width,
+            'nodes': len(self.nodes),
+            'edges': len(self.edges),
+            'intersections': len(np.unique(self.intersections[:, 0])),
+            'entrances': int((node_types == self.ENTRANCE).sum()),
+            'exits': int((node_types == self.EXIT).sum()),
+        }
+
+def main(argv):
+    blocks_x = 5
+    blocks_y = 5
+    block_size = 10
+    street_width = 4
+    cell_pixels = 2.0
+    out_dir = './map/generated'
+
+    help_message = ('map_generator.py -x <int blocksAcross> -y <int blocksDown> '
+                    '-b <int blockSize> -w <int streetWidth> -c <float cellPixels> '
+                    '-o <outputDirectory>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'hx:y:b:w:c:o:',['help', 'blocks-x=', 'blocks-y=',
+                                                       'block-size=', 'street-width=',
+                                                       'cell-pixels=', 'output='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-x', '--blocks-x'):
+            blocks_x = int(arg)
+        elif opt in ('-y', '--blocks-y'):
+            blocks_y = int(arg)
+        elif opt in ('-b', '--block-size'):
+            block_size = int(arg)
+        elif opt in ('-w', '--street-width'):
+            street_width = int(arg)
+        elif opt in ('-c', '--cell-pixels'):
+            cell_pixels = float(arg)
+        elif opt in ('-o', '--output'):
+            out_dir = arg
+
+    generator = MapGenerator(blocks_x, blocks_y, block_size, street_width, cell_pixels)
+    generator.generate().write(out_dir)
+
+    summary = generator.summary()
+    print('Wrote a %dx%d block map with %d nodes, %d edges and %d intersections to %s.'
+          % (blocks_x, blocks_y, summary['nodes'], summary['edges'],
+             summary['intersections'], out_dir))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
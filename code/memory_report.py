@@ -0,0 +1,295 @@
+import sys
+import getopt
+import json
+import mmap
+import types
+import numpy as np
+from grid import Grid
+from pedestrian_stream import PedestrianStream
+from custom_random import CustomRandom
+
+class LegacyNode:
+    """
+    A node laid out as nodes were before they were slotted: an attribute
+    dict per node, holding its own neighbors and paths dicts.
+    """
+
+    def __init__(self, node, paths):
+        self.node_id = node.node_id
+        self.node_type = node.node_type
+        self.x = node.x
+        self.y = node.y
+        self.pixx = node.pixx
+        self.pixy = node.pixy
+        self.paths = paths
+        self.neighbors = {}
+        self.available = node.available
+        self.current_ped = node.current_ped
+
+class LegacyPedestrian:
+    """
+    A pedestrian laid out as pedestrians were before they were slotted: an
+    attribute dict per pedestrian, and a copy of its path from the grid as a
+    list, from which it pops the nodes it has reached.
+    """
+
+    def __init__(self, ped, grid, node_dict):
+        self.current = node_dict[ped.current.node_id]
+        self.destination = node_dict[ped.destination.node_id]
+        self.speed = ped.speed
+        self.shortest_path = list(grid.shortest_path(ped.current.node_id,
+                                                     ped.destination.node_id))
+        self.shortest_path.pop(0)
+        self.shortest_path.pop(0)
+        self.target_next = node_dict[ped.target_next.node_id]
+        self.egress_complete = ped.egress_complete
+        self.cells_moved = ped.cells_moved
+        self.index = ped.index
+
+class MemoryReport:
+    """
+    Measures the memory taken by the node and pedestrian objects of a
+    simulation: the bytes per node held by the grid, and the bytes per
+    pedestrian on top of the grid. Sizes are deep sizes from sys.getsizeof,
+    counting each object once however many times it is referenced.
+
+    The same grid and pedestrians can also be measured as they were laid out
+    before nodes and pedestrians were slotted, to compare the two layouts.
+    """
+
+    # Grid attributes holding routing data or caches rather than nodes, left
+    # out of the bytes per node.
+    EXCLUDED = ['path_trees', 'routing_table', 'node_paths', 'detour_cache', 'map_data']
+
+    """
+    Creates a new MemoryReport.
+
+    Args:
+      grid: Grid. The grid to measure.
+      num_pedestrians: Integer. Number of pedestrians to create and measure.
+      seed: Integer. Seed for the pedestrians' choices.
+      legacy: Boolean. Whether to also measure the grid and pedestrians in
+        the layout they had before nodes and pedestrians were slotted.
+
+    Returns:
+      A new MemoryReport object.
+
+    """
+    def __init__(self, grid, num_pedestrians, seed, legacy=False):
+        self.grid = grid
+        self.num_pedestrians = num_pedestrians
+        self.seed = seed
+        self.legacy = legacy
+
+    # Measures the grid and the pedestrians, and prints and returns the
+    # results. With legacy set, the results of the legacy layout are
+    # returned under 'legacy'.
+    def run(self):
+        # Pedestrians as they enter the simulation.
+        stream = PedestrianStream(self.grid, CustomRandom(self.seed),
+                                  self.num_pedestrians, [1] * 100)
+        peds = [stream.pop() for i in range(self.num_pedestrians)]
+
+        results = self.measure('Current layout', vars(self.grid), peds, set())
+
+        if self.legacy:
+            tables = self.legacy_tables()
+            node_dict = tables['base_node_dict']
+            legacy_peds = [LegacyPedestrian(ped, self.grid, node_dict) for ped in peds]
+
+            # The legacy nodes stand in for the grid's nodes, which are still
+            # referenced by its intersections.
+            seen = set(id(node) for node in self.grid.nodes)
+            results['legacy'] = self.measure('Legacy layout', tables, legacy_peds, seen)
+
+        return results
+
+    # Measures the given grid attributes and pedestrians, skipping anything
+    # in seen, and prints and returns the results.
+    def measure(self, title, attributes, peds, seen):
+        # Attributes of the grid itself, apart from routing data and caches.
+        grid_bytes = sys.getsizeof(self.grid)
+        excluded = [attributes.get(name) for name in self.EXCLUDED]
+        seen.update(id(value) for value in excluded)
+
+        for name, value in attributes.iteritems():
+            grid_bytes += deep_size(name, seen) + deep_size(value, seen)
+
+        num_nodes = len(attributes['nodes'])
+
+        # Everything the pedestrians share with the grid, such as their
+        # nodes, has already been counted.
+        seen.add(id(peds))
+        ped_bytes = sum(deep_size(ped, seen) for ped in peds)
+
+        results = {
+            'nodes': num_nodes,
+            'grid_bytes': grid_bytes,
+            'bytes_per_node': grid_bytes / float(num_nodes),
+            'pedestrians': len(peds),
+            'pedestrian_bytes': ped_bytes,
+            'bytes_per_pedestrian': ped_bytes / float(max(len(peds), 1)),
+        }
+
+        print('%s:' % title)
+        print('  Grid: %d nodes in %.1f MB, %.1f bytes per node.'
+              % (num_nodes, grid_bytes / float(2**20), results['bytes_per_node']))
+        print('  Pedestrians: %d in %.1f KB, %.1f bytes per pedestrian.'
+              % (len(peds), ped_bytes / 1024.0, results['bytes_per_pedestrian']))
+
+        return results
+
+    # Returns the grid's attributes with its node tables rebuilt in the
+    # legacy layout: a neighbors dict and a paths dict on every node, dicts
+    # of coordinates and of neighbors, and saved nodes holding a copy of
+    # their paths.
+    def legacy_tables(self):
+        grid = self.grid
+        tables = dict(vars(grid))
+        del tables['saved_available']
+
+        nodes = [LegacyNode(node, grid.node_paths.get(node.node_id, {}))
+                 for node in grid.nodes]
+        num_nodes = len(nodes)
+
+        # Neighbors are added edge by edge, as the grid used to add them.
+        map_data = grid.map_data
+        node_a, node_b = map_data.edges[:, 0], map_data.edges[:, 1]
+        valid = (node_a >= 0) & (node_a < num_nodes) & (node_b >= 0) & (node_b < num_nodes)
+        node_a, node_b, weights = node_a[valid], node_b[valid], map_data.edge_weights[valid]
+
+        for a, b, weight in zip(node_a.tolist(), node_b.tolist(), weights.tolist()):
+            nodes[a].neighbors[b] = weight
+            nodes[b].neighbors[a] = weight
+
+        tables['nodes'] = nodes
+        tables['base_node_dict'] = dict(enumerate(nodes))
+        tables['node_dict'] = dict((node_id, nodes[node_id]) for node_id in grid.node_dict)
+        tables['neighbors_dict'] = dict((node.node_id, node.neighbors) for node in nodes)
+        tables['coordinates'] = dict(enumerate(map(tuple, map_data.node_xy.tolist())))
+        tables['saved_nodes'] = [(node, node.available, dict(node.paths) if node.paths else None)
+                                 for node in nodes]
+
+        return tables
+
+# Returns the size in bytes of an object and everything reachable from it
+# that isn't in seen, adding what it counts to seen. Functions, classes and
+# modules are shared code rather than data, so they aren't counted.
+def deep_size(obj, seen):
+    size = 0
+    pending = [obj]
+
+    while pending:
+        obj = pending.pop()
+
+        if id(obj) in seen:
+            continue
+
+        seen.add(id(obj))
+
+        if isinstance(obj, (types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+                            types.ModuleType, type, types.ClassType)):
+            continue
+
+        if isinstance(obj, mmap.mmap):
+            size += len(obj)
+            continue
+
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, np.ndarray):
+            # A view doesn't own its data; its base does.
+            if obj.base is not None:
+                pending.append(obj.base)
+            continue
+
+        if isinstance(obj, dict):
+            pending.extend(obj.iterkeys())
+            pending.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+
+        if hasattr(obj, '__dict__'):
+            pending.append(obj.__dict__)
+
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, name):
+                    pending.append(getattr(obj, name))
+
+    return size
+
+def main(argv):
+    node_file = './map/nodes.csv'
+    edge_file = './map/edges.csv'
+    intersection_file = './map/intersections.csv'
+    paths_file = None
+    routing = 'trees'
+    num_pedestrians = 1000
+    seed = 1
+    legacy = False
+    output_file = None
+
+    help_message = ('memory_report.py -n <nodesCsv> -e <edgesCsv> '
+                    '-i <intersectionsCsv> -P <pathsFile> -r <pairs|trees> '
+                    '-p <int numPedestrians> -s <int seed> -l <t/f legacyBoolean> '
+                    '-o <jsonOutputFile>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'hn:e:i:P:r:p:s:l:o:',['help', 'nodes=', 'edges=',
+                                                              'intersections=', 'paths=',
+                                                              'routing=', 'peds=', 'seed=',
+                                                              'legacy=', 'output='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-n', '--nodes'):
+            node_file = arg
+        elif opt in ('-e', '--edges'):
+            edge_file = arg
+        elif opt in ('-i', '--intersections'):
+            intersection_file = arg
+        elif opt in ('-P', '--paths'):
+            paths_file = arg
+        elif opt in ('-r', '--routing'):
+            routing = arg
+        elif opt in ('-p', '--peds'):
+            num_pedestrians = int(arg)
+        elif opt in ('-s', '--seed'):
+            seed = int(arg)
+        elif opt in ('-l', '--legacy'):
+            if arg == 't' or arg == 'T':
+                legacy = True
+        elif opt in ('-o', '--output'):
+            output_file = arg
+
+    if routing not in ('pairs', 'trees'):
+        print(help_message)
+        sys.exit(2)
+
+    grid = Grid({
+        'node_file': node_file,
+        'edge_file': edge_file,
+        'intersection_file': intersection_file,
+        'paths_file': paths_file,
+        'closed_intersections': [],
+        'type_map': { 'sidewalk': 1, 'crosswalk': 2, 'entrance': 3, 'exit': 4 },
+        'routing': routing,
+        'map_cache_dir': None,
+    })
+
+    results = MemoryReport(grid, num_pedestrians, seed, legacy).run()
+
+    if output_file:
+        with open(output_file, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
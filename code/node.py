@@ -1,5 +1,14 @@
-class Node:
-    """ Implementation of the node structure in our graph. """
+class Node(object):
+    """
+    Implementation of the node structure in our graph.
+
+    Nodes are slotted, and hold no per-node containers: a node's neighbors
+    are looked up in the grid's shared neighbors table, and the paths stored
+    for it in the grid's shared paths table.
+    """
+
+    __slots__ = ('node_id', 'node_type', 'x', 'y', 'pixx', 'pixy', 'available',
+                 'current_ped')
 
 
     """
@@ -11,6 +20,8 @@ class Node:
           'road', 'entrance', and 'exit', respectively.
       x: Integer. The x-coordinate of the node in the grid.
       y: Integer. The y-coordinate of the node in the grid.
+      pixx: Float. The pixel-space x-coordinate of the node.
+      pixy: Float. The pixel-space y-coordinate of the node.
 
     Returns:
       A new Node object.
@@ -31,21 +42,8 @@ class Node:
         self.pixx = pixx
         self.pixy = pixy
 
-        # Initialize a dictionary to hold the next node in the shortest path
-        # for each destination.
-        self.paths = {}
-
-        # List of Node neighbors.
-        self.neighbors = {}
-
         # By default, the node is not occupied (i.e., it is available).
         self.available = True
 
         # Store the current pedestrian occupying the node.
         self.current_ped = None
-
-    # For a given destination node, returns the next node in the shortest path.
-    def get_next_node(self, dest, node_dict):
-        next_node_id = self.paths[dest.node_id]
-
-        return node_dict[next_node_id]
\ No newline at end of file
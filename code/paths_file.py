@@ -0,0 +1,80 @@
+import binascii
+import pickle
+import struct
+
+class PathsFile(object):
+    """
+    Reads and writes pickle paths files. The pickled paths are preceded by a
+    small fixed header recording the key of the map and closed intersections
+    they were found for and the length of the pickle, so a file can be
+    checked without unpickling it. Files without the header, written before
+    it was added, are read as plain pickles with no key.
+
+    Header layout (all values little-endian):
+
+      8-byte magic, uint32 version, uint64 length of the pickle in bytes,
+      20-byte key, 24 bytes padding.
+    """
+
+    MAGIC = 'PEDPATH1'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIQ20s24x')
+    NO_KEY = '\0' * 20
+
+    # Writes paths data to a file, under the given key if any.
+    @classmethod
+    def write(cls, filename, paths_data, key=None):
+        data = pickle.dumps(paths_data, -1)
+        packed_key = binascii.unhexlify(key) if key else cls.NO_KEY
+
+        with open(filename, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(data), packed_key))
+            f.write(data)
+
+    # Reads the header of a paths file. Returns (key, file_size), the key
+    # being None if the file was written without one, and file_size the size
+    # the whole file should have. Raises a ValueError if the file has no
+    # header.
+    @classmethod
+    def read_header(cls, filename):
+        with open(filename, 'rb') as f:
+            data = f.read(cls.HEADER.size)
+
+        return cls.unpack_header(filename, data)
+
+    # Unpacks a header read from the start of a paths file.
+    @classmethod
+    def unpack_header(cls, filename, data):
+        if len(data) < cls.HEADER.size or not data.startswith(cls.MAGIC):
+            raise ValueError('%s has no paths file header.' % filename)
+
+        magic, version, length, key = cls.HEADER.unpack(data)
+
+        if version != cls.VERSION:
+            raise ValueError('%s is not a version %d paths file.'
+                             % (filename, cls.VERSION))
+
+        if key == cls.NO_KEY:
+            key = None
+        else:
+            key = binascii.hexlify(key)
+
+        return key, cls.HEADER.size + length
+
+    # Reads a paths file. Returns (paths_data, key), the key being None if the
+    # file doesn't record one.
+    @classmethod
+    def read(cls, filename):
+        with open(filename, 'rb') as f:
+            start = f.read(len(cls.MAGIC))
+
+            if start != cls.MAGIC:
+                # A plain pickle, written before the header was added.
+                f.seek(0)
+
+                return pickle.load(f), None
+
+            key, file_size = cls.unpack_header(filename,
+                                               start + f.read(cls.HEADER.size - len(start)))
+
+            return pickle.load(f), key
@@ -1,11 +1,14 @@
 from shortest_path import ShortestPath
 
-import copy
+import array
 import random
 
-class Pedestrian:
+class Pedestrian(object):
     """ Implements a pedestrian. """
 
+    __slots__ = ('current', 'destination', 'speed', 'route', 'target_next',
+                 'egress_complete', 'cells_moved', 'index')
+
 
     """
     Creates a new pedestrian.
@@ -17,12 +20,14 @@ class Pedestrian:
       speed: Integer. Number of grid cells traversed per time step.
       node_dict: Dictionary. Lookup table of node_id -> node object for every node
         in the simulation.
+      path: List. Shortest path (list of node_ids) from current to
+        destination.
 
     Returns:
       A new Pedestrian object.
 
     """
-    def __init__(self, current, destination, speed, node_dict):
+    def __init__(self, current, destination, speed, node_dict, path):
         # The current location of the pedestrian, as a Node.
         self.current = current
 
@@ -33,21 +38,40 @@ class Pedestrian:
         # grid cells traversed per time step.
         self.speed = speed
 
-        # Store the pedestrian's shortest path to his destination, as determined
-        # by Dijkstra's algorithm.
-        self.shortest_path = copy.deepcopy(self.current.paths[self.destination.node_id])
+        # Store the rest of the pedestrian's shortest path to his destination,
+        # after the current node, as determined by Dijkstra's algorithm. It is
+        # kept as an array of node_ids in reverse order, so the next node is
+        # popped off the end.
+        self.route = array.array('i', reversed(path))
+        self.route.pop()
 
         # Initialize the desired next node to move to in the shortest path,
         # also known as the target next.
-        self.shortest_path.pop(0)
-        self.target_next = node_dict[self.shortest_path.pop(0)]
+        self.target_next = node_dict[self.route.pop()]
 
         # Whether the pedestrian has completed egress (i.e., exited the SUI).
         self.egress_complete = False
 
-    # Move the pedestrian to a given node. Takes a node (Node), node_dict (Dictionary),
-    # and type_map (Dictionary) translating string node types to node_type ids.
-    def move(self, node, node_dict, type_map, neighbors_dict):
+        # Number of cells the pedestrian has moved.
+        self.cells_moved = 0
+
+        # Position of the pedestrian in the order pedestrians entered the SUI,
+        # when per-pedestrian outputs are collected.
+        self.index = None
+
+    # Move the pedestrian to a given node. Takes a node (Node), node_dict (Dictionary)
+    # of the open nodes, and type_map (Dictionary) translating string node types
+    # to node_type ids. Nodes missing from node_dict, such as those of closed
+    # intersections, are never moved onto.
+    # detour_cache (DetourCache), if given, supplies detour paths in place of
+    # searching for them on every reroute. profiler (Profiler), if given, times
+    # reroutes and counts reroutes, swaps and failed moves.
+    def move(self, node, node_dict, type_map, neighbors_dict, detour_cache=None,
+             profiler=None):
+        # A pedestrian who has left the SUI can't move any further.
+        if self.egress_complete:
+            return self
+
         # If the requested node is not available to move to, find a neighbor
         # of the current node that is available.
         if not node.available:
@@ -59,16 +83,31 @@ class Pedestrian:
             # is occupied by a ped that wants to go to my current node,
             # perform the move.
             if node.current_ped != None and node.current_ped.target_next == self.current:
+                other_ped = node.current_ped
+                my_node = self.current
+
+                if profiler:
+                    profiler.count('swaps')
+
                 # Both the nodes are now available.
                 node.available = True
-                self.current.available = True
+                my_node.available = True
 
                 # Perform the moves.
-                self.move(node, node_dict, type_map, neighbors_dict)
-                node.current_ped.move(self.current, node_dict, type_map, neighbors_dict)
+                self.move(node, node_dict, type_map, neighbors_dict, detour_cache, profiler)
+                other_ped.move(my_node, node_dict, type_map, neighbors_dict, detour_cache, profiler)
 
-            # Shuffle neighbors.
-            neighbors = self.current.neighbors.keys()
+                # The other ped's move freed the node we just moved into, so
+                # occupy it again.
+                if not self.egress_complete:
+                    node.available = False
+                    node.current_ped = self
+
+                return self
+
+            # Shuffle the open neighbors.
+            neighbors = [node_id for node_id in neighbors_dict[self.current.node_id]
+                         if node_id in node_dict]
             random.shuffle(neighbors)
 
             # For every neighbor,
@@ -85,40 +124,48 @@ class Pedestrian:
                     found_node = True
 
                     # Grab the next node in the shortest path.
-                    next_node_id = self.shortest_path[0]
+                    next_node_id = self.route[-1]
 
                     # If the selected node is the same as our desired next node,
                     if node.node_id == next_node_id:
 
-                        if len(self.shortest_path) > 0:
+                        if len(self.route) > 0:
                             # Remove it from our shortest path.
-                            self.shortest_path.pop(0)
+                            self.route.pop()
 
                         # Break from the loop.
                         break
 
-                    # Check to see if the selected node has a path to get to our
-                    # next node.
-                    shortest_path = node.paths.get(next_node_id, None)
+                    if profiler:
+                        reroute_start = profiler.clock()
 
-                    # If not,
-                    if not shortest_path:
-                        # Update our shortest path with the shortest path to
-                        # the next node.
+                    # If we've been given a detour cache, get the path from
+                    # the selected node to our next node from it.
+                    if detour_cache:
+                        shortest_path = detour_cache.get(node.node_id, next_node_id)
+                    else:
+                        # Otherwise, search for the shortest path to the next
+                        # node.
                         shortest_path = ShortestPath(neighbors_dict,
                                                      node.node_id,
-                                                     next_node_id).path
+                                                     next_node_id,
+                                                     nodes=node_dict).path
 
-                        node.paths[next_node_id] = shortest_path
+                    if profiler:
+                        profiler.add('rerouting', reroute_start)
+                        profiler.count('reroutes')
 
                     # Update our shortest path.
-                    self.shortest_path[0:0] = shortest_path[1:-1]
+                    self.route.extend(reversed(shortest_path[1:-1]))
 
                     # Exit the loop. We're done.
                     break
 
             # If we weren't able to find a node to move to,
             if not found_node:
+                if profiler:
+                    profiler.count('failed_moves')
+
                 return
 
         # The current node is now available and no ped occupies it.
@@ -127,6 +174,7 @@ class Pedestrian:
 
         # Update the current node to the new node.
         self.current = node
+        self.cells_moved += 1
 
         # If current is a destination node,
         if self.current.node_type == type_map['exit']:
@@ -140,6 +188,6 @@ class Pedestrian:
             self.current.current_ped = self
 
             # Update the target next.
-            self.target_next = node_dict[self.shortest_path.pop(0)]
+            self.target_next = node_dict[self.route.pop()]
 
         return self
@@ -0,0 +1,113 @@
+from pedestrian import Pedestrian
+import numpy as np
+
+class PedestrianStream(object):
+    """
+    The queue of pedestrians waiting to enter the simulation, generated
+    lazily. Entrance, destination and speed choices are drawn from the random
+    number generator in batches, and a Pedestrian object is only created when
+    it enters the simulation, so memory use doesn't grow with the total number
+    of pedestrians.
+    """
+
+
+    """
+    Creates a new PedestrianStream.
+
+    Args:
+      grid: Grid. The grid the pedestrians walk on.
+      rng: CustomRandom. Random number generator for the pedestrians' choices.
+      num_pedestrians: Integer. Total number of pedestrians in the stream.
+      speed_distribution: List. Speeds to sample from, 100 entries long.
+      batch_size: Integer. Number of pedestrians to draw choices for at once.
+      speed_rng: CustomRandom. If given, speeds are drawn from this generator
+        rather than rng.
+
+    Returns:
+      A new PedestrianStream object.
+
+    """
+    def __init__(self, grid, rng, num_pedestrians, speed_distribution, batch_size=4096,
+                 speed_rng=None):
+        self.grid = grid
+        self.rng = rng
+        self.speed_rng = speed_rng
+        self.speed_distribution = speed_distribution
+        self.batch_size = batch_size
+
+        # Number of pedestrians that have not yet been drawn into a batch, and
+        # that have not yet left the stream.
+        self.undrawn = num_pedestrians
+        self.remaining = num_pedestrians
+
+        # Choices for the current batch, and our position in it.
+        self.entrances = []
+        self.destinations = []
+        self.speeds = []
+        self.position = 0
+
+    # Number of pedestrians still waiting in the stream.
+    def __len__(self):
+        return self.remaining
+
+    # Draws the entrance, destination and speed of the next count
+    # pedestrians. Pedestrians are drawn in order, each taking three numbers
+    # from the generator, all in one batch, or two if speeds have their own
+    # generator. Returns lists of entrance Nodes, destination Nodes and
+    # speeds.
+    def sample(self, count):
+        entrance_nodes = self.grid.entrance_nodes
+        destination_nodes = self.grid.destination_nodes
+
+        # One row of (entrance, destination, speed) numbers per pedestrian,
+        # scaled as random_in_range would.
+        if self.speed_rng is None:
+            draws = self.rng.uniform_batch(3 * count).reshape(count, 3)
+        else:
+            draws = np.empty((count, 3))
+            draws[:, :2] = self.rng.uniform_batch(2 * count).reshape(count, 2)
+            draws[:, 2] = self.speed_rng.uniform_batch(count)
+
+        draws *= [len(entrance_nodes), len(destination_nodes), len(self.speed_distribution)]
+        choices = draws.astype(np.int64)
+
+        entrances = [entrance_nodes[i] for i in choices[:, 0]]
+        destinations = [destination_nodes[i] for i in choices[:, 1]]
+        speeds = [self.speed_distribution[i] for i in choices[:, 2]]
+
+        return entrances, destinations, speeds
+
+    # Makes sure the choices for the next pedestrian have been drawn.
+    def fill(self):
+        if self.position == len(self.entrances):
+            count = min(self.batch_size, self.undrawn)
+            self.entrances, self.destinations, self.speeds = self.sample(count)
+            self.undrawn -= count
+            self.position = 0
+
+    # Returns the entrance Node of the next pedestrian in the stream.
+    def next_entrance(self):
+        self.fill()
+
+        return self.entrances[self.position]
+
+    # Removes the next pedestrian from the stream, returning it as a new
+    # Pedestrian.
+    def pop(self):
+        if self.remaining == 0:
+            raise IndexError('pop from an empty PedestrianStream')
+
+        self.fill()
+
+        entrance_node = self.entrances[self.position]
+        destination_node = self.destinations[self.position]
+        speed = self.speeds[self.position]
+
+        self.position += 1
+        self.remaining -= 1
+
+        # Look up the pedestrian's route through the grid.
+        path = self.grid.shortest_path(entrance_node.node_id, destination_node.node_id)
+
+        return Pedestrian(entrance_node, destination_node, speed,
+                          self.grid.node_dict, path)
@@ -0,0 +1,71 @@
+import json
+import timeit
+
+class Profiler(object):
+    """
+    Accumulates the wall time and number of calls of each phase of a
+    simulation, and counts events such as reroutes, swaps and failed moves.
+
+    Code being profiled checks whether it was given a Profiler before timing
+    anything, so a simulation run without one does almost no extra work.
+    """
+
+    # Clock used for timing phases.
+    clock = staticmethod(timeit.default_timer)
+
+    """
+    Creates a new Profiler.
+
+    Returns:
+      A new Profiler object.
+
+    """
+    def __init__(self):
+        # Dicts of phase -> seconds, and phase -> number of calls.
+        self.seconds = {}
+        self.calls = {}
+
+        # Dict of event -> count.
+        self.counts = {}
+
+    # Adds the time since start, a time returned by clock(), to a phase.
+    # Returns the current time, so the next phase can be timed from it.
+    def add(self, phase, start):
+        now = self.clock()
+
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + (now - start)
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+        return now
+
+    # Adds n to the count of an event.
+    def count(self, event, n=1):
+        self.counts[event] = self.counts.get(event, 0) + n
+
+    # Returns the profile as a dict.
+    def to_dict(self):
+        return {
+            'phases': dict((phase, {'seconds': self.seconds[phase],
+                                    'calls': self.calls[phase]})
+                           for phase in self.seconds),
+            'counts': dict(self.counts),
+        }
+
+    # Writes the profile, with any extra fields given, to a JSON file.
+    def save(self, filename, extra={}):
+        profile = self.to_dict()
+        profile.update(extra)
+
+        with open(filename, 'w') as outfile:
+            json.dump(profile, outfile, indent=2, sort_keys=True)
+
+    # Prints the time spent in each phase, longest first, and the counts.
+    def report(self):
+        print('Profile:')
+
+        for phase in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            print('  %-14s %9.3f s in %8d calls' % (phase, self.seconds[phase],
+                                                   self.calls[phase]))
+
+        for event in sorted(self.counts):
+            print('  %-14s %9d' % (event, self.counts[event]))
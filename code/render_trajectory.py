@@ -0,0 +1,184 @@
+import sys
+import os
+import getopt
+import subprocess
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from trajectory import TrajectoryReader
+
+class TrajectoryRenderer:
+    """
+    Renders a trajectory file recorded during a simulation as a sequence of
+    PNG frames, plotting pedestrians on top of the map image, and optionally
+    joins the frames into a video with ffmpeg. Chunks of the file are
+    rendered by a pool of worker processes.
+    """
+
+
+    """
+    Creates a new TrajectoryRenderer.
+
+    Args:
+      trajectory_file: String. Path of the trajectory file.
+      vis_image: String. Path of the map image to plot on, or None.
+      out_dir: String. Directory the frames are written to.
+      workers: Integer. Number of worker processes.
+      every: Integer. Render one in every *every* recorded steps.
+
+    Returns:
+      A new TrajectoryRenderer object.
+
+    """
+    def __init__(self, trajectory_file, vis_image, out_dir, workers=1, every=1):
+        self.trajectory_file = trajectory_file
+        self.vis_image = vis_image
+        self.out_dir = out_dir
+        self.workers = workers
+        self.every = every
+
+    # Renders every chunk of the trajectory. Returns the number of frames.
+    def render(self):
+        reader = TrajectoryReader(self.trajectory_file)
+
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+
+        # Number the frames across chunks: the first step of each chunk is
+        # the total number of steps in the chunks before it.
+        tasks = []
+        first_step = 0
+
+        for indx, (offset, first_timestep, num_steps) in enumerate(reader.chunks):
+            tasks.append((self, indx, first_step))
+            first_step += num_steps
+
+        if self.workers > 1:
+            pool = multiprocessing.Pool(self.workers)
+
+            try:
+                frame_counts = pool.map(render_chunk, tasks)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            frame_counts = [render_chunk(task) for task in tasks]
+
+        num_frames = sum(frame_counts)
+        print('Rendered %d frames from %d steps to %s.' % (num_frames, first_step, self.out_dir))
+
+        return num_frames
+
+    # Renders the steps of one chunk whose step number is a multiple of
+    # every. Returns the number of frames written.
+    def render_chunk(self, reader, indx, first_step):
+        fig = plt.figure()
+        ax = fig.add_subplot(1, 1, 1)
+
+        if self.vis_image:
+            ax.imshow(plt.imread(self.vis_image), zorder=0)
+        else:
+            ax.set_xlim(reader.pixx.min(), reader.pixx.max())
+            ax.set_ylim(reader.pixy.max(), reader.pixy.min())
+
+        scat = ax.scatter([], [], zorder=1, color='r')
+        title = ax.set_title('')
+        num_frames = 0
+
+        for step, (timestep, pixx, pixy) in enumerate(reader.read_chunk(indx)):
+            step_number = first_step + step
+
+            if step_number % self.every != 0:
+                continue
+
+            scat.set_offsets(np.column_stack([pixx, pixy]))
+            title.set_text('Timestep %d' % timestep)
+            fig.savefig(self.frame_path(step_number // self.every))
+            num_frames += 1
+
+        plt.close(fig)
+
+        return num_frames
+
+    # Returns the path of a frame.
+    def frame_path(self, frame):
+        return os.path.join(self.out_dir, 'frame_%06d.png' % frame)
+
+    # Joins the frames into a video with ffmpeg.
+    def make_video(self, video_file, frame_rate):
+        subprocess.check_call(['ffmpeg', '-y', '-loglevel', 'error',
+                               '-framerate', str(frame_rate),
+                               '-i', os.path.join(self.out_dir, 'frame_%06d.png'),
+                               '-pix_fmt', 'yuv420p', video_file])
+
+        print('Wrote %s.' % video_file)
+
+# Renders one chunk in a worker process.
+def render_chunk(task):
+    renderer, indx, first_step = task
+
+    return renderer.render_chunk(TrajectoryReader(renderer.trajectory_file), indx, first_step)
+
+def main(argv):
+    trajectory_file = None
+    vis_image = './map/map.png'
+    out_dir = './frames'
+    workers = multiprocessing.cpu_count()
+    every = 10
+    video_file = None
+    frame_rate = 10
+
+    help_message = ('render_trajectory.py -t <trajectoryFile> -i <mapImage> '
+                    '-o <framesDirectory> -w <int workers> -n <int everyNSteps> '
+                    '-V <videoFile> -r <int frameRate>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'ht:i:o:w:n:V:r:',['help', 'trajectory=', 'image=',
+                                                         'output=', 'workers=', 'every=',
+                                                         'video=', 'rate='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-t', '--trajectory'):
+            trajectory_file = arg
+        elif opt in ('-i', '--image'):
+            vis_image = arg or None
+        elif opt in ('-o', '--output'):
+            out_dir = arg
+        elif opt in ('-w', '--workers'):
+            workers = int(arg)
+        elif opt in ('-n', '--every'):
+            every = int(arg)
+        elif opt in ('-V', '--video'):
+            video_file = arg
+        elif opt in ('-r', '--rate'):
+            frame_rate = int(arg)
+
+    if trajectory_file == None:
+        print('trajectory file was not given')
+        sys.exit(2)
+
+    if vis_image and not os.path.exists(vis_image):
+        print('map image %s not found. plotting without it.' % vis_image)
+        vis_image = None
+
+    renderer = TrajectoryRenderer(trajectory_file, vis_image, out_dir, workers, every)
+    renderer.render()
+
+    if video_file:
+        renderer.make_video(video_file, frame_rate)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,140 @@
+import json
+import os
+import struct
+import numpy as np
+
+class ResultsStore(object):
+    """
+    Collects the outputs of a batch of simulations and writes them in
+    batches, rather than reopening files for every run.
+
+    For a base path such as results/config1_<time>, the store writes:
+
+      <base>.txt:               seed,timesteps of every run, as before.
+      <base>.runs.csv:          one row of metadata per run: seed, timesteps,
+                                number of pedestrians, wall time, engine and
+                                the hash of the configuration.
+      <base>.peds:              optionally, per-pedestrian outputs in the
+                                binary format below.
+      <base>.verification.json: optionally, the verification data of every
+                                run, keyed by seed.
+
+    Per-pedestrian file layout (all values little-endian): an 8-byte magic,
+    then a block for each run made of a header (uint32 seed, uint32
+    num_pedestrians) and one column per field, each int32[num_pedestrians]:
+    entry timestep, egress timestep and path length in cells. Pedestrians
+    that never entered or never left have -1 entry or egress timesteps.
+    """
+
+    MAGIC = 'PEDRES01'
+    RUN_HEADER = struct.Struct('<II')
+    PED_FIELDS = ['entry', 'egress', 'path_length']
+    RUN_FIELDS = ['seed', 'timesteps', 'num_pedestrians', 'wall_s', 'engine', 'config_hash']
+
+    """
+    Creates a new ResultsStore.
+
+    Args:
+      base_path: String. Path of the result files, without an extension.
+      config_hash: String. Hash identifying the configuration being run.
+      engine: String. Simulation engine used for the runs.
+      buffer_size: Integer. Number of runs buffered before they are written.
+
+    Returns:
+      A new ResultsStore object.
+
+    """
+    def __init__(self, base_path, config_hash, engine, buffer_size=50):
+        self.base_path = base_path
+        self.config_hash = config_hash
+        self.engine = engine
+        self.buffer_size = buffer_size
+
+        self.buffer = []
+        self.verification = {}
+
+        # Create the runs file with its header.
+        with open(self.path('.runs.csv'), 'w') as runs_file:
+            runs_file.write(','.join(self.RUN_FIELDS) + '\n')
+
+    # Returns the path of a result file with the given extension.
+    def path(self, ext):
+        return self.base_path + ext
+
+    # Adds the outputs of a run: a dict with its seed, timesteps,
+    # num_pedestrians and wall_s, and optionally its ped_distribution
+    # (verification data) and pedestrians (dict of per-pedestrian arrays).
+    def add(self, outputs):
+        self.buffer.append(outputs)
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    # Writes the buffered runs.
+    def flush(self):
+        if not self.buffer:
+            return
+
+        with open(self.path('.txt'), 'a+') as res_file:
+            res_file.write(''.join('%d,%d\n' % (run['seed'], run['timesteps'])
+                                   for run in self.buffer))
+
+        with open(self.path('.runs.csv'), 'a+') as runs_file:
+            runs_file.write(''.join('%d,%d,%d,%.6f,%s,%s\n'
+                                    % (run['seed'], run['timesteps'],
+                                       run['num_pedestrians'], run['wall_s'],
+                                       self.engine, self.config_hash)
+                                    for run in self.buffer))
+
+        runs_with_peds = [run for run in self.buffer if run.get('pedestrians')]
+
+        if runs_with_peds:
+            peds_path = self.path('.peds')
+            is_new = not os.path.exists(peds_path)
+
+            with open(peds_path, 'ab') as peds_file:
+                if is_new:
+                    peds_file.write(self.MAGIC)
+
+                for run in runs_with_peds:
+                    pedestrians = run['pedestrians']
+                    peds_file.write(self.RUN_HEADER.pack(run['seed'], len(pedestrians['entry'])))
+
+                    for field in self.PED_FIELDS:
+                        np.asarray(pedestrians[field], dtype='<i4').tofile(peds_file)
+
+        for run in self.buffer:
+            if run.get('ped_distribution'):
+                self.verification[run['seed']] = run['ped_distribution']
+
+        self.buffer = []
+
+    # Writes everything still buffered, and the verification data.
+    def close(self):
+        self.flush()
+
+        if self.verification:
+            with open(self.path('.verification.json'), 'w') as outfile:
+                json.dump(self.verification, outfile)
+
+    # Reads a per-pedestrian file. Returns a dict of seed -> dict of field
+    # -> int32 array.
+    @classmethod
+    def read_pedestrians(cls, filename):
+        runs = {}
+
+        with open(filename, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError('%s is not a per-pedestrian results file.' % filename)
+
+            while True:
+                data = f.read(cls.RUN_HEADER.size)
+
+                if len(data) < cls.RUN_HEADER.size:
+                    break
+
+                seed, num_pedestrians = cls.RUN_HEADER.unpack(data)
+                runs[seed] = dict((field, np.fromfile(f, dtype='<i4', count=num_pedestrians))
+                                  for field in cls.PED_FIELDS)
+
+        return runs
@@ -0,0 +1,150 @@
+from routing_table import RoutingTable
+from paths_file import PathsFile
+
+import hashlib
+import os
+
+class RoutingCache(object):
+    """
+    A directory of preprocessed routing data, keyed by a hash of the map files
+    and the set of closed intersections the data was built for. Entries that
+    are invalid are discarded, and the least recently used entries are evicted
+    once the cache grows beyond its size limit.
+    """
+
+    # Bump to invalidate every existing entry when the routing data format
+    # changes.
+    FORMAT_VERSION = 1
+
+    """
+    Creates a new RoutingCache.
+
+    Args:
+      cache_dir: String. Directory holding the cache entries. Created if it
+        doesn't exist.
+      max_bytes: Integer. Total size the cache is allowed to grow to before
+        old entries are evicted.
+
+    Returns:
+      A new RoutingCache object.
+
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    # Computes the cache key for the given map files, closed intersections
+    # and routing mode.
+    @classmethod
+    def key_for(cls, map_files, closed_intersections, routing):
+        digest = hashlib.sha1()
+        digest.update('version=%d;routing=%s;' % (cls.FORMAT_VERSION, routing))
+
+        for filename in map_files:
+            digest.update('file;')
+
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), ''):
+                    digest.update(block)
+
+        closed = sorted(set(closed_intersections or []))
+        digest.update('closed=%s;' % ','.join(str(x) for x in closed))
+
+        return digest.hexdigest()
+
+    # Returns the path of the entry for a key.
+    def path_for(self, key, routing, suffix=''):
+        if routing == 'trees':
+            ext = '.rtab'
+        else:
+            ext = '.pickle'
+
+        return os.path.join(self.cache_dir, key + suffix + ext)
+
+    # Returns the path of a valid entry for the key, or None if there is no
+    # such entry. Invalid entries are removed so they get rebuilt.
+    def lookup(self, key, routing):
+        path = self.path_for(key, routing)
+
+        if not os.path.exists(path):
+            return None
+
+        if not self.is_valid(path, key, routing):
+            print('---> Discarding invalid routing cache entry %s.' % path)
+            os.remove(path)
+            return None
+
+        # Mark the entry as recently used.
+        os.utime(path, None)
+
+        return path
+
+    # Checks that an entry is complete, and was built for the given key.
+    def is_valid(self, path, key, routing):
+        size = os.path.getsize(path)
+
+        # A paths file's size is recorded in its header.
+        if routing != 'trees':
+            try:
+                paths_key, expected_size = PathsFile.read_header(path)
+            except ValueError:
+                return False
+
+            return paths_key == key and size == expected_size
+
+        try:
+            num_nodes, num_destinations, table_key = RoutingTable.read_header(path)
+        except ValueError:
+            return False
+
+        # A routing table's size is fixed by its header.
+        expected_size = (RoutingTable.HEADER.size + 4 * num_nodes +
+                         4 * num_destinations + 8 * num_destinations * num_nodes)
+
+        return table_key == key and size == expected_size
+
+    # Returns a temporary path to write a new entry to. Once it is written,
+    # it should be passed to commit.
+    def pending_path_for(self, key, routing):
+        return self.path_for(key, routing, '.tmp%d' % os.getpid())
+
+    # Moves a newly written entry into place, then evicts old entries if the
+    # cache has grown too large.
+    def commit(self, pending_path, key, routing):
+        path = self.path_for(key, routing)
+        os.rename(pending_path, path)
+        self.evict(keep=path)
+
+        return path
+
+    # Removes the least recently used entries until the cache fits in
+    # max_bytes. The entry at *keep* is never removed.
+    def evict(self, keep=None):
+        entries = []
+
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+
+            if '.tmp' in filename or not os.path.isfile(path):
+                continue
+
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for mtime, size, path in entries)
+
+        # Oldest entries first.
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            if path == keep:
+                continue
+
+            os.remove(path)
+            total -= size
+
+            print('---> Evicted routing cache entry %s.' % path)
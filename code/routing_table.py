@@ -0,0 +1,387 @@
+from shortest_path_tree import ShortestPathTree
+from paths_file import PathsFile
+
+import binascii
+import heapq
+import struct
+import numpy as np
+
+class RoutingTable(object):
+    """
+    A compact routing table giving, for every destination node, the next node
+    and remaining distance toward it from every node in the graph. Stored on
+    disk in a binary format that is opened with mmap, so loading a table costs
+    almost nothing and processes reading the same file share its pages.
+
+    File layout (all values little-endian):
+
+      header:       8-byte magic, uint32 version, uint32 num_nodes,
+                    uint32 num_destinations, 20-byte key, 24 bytes padding.
+      node_ids:     int32[num_nodes], sorted. Position in this array is the
+                    node's dense index.
+      dest_ids:     int32[num_destinations].
+      next_hops:    int32[num_destinations, num_nodes]. Dense index of the next
+                    node toward each destination, or -1 if it can't be reached.
+      distances:    float32[num_destinations, num_nodes]. Distance to each
+                    destination, or inf if it can't be reached.
+    """
+
+    MAGIC = 'PEDRTAB1'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIII20s24x')
+    NO_KEY = '\0' * 20
+
+    """
+    Creates a new RoutingTable.
+
+    Args:
+      node_ids: Array. Sorted node_ids of every node in the table.
+      destination_ids: Array. node_ids of every destination node.
+      next_hops: Array. int32 matrix of dense next-hop indexes, one row per
+        destination.
+      distances: Array. float32 matrix of distances, one row per destination.
+      key: String. Optional hex digest identifying the map the table was built
+        from.
+
+    Returns:
+      A new RoutingTable object.
+
+    """
+    def __init__(self, node_ids, destination_ids, next_hops, distances, key=None):
+        self.node_ids = node_ids
+        self.destination_ids = destination_ids
+        self.next_hops = next_hops
+        self.distances = distances
+        self.key = key
+
+        # Map each destination node_id to its row in the matrices.
+        self.destination_index = dict((int(dest_id), row) for row, dest_id
+                                      in enumerate(destination_ids))
+
+    # Returns the dense index of a node_id, or -1 if it isn't in the table.
+    def index_of(self, node_id):
+        indx = int(np.searchsorted(self.node_ids, node_id))
+
+        if indx < len(self.node_ids) and self.node_ids[indx] == node_id:
+            return indx
+
+        return -1
+
+    # Returns the next node_id toward the given destination, or None if the
+    # destination can't be reached from the node.
+    def next_hop(self, node_id, destination_id):
+        indx = self.index_of(node_id)
+        row = self.destination_index.get(destination_id)
+
+        if indx < 0 or row is None or self.next_hops[row, indx] < 0:
+            return None
+
+        return int(self.node_ids[self.next_hops[row, indx]])
+
+    # Returns the shortest path from a node to a destination as a list of
+    # node_ids, or None if the destination can't be reached.
+    def path(self, start_id, destination_id):
+        indx = self.index_of(start_id)
+        row = self.destination_index.get(destination_id)
+
+        if indx < 0 or row is None:
+            return None
+
+        next_row = self.next_hops[row]
+
+        if next_row[indx] < 0:
+            return None
+
+        root = self.index_of(destination_id)
+        path = [int(start_id)]
+
+        while indx != root:
+            indx = int(next_row[indx])
+            path.append(int(self.node_ids[indx]))
+
+        return path
+
+    # Returns the distance from a node to a destination.
+    def distance(self, node_id, destination_id):
+        indx = self.index_of(node_id)
+        row = self.destination_index.get(destination_id)
+
+        if indx < 0 or row is None:
+            return float('inf')
+
+        return float(self.distances[row, indx])
+
+    # Writes the table to a file.
+    def save(self, filename):
+        key = binascii.unhexlify(self.key) if self.key else self.NO_KEY
+
+        with open(filename, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+                                     len(self.node_ids),
+                                     len(self.destination_ids), key))
+            np.asarray(self.node_ids, dtype='<i4').tofile(f)
+            np.asarray(self.destination_ids, dtype='<i4').tofile(f)
+            np.asarray(self.next_hops, dtype='<i4').tofile(f)
+            np.asarray(self.distances, dtype='<f4').tofile(f)
+
+    # Whether a paths file name refers to a routing table, rather than a
+    # pickle.
+    @staticmethod
+    def is_table_file(filename):
+        return filename.endswith('.rtab')
+
+    # Reads the header of a table file. Returns (num_nodes, num_destinations,
+    # key), raising a ValueError if the file isn't a routing table.
+    @classmethod
+    def read_header(cls, filename):
+        with open(filename, 'rb') as f:
+            data = f.read(cls.HEADER.size)
+
+        if len(data) < cls.HEADER.size:
+            raise ValueError('%s is not a routing table.' % filename)
+
+        magic, version, num_nodes, num_destinations, key = cls.HEADER.unpack(data)
+
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError('%s is not a version %d routing table.'
+                             % (filename, cls.VERSION))
+
+        if key == cls.NO_KEY:
+            key = None
+        else:
+            key = binascii.hexlify(key)
+
+        return num_nodes, num_destinations, key
+
+    # Opens a table file with mmap. The matrices are read-only views of the
+    # file; nothing is read until it is used.
+    @classmethod
+    def load(cls, filename):
+        num_nodes, num_destinations, key = cls.read_header(filename)
+
+        # Map each section of the file in turn.
+        sections = [('<i4', (num_nodes,)),
+                    ('<i4', (num_destinations,)),
+                    ('<i4', (num_destinations, num_nodes)),
+                    ('<f4', (num_destinations, num_nodes))]
+
+        arrays = []
+        offset = cls.HEADER.size
+
+        for dtype, shape in sections:
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+            if size == 0:
+                arrays.append(np.zeros(shape, dtype=dtype))
+            else:
+                arrays.append(np.memmap(filename, dtype=dtype, mode='r',
+                                        offset=offset, shape=shape))
+            offset += size
+
+        return cls(arrays[0], arrays[1], arrays[2], arrays[3], key)
+
+    # Builds a table from a dict of destination node_id -> ShortestPathTree.
+    @classmethod
+    def from_trees(cls, node_ids, trees, key=None):
+        node_ids = np.array(sorted(node_ids), dtype=np.int32)
+        destination_ids = np.array(sorted(trees), dtype=np.int32)
+
+        next_hops = np.empty((len(destination_ids), len(node_ids)), dtype=np.int32)
+        distances = np.empty((len(destination_ids), len(node_ids)), dtype=np.float32)
+        next_hops.fill(-1)
+        distances.fill(np.inf)
+
+        for row, dest_id in enumerate(destination_ids):
+            tree = trees[int(dest_id)]
+
+            # Translate node_ids to dense indexes in bulk.
+            from_ids = np.fromiter(tree.next_hops.iterkeys(), dtype=np.int32,
+                                   count=len(tree.next_hops))
+            to_ids = np.fromiter(tree.next_hops.itervalues(), dtype=np.int32,
+                                 count=len(tree.next_hops))
+            next_hops[row, np.searchsorted(node_ids, from_ids)] = np.searchsorted(node_ids, to_ids)
+
+            # The root's next hop is itself.
+            root = np.searchsorted(node_ids, dest_id)
+            next_hops[row, root] = root
+
+            reached = np.fromiter(tree.distances.iterkeys(), dtype=np.int32,
+                                  count=len(tree.distances))
+            lengths = np.fromiter(tree.distances.itervalues(), dtype=np.float64,
+                                  count=len(tree.distances))
+            distances[row, np.searchsorted(node_ids, reached)] = lengths
+
+        return cls(node_ids, destination_ids, next_hops, distances, key)
+
+    # Builds the table for a graph with some of this table's nodes removed,
+    # such as when intersections are closed, from this one. Removing nodes
+    # never shortens a path, so a node whose route avoids every removed node
+    # keeps its route. Only the nodes routed through a removed node are
+    # searched again, by a Dijkstra search seeded from their neighbors that
+    # kept their routes. Routes can differ from a full rebuild between paths
+    # of equal length. Takes the CSRGraph of the new graph, whose nodes must
+    # all be in this table. Returns the new table and the number of routes
+    # repaired.
+    def repaired(self, csr, key=None):
+        node_ids = np.asarray(csr.node_ids, dtype=np.int32)
+        base_ids = np.asarray(self.node_ids)
+        num_nodes = len(node_ids)
+
+        # Dense index in this table of each node of the new graph, and the
+        # other way around (-1 for removed nodes).
+        if not np.all(np.in1d(node_ids, base_ids)):
+            raise ValueError('The graph has nodes that are not in the routing table.')
+
+        base_index = np.searchsorted(base_ids, node_ids)
+
+        new_index = np.empty(len(base_ids), dtype=np.int32)
+        new_index.fill(-1)
+        new_index[base_index] = np.arange(num_nodes, dtype=np.int32)
+
+        # Destinations that weren't removed.
+        kept = [row for row, dest_id in enumerate(self.destination_ids)
+                if new_index[np.searchsorted(base_ids, dest_id)] >= 0]
+        destination_ids = np.asarray(self.destination_ids, dtype=np.int32)[kept]
+
+        next_hops = np.asarray(self.next_hops)[kept]
+        distances = np.asarray(self.distances)[kept]
+
+        affected = self.routed_through(next_hops, new_index < 0)
+
+        # Carry over the routes of every node, translated to the new dense
+        # indexes, then clear those that need repairing.
+        new_next_hops = np.where(next_hops >= 0, new_index[np.maximum(next_hops, 0)], -1)
+        new_next_hops = new_next_hops[:, base_index].astype(np.int32)
+        new_distances = distances[:, base_index].astype(np.float32)
+        affected = affected[:, base_index] & np.isfinite(new_distances)
+
+        new_next_hops[affected] = -1
+        new_distances[affected] = np.inf
+
+        # Adjacency as lists, for the searches.
+        indptr = csr.indptr.tolist()
+        indices = csr.indices.tolist()
+        weights = csr.weights.tolist()
+
+        for row in np.flatnonzero(affected.any(axis=1)):
+            self.repair_row(new_next_hops[row], new_distances[row], affected[row],
+                            indptr, indices, weights)
+
+        table = RoutingTable(node_ids, destination_ids, new_next_hops, new_distances, key)
+
+        return table, int(affected.sum())
+
+    # Returns a boolean matrix, shaped like next_hops, of the nodes whose
+    # route to each destination passes through a node in the removed mask
+    # (including the removed nodes). Follows the routes by pointer doubling,
+    # so it takes a number of steps logarithmic in the length of the longest
+    # route.
+    @staticmethod
+    def routed_through(next_hops, removed):
+        rows, num_nodes = next_hops.shape
+
+        # Unreachable nodes and roots point to themselves.
+        jump = np.where(next_hops >= 0, next_hops, np.arange(num_nodes, dtype=np.int32))
+        flag = np.tile(removed, (rows, 1))
+        row_index = np.arange(rows)[:, None]
+
+        while True:
+            flag |= flag[row_index, jump]
+            next_jump = jump[row_index, jump]
+
+            if np.array_equal(next_jump, jump):
+                return flag
+
+            jump = next_jump
+
+    # Repairs the routes to one destination of the nodes in the affected
+    # mask, in place, by a Dijkstra search over those nodes seeded with the
+    # distances of their unaffected neighbors.
+    @staticmethod
+    def repair_row(next_hops, distances, affected, indptr, indices, weights):
+        heap = []
+        tentative = {}
+
+        for v in np.flatnonzero(affected).tolist():
+            best, best_hop = float('inf'), -1
+
+            for k in range(indptr[v], indptr[v+1]):
+                u = indices[k]
+
+                if not affected[u] and distances[u] != np.inf:
+                    candidate = float(distances[u]) + weights[k]
+
+                    if candidate < best:
+                        best, best_hop = candidate, u
+
+            if best_hop >= 0:
+                tentative[v] = best
+                next_hops[v] = best_hop
+                heap.append((best, v))
+
+        heapq.heapify(heap)
+        done = set()
+
+        while heap:
+            distance, v = heapq.heappop(heap)
+
+            if v in done:
+                continue
+
+            done.add(v)
+            distances[v] = distance
+
+            for k in range(indptr[v], indptr[v+1]):
+                w = indices[k]
+
+                if not affected[w] or w in done:
+                    continue
+
+                vw_distance = distance + weights[k]
+
+                if vw_distance < tentative.get(w, float('inf')):
+                    tentative[w] = vw_distance
+                    next_hops[w] = v
+                    heapq.heappush(heap, (vw_distance, w))
+
+    # Builds a table from a pickle paths file. Files written in 'trees' mode
+    # convert exactly; files written in 'pairs' mode only give routes for the
+    # nodes along their stored paths.
+    @classmethod
+    def from_pickle(cls, filename, node_ids, neighbors_dict, key=None):
+        paths_data = PathsFile.read(filename)[0]
+
+        if paths_data.get('routing') == 'trees':
+            trees = {}
+
+            for dest_id, tree_data in paths_data['trees'].iteritems():
+                trees[dest_id] = ShortestPathTree.from_data(dest_id, tree_data)
+
+            return cls.from_trees(node_ids, trees, key)
+
+        # Rebuild partial trees from the paths stored for each entrance. Any
+        # suffix of a shortest path is itself a shortest path, so every node
+        # on a path routes to its destination along the rest of it.
+        trees = {}
+
+        for entrance_paths in paths_data.itervalues():
+            for dest_id, path in entrance_paths.iteritems():
+                tree = trees.get(dest_id)
+
+                if tree is None:
+                    tree = ShortestPathTree.from_data(dest_id, {
+                        'next_hops': {}, 'distances': { dest_id: 0.0 }
+                    })
+                    trees[dest_id] = tree
+
+                distance = 0.0
+
+                for indx in range(len(path) - 2, -1, -1):
+                    node_id = path[indx]
+                    distance += neighbors_dict[node_id][path[indx+1]]
+
+                    if node_id not in tree.next_hops:
+                        tree.next_hops[node_id] = path[indx+1]
+                        tree.distances[node_id] = distance
+
+        return cls.from_trees(node_ids, trees, key)
@@ -3,6 +3,9 @@
 # Accessible at https://www.ics.uci.edu/~eppstein/161/python/dijkstra.py.
 from priodict import priorityDictionary
 
+import heapq
+import math
+
 class ShortestPath:
     """ An abstraction for finding the shortest path between two nodes in a graph. """
 
@@ -15,19 +18,51 @@ class ShortestPath:
         in the graph. Each key should itself point to another dictionary, with keys corresponding
         to neighboring nodes, and values corresponding to edge weights.
       start: Integer. The node_id of the starting node.
-      end: Integer: The node_id of the destination node.
+      end: Integer: The node_id of the destination node. If None, shortest
+        paths from the start to every reachable node are computed, and no
+        single path is generated.
+      method: String. Search algorithm: 'dijkstra' (binary heap), 'astar', or
+        'legacy' (priority dictionary). By default, A* is used when
+        coordinates and an end node are given, and Dijkstra otherwise.
+      coordinates: Dictionary. Optional lookup table of node_id -> (x, y)
+        grid coordinates, used by A*.
+      heuristic_scale: Float. Factor applied to the straight-line distance
+        between coordinates by the A* heuristic. To find true shortest paths it
+        must not exceed weight / straight-line length for any edge.
+      nodes: Collection. Optional node_ids the search is restricted to, such
+        as the open nodes of a grid with closed intersections. Other nodes in
+        the graph are never entered.
 
     Returns:
       A new ShortestPath object.
 
     """
-    def __init__(self, graph, start, end):
+    def __init__(self, graph, start, end=None, method=None, coordinates=None,
+                 heuristic_scale=1.0, nodes=None):
         self.graph = graph
         self.start = start
         self.end = end
-
-        # Generate the shortest path from the given start to the destination.
-        self.path = self.generate_shortest_path(self.graph, self.start, self.end)
+        self.coordinates = coordinates
+        self.heuristic_scale = heuristic_scale
+        self.nodes = nodes
+
+        # Pick a search algorithm if none was given.
+        if method is None:
+            if coordinates is not None and end is not None:
+                method = 'astar'
+            else:
+                method = 'dijkstra'
+
+        self.method = method
+
+        # If no destination was given, search the whole graph and keep the
+        # distances and predecessors for every reachable node.
+        if self.end is None:
+            self.distances, self.predecessors = self.search(self.graph, self.start)
+            self.path = None
+        else:
+            # Generate the shortest path from the given start to the destination.
+            self.path = self.generate_shortest_path(self.graph, self.start, self.end)
 
     # Returns the next node in the shortest path.
     # def next_node(self):
@@ -73,13 +108,18 @@ class ShortestPath:
         P = {}	# dictionary of predecessors
         Q = priorityDictionary()	# estimated distances of non-final vertices
         Q[start] = 0
+        nodes = self.nodes
+        row = getattr(G, 'row', None)
 
         for v in Q:
             D[v] = Q[v]
             if v == end: break
 
-            for w in G[v]:
-                vwLength = D[v] + G[v][w]
+            for w, vwWeight in (row(v) if row else G[v].iteritems()):
+                if nodes is not None and w not in nodes:
+                    continue
+
+                vwLength = D[v] + vwWeight
                 if w in D:
                     if vwLength < D[w]:
                         raise ValueError, "Dijkstra: found better path to already-final vertex"
@@ -89,6 +129,83 @@ class ShortestPath:
 
         return (D,P)
 
+    # Implements Dijkstra's algorithm using a binary heap, stopping as soon as
+    # the end node is reached. Has the same inputs and outputs as dijkstra.
+    def heap_dijkstra(self, G, start, end=None):
+        return self.astar(G, start, end, None)
+
+    # Implements A* search, given a graph G, start node_id, end node_id, and
+    # a heuristic giving a lower bound on the distance from a node_id to the
+    # end node. Has the same outputs as dijkstra, except that distances to
+    # vertices not yet finalized when the end is reached are only upper
+    # bounds. With no heuristic, this is Dijkstra's algorithm.
+    def astar(self, G, start, end, heuristic):
+        D = {start: 0}  # best known distances
+        P = {}          # dictionary of predecessors
+        done = set()    # vertices whose distances are final
+        nodes = self.nodes
+
+        # Graphs that list each vertex's edges in a row, such as a grid's
+        # Adjacency, are walked without building a neighbors dict per vertex.
+        row = getattr(G, 'row', None)
+
+        if heuristic is None:
+            heap = [(0, 0, start)]
+        else:
+            heap = [(heuristic(start), 0, start)]
+
+        while heap:
+            estimate, v_length, v = heapq.heappop(heap)
+
+            # Skip stale heap entries for vertices already finalized.
+            if v in done:
+                continue
+
+            done.add(v)
+
+            if v == end:
+                break
+
+            for w, vw_weight in (row(v) if row else G[v].iteritems()):
+                if nodes is not None and w not in nodes:
+                    continue
+
+                vw_length = v_length + vw_weight
+
+                if w not in D or vw_length < D[w]:
+                    D[w] = vw_length
+                    P[w] = v
+
+                    if heuristic is None:
+                        heapq.heappush(heap, (vw_length, vw_length, w))
+                    else:
+                        heapq.heappush(heap, (vw_length + heuristic(w), vw_length, w))
+
+        return (D,P)
+
+    # Returns the A* heuristic for our coordinates: the scaled straight-line
+    # distance from a node_id to the given end node_id.
+    def straight_line_heuristic(self, end):
+        coordinates = self.coordinates
+        scale = self.heuristic_scale
+        end_x, end_y = coordinates[end]
+
+        def heuristic(v):
+            x, y = coordinates[v]
+            return scale * math.hypot(x - end_x, y - end_y)
+
+        return heuristic
+
+    # Searches from the start node_id, using the chosen algorithm.
+    def search(self, G, start, end=None):
+        if self.method == 'legacy':
+            return self.dijkstra(G, start, end)
+
+        if self.method == 'astar' and end is not None:
+            return self.astar(G, start, end, self.straight_line_heuristic(end))
+
+        return self.heap_dijkstra(G, start, end)
+
     # Finds the shortest path given a graph G, start node_id, and end node_id.
     def generate_shortest_path(self, G, start, end):
         """
@@ -97,7 +214,7 @@ class ShortestPath:
         The output is a list of the vertices in order along the shortest path.
         """
 
-        D,P = self.dijkstra(G,start,end)
+        D,P = self.search(G,start,end)
         Path = []
         while 1:
             Path.append(end)
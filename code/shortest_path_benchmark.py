@@ -0,0 +1,184 @@
+import sys
+import getopt
+import json
+import random
+import time
+from grid import Grid
+from shortest_path import ShortestPath
+
+class ShortestPathBenchmark:
+    """
+    Compares the shortest path search algorithms on a map, timing the same
+    queries with each of them and checking that they agree on path lengths.
+    """
+
+    METHODS = ['legacy', 'dijkstra', 'astar']
+
+    """
+    Creates a new ShortestPathBenchmark.
+
+    Args:
+      grid: Grid. The grid whose graph is searched.
+      num_queries: Integer. Number of queries of each kind to time.
+      detour_hops: Integer. Maximum number of hops between the ends of a
+        detour query.
+      seed: Integer. Seed for choosing queries.
+
+    Returns:
+      A new ShortestPathBenchmark object.
+
+    """
+    def __init__(self, grid, num_queries, detour_hops, seed):
+        self.grid = grid
+        self.num_queries = num_queries
+        self.detour_hops = detour_hops
+        self.rng = random.Random(seed)
+
+    # Generates (start, end) pairs between random entrances and destinations,
+    # like the queries made during preprocessing.
+    def route_queries(self):
+        return [(self.rng.choice(self.grid.entrance_nodes).node_id,
+                 self.rng.choice(self.grid.destination_nodes).node_id)
+                for i in range(self.num_queries)]
+
+    # Generates (start, end) pairs a few hops apart, like the detour queries
+    # made by pedestrians who are blocked.
+    def detour_queries(self):
+        node_ids = self.grid.neighbors_dict.keys()
+        queries = []
+
+        while len(queries) < self.num_queries:
+            start = self.rng.choice(node_ids)
+            end = start
+
+            # Take a short random walk from the start.
+            for hop in range(self.rng.randint(2, self.detour_hops)):
+                neighbors = self.grid.neighbors_dict[end].keys()
+
+                if not neighbors:
+                    break
+
+                end = self.rng.choice(neighbors)
+
+            if end != start:
+                queries.append((start, end))
+
+        return queries
+
+    # Computes the length of a path.
+    def path_length(self, path):
+        return sum(self.grid.neighbors_dict[path[i]][path[i+1]]
+                   for i in range(len(path) - 1))
+
+    # Times every method on the given queries. Returns a dict of results for
+    # each method.
+    def time_queries(self, queries):
+        results = {}
+        lengths = {}
+
+        for method in self.METHODS:
+            start_time = time.time()
+
+            paths = [ShortestPath(self.grid.neighbors_dict, start, end,
+                                  method=method,
+                                  coordinates=self.grid.coordinates,
+                                  heuristic_scale=self.grid.heuristic_scale).path
+                     for start, end in queries]
+
+            elapsed = time.time() - start_time
+            lengths[method] = [self.path_length(path) for path in paths]
+
+            results[method] = {
+                'total_s': elapsed,
+                'ms_per_query': 1000 * elapsed / len(queries),
+            }
+
+        # Every method must find paths of the same length as the original
+        # implementation.
+        for method in self.METHODS:
+            mismatches = sum(1 for a, b in zip(lengths[method], lengths['legacy'])
+                             if abs(a - b) > 1e-6)
+            results[method]['length_mismatches'] = mismatches
+            results[method]['speedup'] = results['legacy']['total_s'] / results[method]['total_s']
+
+        return results
+
+    # Runs the benchmark. Returns the results.
+    def run(self):
+        results = {
+            'num_nodes': len(self.grid.neighbors_dict),
+            'num_queries': self.num_queries,
+            'routes': self.time_queries(self.route_queries()),
+            'detours': self.time_queries(self.detour_queries()),
+        }
+
+        for kind in ('routes', 'detours'):
+            print('%s:' % kind)
+
+            for method in self.METHODS:
+                res = results[kind][method]
+                print('  %-8s %9.3f ms/query  %6.2fx  %d length mismatches'
+                      % (method, res['ms_per_query'], res['speedup'],
+                         res['length_mismatches']))
+
+        return results
+
+def main(argv):
+    node_file = './map/nodes.csv'
+    edge_file = './map/edges.csv'
+    intersection_file = './map/intersections.csv'
+    num_queries = 200
+    detour_hops = 10
+    seed = 1
+    output_file = None
+
+    help_message = ('shortest_path_benchmark.py -n <nodesCsv> -e <edgesCsv> '
+                    '-i <intersectionsCsv> -q <int numQueries> '
+                    '-d <int detourHops> -s <int seed> -o <jsonOutputFile>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'hn:e:i:q:d:s:o:',['help', 'nodes=', 'edges=',
+                                                          'intersections=', 'queries=',
+                                                          'hops=', 'seed=', 'output='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-n', '--nodes'):
+            node_file = arg
+        elif opt in ('-e', '--edges'):
+            edge_file = arg
+        elif opt in ('-i', '--intersections'):
+            intersection_file = arg
+        elif opt in ('-q', '--queries'):
+            num_queries = int(arg)
+        elif opt in ('-d', '--hops'):
+            detour_hops = int(arg)
+        elif opt in ('-s', '--seed'):
+            seed = int(arg)
+        elif opt in ('-o', '--output'):
+            output_file = arg
+
+    grid = Grid({
+        'node_file': node_file,
+        'edge_file': edge_file,
+        'intersection_file': intersection_file,
+        'closed_intersections': [],
+        'type_map': { 'sidewalk': 1, 'crosswalk': 2, 'entrance': 3, 'exit': 4 },
+        'routing': 'none',
+    })
+
+    results = ShortestPathBenchmark(grid, num_queries, detour_hops, seed).run()
+
+    if output_file:
+        with open(output_file, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
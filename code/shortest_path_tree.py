@@ -0,0 +1,87 @@
+from shortest_path import ShortestPath
+
+class ShortestPathTree(object):
+    """
+    A shortest path tree rooted at a single destination node. Gives the next
+    node toward the destination for every node in the graph that can reach it.
+    """
+
+
+    """
+    Creates a new ShortestPathTree instance.
+
+    Since our pedestrian graph is undirected, a single run of Dijkstra's
+    algorithm outward from the destination finds the shortest path from every
+    node to that destination: the predecessor of a node in that search is the
+    next node on its way to the destination.
+
+    Args:
+      graph: Dictionary. Graph in the format expected by ShortestPath.
+      root: Integer. The node_id of the destination node at the root of the
+        tree.
+
+    Returns:
+      A new ShortestPathTree object.
+
+    """
+    def __init__(self, graph, root):
+        self.root = root
+
+        # Search the whole graph outward from the root.
+        search = ShortestPath(graph, root)
+
+        # Distance from every reachable node to the root.
+        self.distances = search.distances
+
+        # Next node toward the root for every reachable node (other than the
+        # root itself).
+        self.next_hops = search.predecessors
+
+    # Returns the shortest path from the given node to the root as a list of
+    # node_ids, or None if the root can't be reached from the node.
+    def path_from(self, node_id):
+        if node_id not in self.distances:
+            return None
+
+        path = [node_id]
+
+        while node_id != self.root:
+            node_id = self.next_hops[node_id]
+            path.append(node_id)
+
+        return path
+
+    # Returns the data needed to rebuild the tree, for writing to a paths file.
+    def to_data(self):
+        return { 'next_hops': self.next_hops, 'distances': self.distances }
+
+    # Builds a tree rooted at the given node_id by searching a CSRGraph,
+    # which is much faster than searching a neighbors dict.
+    @classmethod
+    def from_csr(cls, csr, root):
+        distances, predecessors = csr.dijkstra(csr.index_of(root))
+        node_ids = csr.node_ids.tolist()
+
+        tree = cls.__new__(cls)
+        tree.root = root
+        tree.distances = {}
+        tree.next_hops = {}
+
+        for indx, distance in enumerate(distances):
+            if distance != float('inf'):
+                tree.distances[node_ids[indx]] = distance
+
+                if predecessors[indx] >= 0:
+                    tree.next_hops[node_ids[indx]] = node_ids[predecessors[indx]]
+
+        return tree
+
+    # Rebuilds a tree from data previously returned by to_data.
+    @classmethod
+    def from_data(cls, root, data):
+        tree = cls.__new__(cls)
+        tree.root = root
+        tree.next_hops = data['next_hops']
+        tree.distances = data['distances']
+
+        return tree
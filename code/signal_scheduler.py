@@ -0,0 +1,142 @@
+import heapq
+
+class SignalPlan(object):
+    """
+    The timing plan of a signalized intersection: it is open to pedestrians
+    for green timesteps, then closed for red timesteps, repeating. The first
+    green phase starts at offset.
+    """
+
+
+    """
+    Creates a new SignalPlan.
+
+    Args:
+      green: Integer. Number of timesteps the intersection stays open.
+      red: Integer. Number of timesteps the intersection stays closed.
+      offset: Integer. Timestep at which a green phase starts.
+
+    Returns:
+      A new SignalPlan object.
+
+    """
+    def __init__(self, green, red, offset=0):
+        if green <= 0 or red <= 0:
+            raise ValueError('Signal phases must last at least one timestep.')
+
+        self.green = green
+        self.red = red
+        self.offset = offset
+
+    # Creates the plan of an intersection that changes state every period
+    # timesteps, opening at timestep 0.
+    @classmethod
+    def from_period(cls, period):
+        return cls(period, period)
+
+    # Length of a full green and red cycle.
+    def cycle(self):
+        return self.green + self.red
+
+    # Returns the state of the intersection at timestep 0 (True if open),
+    # and the timestep of its first change after that.
+    def initial_state(self):
+        phase = -self.offset % self.cycle()
+
+        if phase < self.green:
+            return True, self.green - phase
+        else:
+            return False, self.cycle() - phase
+
+    # Returns the number of timesteps the intersection stays in the given
+    # state.
+    def duration(self, is_open):
+        return self.green if is_open else self.red
+
+class SignalScheduler(object):
+    """
+    Keeps a calendar of upcoming signal changes, so each timestep only the
+    intersections whose state changes are visited.
+    """
+
+
+    """
+    Creates a new SignalScheduler.
+
+    Args:
+      plans: Dictionary. Lookup table of int_id -> SignalPlan for every
+        signalized intersection.
+
+    Returns:
+      A new SignalScheduler object.
+
+    """
+    def __init__(self, plans):
+        self.plans = plans
+
+        # Upcoming changes, as (timestep, int_id, is_open), earliest first.
+        # Every intersection is set to its initial state at timestep 0.
+        self.events = [(0, int_id, plan.initial_state()[0])
+                       for int_id, plan in plans.iteritems()]
+        heapq.heapify(self.events)
+
+    # Returns the (int_id, is_open) changes due at the given timestep, and
+    # schedules the change that follows each of them. Timesteps must be
+    # visited in increasing order.
+    def due(self, timestep):
+        changes = []
+
+        while self.events and self.events[0][0] <= timestep:
+            event_time, int_id, is_open = heapq.heappop(self.events)
+            changes.append((int_id, is_open))
+
+            plan = self.plans[int_id]
+
+            # The first change after timestep 0 may come part way through a
+            # phase, when the plan has an offset.
+            if event_time == 0:
+                next_time = plan.initial_state()[1]
+            else:
+                next_time = event_time + plan.duration(is_open)
+
+            heapq.heappush(self.events, (next_time, int_id, not is_open))
+
+        return changes
+
+    # Builds signal plans from a configuration's intersection_normal and
+    # intersection_corridor parameters. Returns a dict of int_id ->
+    # SignalPlan.
+    @staticmethod
+    def plans_from_config(parameters):
+        plans = {}
+
+        for param in parameters:
+            p_type = param.get('type')
+            data = param.get('data')
+
+            # Intersections timed individually, either changing state every
+            # 'time' timesteps, or with their own green, red and offset.
+            if p_type == 'intersection_normal':
+                for x in data.get('intersections'):
+                    if 'time' in x:
+                        green = red = int(x.get('time'))
+                    else:
+                        green = int(x.get('green'))
+                        red = int(x.get('red'))
+
+                    plans[int(x.get('id'))] = SignalPlan(green, red,
+                                                         int(x.get('offset', 0)))
+            # Coordinated corridors: intersections in order along a route
+            # share a cycle, and each one turns green 'progression' timesteps
+            # after the one before it.
+            elif p_type == 'intersection_corridor':
+                green = int(data.get('green'))
+                red = int(data.get('red'))
+                offset = int(data.get('offset', 0))
+                progression = int(data.get('progression', 0))
+
+                for i, int_id in enumerate(data.get('intersections')):
+                    plans[int(int_id)] = SignalPlan(green, red,
+                                                    offset + i * progression)
+
+        return plans
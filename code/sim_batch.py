@@ -4,8 +4,19 @@ import datetime
 import sys
 import getopt
 import json
+import random
+import hashlib
+import time
+import multiprocessing
+import collections
 from grid import Grid
 from simulation import Simulation
+from array_simulation import ArraySimulation
+from routing_cache import RoutingCache
+from signal_scheduler import SignalScheduler
+from custom_random import CustomRandom
+from results_store import ResultsStore
+from stopping_rule import RunningStats, StoppingRule
 
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
@@ -15,26 +26,57 @@ class SimBatch:
     Handles batch-running of multiple simulations.
     """
 
-    # Initialize a SimBatch.
-    def __init__(self, config_path):
+    # Initialize a SimBatch. If config, a dict in the format of a
+    # configuration file, is given, it is used instead of reading the file
+    # at config_path.
+    def __init__(self, config_path, config = None):
         # Dict with list of 'open' and 'closed' intersection ids.
         self.intersection_conf = {}
 
-        # Dict with time for intersections to open and close.
-        self.intersection_times = {}
+        # Dict with the timing plan (SignalPlan) of each signalized
+        # intersection.
+        self.signal_plans = {}
+
+        # Map files the grid is built from.
+        self.map_files = {
+            'node_file': './map/nodes.csv',
+            'edge_file': './map/edges.csv',
+            'intersection_file': './map/intersections.csv',
+        }
+
+        # Directory and size limit (in bytes) of the routing cache, used when
+        # no paths file is given.
+        self.cache_dir = './routing_cache'
+        self.cache_max_bytes = 2048 * 2**20
+
+        # Memory cap (in bytes) of the grid's cache of detour paths.
+        self.detour_cache_bytes = 64 * 2**20
 
         # Read in the config file at the given path.
         self.config_path = config_path
-        self.read_config(config_path)
+
+        if config is None:
+            self.read_config(config_path)
+        else:
+            self.load_config(config)
 
     # Reads a given configuration file.
     def read_config(self, config_path):
         with open(config_path) as config_json:
-            config = json.load(config_json)
+            self.load_config(json.load(config_json))
 
+    # Prepares the batch from a configuration dict.
+    def load_config(self, config):
         self.name = config.get('name')
         self.num_sims = int(config.get('num_sims'))
 
+        # Precision target for the mean number of timesteps, if runs are to
+        # be made until it is met rather than num_sims times.
+        self.precision = config.get('precision')
+
+        # Hash identifying the configuration in the results.
+        self.config_hash = hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+
         # Iterates through the given parameters, preparing the data for use
         # in managing the simulation.
         for param in config.get('parameters'):
@@ -43,25 +85,40 @@ class SimBatch:
                 self.intersection_conf['closed'] = [int(x) for x in param.get('data').get('intersections')]
             elif p_type == 'intersection_open':
                 self.intersection_conf['open'] = [int(x) for x in param.get('data').get('intersections')]
-            elif p_type == 'intersection_normal':
-                for x in (param.get('data').get('intersections')):
-                    self.intersection_times[int(x.get('id'))] = int(x.get('time'))
+
+        # Read the timing plans of the signalized intersections.
+        self.signal_plans = SignalScheduler.plans_from_config(config.get('parameters'))
+
+    # Returns the ids of the closed intersections, which determine the road
+    # topology the grid and its paths are built for, as a sorted tuple.
+    def topology(self):
+        return tuple(sorted(self.intersection_conf.get('closed') or []))
 
     # Initialize the underyling grid (i.e., graph) structure that will be used
-    # in the simulation.
-    def initialize_grid(self, paths_file = None):
+    # in the simulation. If given a grid already loaded from the batch's map
+    # files, it is set up for the batch's closed intersections rather than
+    # loading the map again.
+    def initialize_grid(self, paths_file = None, routing = 'pairs', grid = None):
         # Create a type map mapping human-readable node types to integer ids.
         type_map = { 'sidewalk': 1, 'crosswalk': 2, 'entrance': 3, 'exit': 4 }
-        self.grid = None
+        self.grid = grid
+
+        map_files = [self.map_files['node_file'], self.map_files['edge_file'],
+                     self.map_files['intersection_file']]
+        closed_intersections = self.intersection_conf.get('closed')
 
-        # Creates a new grid given a paths file.
-        def create_grid(paths_file = None, new_paths_file = None):
+        # Creates a new grid given a paths file, or sets up the existing one.
+        def create_grid(paths_file = None, new_paths_file = None, paths_key = None,
+                        base_paths_file = None, closed = closed_intersections):
             opts = {
-                'node_file': './map/nodes.csv',
-                'intersection_file': './map/intersections.csv',
-                'closed_intersections': self.intersection_conf.get('closed'),
-                'edge_file': './map/edges.csv',
+                'node_file': self.map_files['node_file'],
+                'intersection_file': self.map_files['intersection_file'],
+                'closed_intersections': closed,
+                'edge_file': self.map_files['edge_file'],
                 'type_map': type_map,
+                'routing': routing,
+                'paths_key': paths_key,
+                'detour_cache_bytes': self.detour_cache_bytes,
             }
 
             if paths_file:
@@ -70,14 +127,46 @@ class SimBatch:
             if new_paths_file:
                 opts['new_paths_file'] = new_paths_file
 
-            self.grid = Grid(opts)
+            if base_paths_file:
+                opts['base_paths_file'] = base_paths_file
+
+            if self.grid is None:
+                self.grid = Grid(opts)
+            else:
+                self.grid.set_topology(opts)
 
-        # If no paths file has been given to us, create one.
+        # If no paths file has been given to us, look for one built for this
+        # map and set of closed intersections in the routing cache, creating
+        # it if there is none.
         if paths_file == None:
-            # Create a grid object that contains the underlying nodes and path
-            # information.
-            self.pickle_name = self.name + '.pickle'
-            create_grid(None, self.pickle_name)
+            cache = RoutingCache(self.cache_dir, self.cache_max_bytes)
+            key = RoutingCache.key_for(map_files, closed_intersections, routing)
+            cached_file = cache.lookup(key, routing)
+
+            if cached_file:
+                print('---> Using cached paths file %s.' % cached_file)
+                self.pickle_name = cached_file
+                create_grid(self.pickle_name, None)
+            else:
+                # A routing table for closed intersections is repaired from
+                # the one for the map with every intersection open, which is
+                # built first if it isn't in the cache.
+                base_file = None
+
+                if routing == 'trees' and closed_intersections:
+                    base_key = RoutingCache.key_for(map_files, [], routing)
+                    base_file = cache.lookup(base_key, routing)
+
+                    if not base_file:
+                        pending_file = cache.pending_path_for(base_key, routing)
+                        create_grid(None, pending_file, base_key, closed=[])
+                        base_file = cache.commit(pending_file, base_key, routing)
+
+                # Write the new paths file under a temporary name, so an
+                # interrupted run never leaves a partial entry in the cache.
+                pending_file = cache.pending_path_for(key, routing)
+                create_grid(None, pending_file, key, base_file)
+                self.pickle_name = cache.commit(pending_file, key, routing)
         # If we have been given a paths file, use it.
         else:
             # Create a grid object that contains the underlying nodes and path
@@ -85,64 +174,295 @@ class SimBatch:
             self.pickle_name = paths_file
             create_grid(self.pickle_name, None)
 
+            # Routing tables and paths files record the map they were built
+            # for, so we can warn if this one doesn't match. Only pairs paths
+            # are written as paths files; trees are written as routing tables.
+            if self.grid.paths_file_key:
+                key = RoutingCache.key_for(map_files, closed_intersections,
+                                           'pairs' if self.grid.routing == 'pairs' else 'trees')
+
+                if self.grid.paths_file_key != key:
+                    print('WARNING: %s was built for a different map or set of '
+                          'closed intersections.' % paths_file)
+
     # Performs the key step - running of multiple simulations.
     def run_sims(self, params = {}):
+        self.configure(params)
+
         # Initialize the grid.
-        self.initialize_grid(params.get('paths_file', None))
+        self.initialize_grid(params.get('paths_file', None), self.routing)
+
+        self.open_results()
 
-        # Determine whether we are doing extra logging for verification
-        # purposes.
-        verification_logging = params.get('verification_logging', False)
+        # Assign every run its seed up front, so results don't depend on the
+        # order in which runs are carried out.
+        seeds = self.generate_seeds(self.num_replications(), params.get('seed', None))
 
-        # If so, and no directory for holding verification results has been
-        # created, create one.
-        if verification_logging and not os.path.exists('./verification'):
-            os.makedirs('./verification')
+        workers = params.get('workers', 1)
 
+        # Running mean and variance of the number of timesteps of each
+        # replication, and the timesteps of the runs of the current one.
+        self.stats = RunningStats()
+        self.replication_timesteps = []
+
+        try:
+            if workers > 1:
+                self.run_parallel(seeds, workers)
+            else:
+                # For each iteration in the given number of simulations,
+                for run_num, seed in enumerate(seeds):
+                    # Return the grid to its initial state after the previous run.
+                    if run_num > 0:
+                        self.grid.reset()
+
+                    if self.add_outputs(self.run_one(seed)):
+                        break
+        finally:
+            self.store.close()
+
+        if self.stopping_rule or self.replication_size > 1:
+            self.report_precision()
+
+    # Sets the options of the batch and of each simulation from the given
+    # parameters.
+    def configure(self, params):
+        # Determine how shortest paths are preprocessed if no paths file is
+        # given.
+        self.routing = params.get('routing', 'pairs')
+
+        self.cache_dir = params.get('cache_dir', self.cache_dir)
+        self.cache_max_bytes = params.get('cache_max_bytes', self.cache_max_bytes)
+        self.detour_cache_bytes = params.get('detour_cache_bytes', self.detour_cache_bytes)
+
+        # Options for each simulation. verification_logging determines
+        # whether we are doing extra logging for verification purposes.
+        self.sim_params = {
+            'num_pedestrians': params.get('num_pedestrians', 500),
+            'visualization': params.get('visualization', False),
+            'vis_image': './map/map.png',
+            'signal_plans': self.signal_plans,
+            'verification_logging': params.get('verification_logging', False),
+            'profile': params.get('profile', False),
+            'pedestrian_outputs': params.get('pedestrian_outputs', False)
+        }
+
+        # Whether to record each run's pedestrian positions, for rendering
+        # after the batch.
+        self.record_trajectories = params.get('record_trajectories', False)
+
+        # Simulation engine: 'objects' moves Pedestrian objects over Node
+        # objects; 'arrays' keeps the simulation state in NumPy arrays.
+        self.engine = params.get('engine', 'objects')
+
+        # Rule deciding when enough runs have been made, if the configuration
+        # or parameters give a precision target.
+        self.stopping_rule = StoppingRule.from_config(self.precision,
+                                                      half_width=params.get('half_width'),
+                                                      max_sims=params.get('max_sims'))
+
+        # Variance reduction: 'none', 'crn' (common random numbers) or
+        # 'antithetic'. Both split each run's random numbers into separate
+        # streams for each purpose, so scenarios run with the same seeds see
+        # the same pedestrians and arrivals. With 'antithetic', each
+        # replication is a pair of runs whose draws mirror each other.
+        self.variance_reduction = params.get('variance_reduction', 'none')
+
+        if self.variance_reduction != 'none':
+            self.sim_params['random_streams'] = 'split'
+
+        # Check the crowd fits in each run's random streams before any work
+        # is done, rather than in every run.
+        Simulation.check_random_draws(self.sim_params['num_pedestrians'],
+                                      self.variance_reduction != 'none')
+
+        self.replication_size = 2 if self.variance_reduction == 'antithetic' else 1
+
+        # Each replication's seed starts its own substream of the generator,
+        # and there are only so many of them. Check before any work is done,
+        # whether the limit comes from the configuration or the parameters.
+        if self.num_replications() > CustomRandom.num_substreams():
+            raise ValueError('%s asks for %d replications, but at most %d are possible.'
+                             % (self.name, self.num_replications(),
+                                CustomRandom.num_substreams()))
+
+    # Creates the results store the outputs of the batch are written to.
+    def open_results(self):
         # Create a directory for holding results if none exists yet.
         if not os.path.exists('./results'):
             os.makedirs('./results')
 
         # Determine the file path for our results file.
-        self.res_file_path = self.filename_with_time('./results/', self.name, '.txt')
-
-        # For each iteration in the given number of simulations,
-        for run_num in range(self.num_sims):
-            # Initialize our grid if it hasn't been already.
-            if run_num > 0:
-                self.initialize_grid(self.pickle_name)
-
-            # Create a simulation object.
-            simulation = Simulation(self.grid, {
-                'num_pedestrians': params.get('num_pedestrians', 500),
-                'visualization': params.get('visualization', False),
-                'vis_image': './map/map.png',
-                'intersection_times': self.intersection_times,
-                'verification_logging': verification_logging
-            })
+        results_base = self.filename_with_time('./results/', self.name, '')
+        self.res_file_path = results_base + '.txt'
 
-            # Do additional logging if necessary.
-            if verification_logging:
-                seed, res, ped_distribution = simulation.run()
-                # Write outputs to our results file.
-                self.write_outputs(seed, res, ped_distribution)
-            else:
-                seed, res = simulation.run()
-                # Write outputs to our results file.
-                self.write_outputs(seed, res)
+        # Results are buffered and written in batches.
+        self.store = ResultsStore(results_base, self.config_hash, self.engine)
+
+    # Returns the number of replications to make, at most. Each replication
+    # is one run, or an antithetic pair of runs, which together take about
+    # num_sims runs.
+    def num_replications(self):
+        if self.stopping_rule:
+            return self.stopping_rule.max_sims
+
+        return (self.num_sims + self.replication_size - 1) // self.replication_size
+
+    # Generates the seeds of the runs of each of the given number of
+    # replications. Each replication's seed starts its own substream of the
+    # generator seeded with master_seed, so the numbers drawn by different
+    # replications never overlap. The second run of an antithetic pair is
+    # seeded with the antithetic generator's seed.
+    def generate_seeds(self, num_replications, master_seed = None):
+        if master_seed == None:
+            master_seed = random.randrange(1, 2**31-1)
+
+        print('---> Master seed for this batch is %d.' % master_seed)
+
+        master_rng = CustomRandom(master_seed)
+        seeds = []
+
+        for i in range(num_replications):
+            generator = master_rng.substream(i)
+            seeds.append(generator.seed)
+
+            if self.replication_size == 2:
+                seeds.append(generator.antithetic().seed)
 
-    # Writes simulation outputs to a results file.
-    def write_outputs(self, seed, res, ped_distribution = None):
-        if ped_distribution:
-            ped_dist_path = self.filename_with_time('./verification/',
-                                                    self.name, '.json')
+        return seeds
 
-            with open(ped_dist_path, 'w') as outfile:
-                json.dump(ped_distribution, outfile)
+    # Runs a single simulation with the given seed on the current grid.
+    # Returns the simulation's outputs, as a dict.
+    def run_one(self, seed):
+        sim_params = dict(self.sim_params)
+        sim_params['seed'] = seed
 
-        with open(self.res_file_path, 'a+') as res_file:
-            write_string = str(seed) + ',' + str(res) + '\n'
-            res_file.write(write_string)
+        if self.record_trajectories:
+            sim_params['trajectory_file'] = self.trajectory_path(seed)
+
+        start_time = time.time()
+
+        # Create a simulation object.
+        if self.engine == 'arrays':
+            simulation = ArraySimulation(self.grid, sim_params)
+        else:
+            simulation = Simulation(self.grid, sim_params)
+
+        res = simulation.run()
+
+        outputs = {
+            'seed': seed,
+            'timesteps': res[1],
+            'num_pedestrians': sim_params['num_pedestrians'],
+            'wall_s': time.time() - start_time,
+            'ped_distribution': res[2] if len(res) > 2 else None,
+            'pedestrians': simulation.pedestrian_outputs(),
+        }
+
+        # Write the run's profile next to the results file.
+        if simulation.profiler:
+            simulation.profiler.save(self.profile_path(seed), {
+                'seed': seed,
+                'engine': self.engine,
+                'num_pedestrians': sim_params['num_pedestrians'],
+            })
+
+        return outputs
+
+    # Returns the path of the profile of the run with the given seed.
+    def profile_path(self, seed):
+        return '%s_%d.profile.json' % (os.path.splitext(self.res_file_path)[0], seed)
+
+    # Returns the path of the trajectory file of the run with the given seed.
+    def trajectory_path(self, seed):
+        return '%s_%d.traj' % (os.path.splitext(self.res_file_path)[0], seed)
+
+    # Adds the outputs of a run to the results. Returns whether the stopping
+    # rule, if there is one, says to stop making runs.
+    def add_outputs(self, outputs):
+        self.store.add(outputs)
+        self.replication_timesteps.append(outputs['timesteps'])
+
+        # Wait for the rest of the replication's runs.
+        if len(self.replication_timesteps) < self.replication_size:
+            return False
+
+        self.stats.add(float(sum(self.replication_timesteps)) / self.replication_size)
+        self.replication_timesteps = []
+
+        if not self.stopping_rule:
+            return False
+
+        rule = self.stopping_rule
+        print('---> Replication %d: mean %.3f timesteps, std %.3f, %g%% CI half-width %.3f '
+              '(target %.3f).' % (self.stats.n, self.stats.mean, self.stats.std(),
+                                  100 * rule.confidence,
+                                  self.stats.half_width(rule.confidence), rule.half_width))
+
+        return rule.done(self.stats)
+
+    # Prints the estimated mean number of timesteps and its confidence
+    # interval, and whether the precision target, if any, was met.
+    def report_precision(self):
+        rule = self.stopping_rule
+        confidence = rule.confidence if rule else 0.95
+        half_width = self.stats.half_width(confidence)
+
+        if not rule:
+            print('---> %d replications: %.3f +/- %.3f timesteps (%g%% CI).'
+                  % (self.stats.n, self.stats.mean, half_width, 100 * confidence))
+        elif rule.met(self.stats):
+            print('---> Precision target met after %d replications: %.3f +/- %.3f timesteps.'
+                  % (self.stats.n, self.stats.mean, half_width))
+        else:
+            print('---> Stopped after %d replications without meeting the precision target: '
+                  '%.3f +/- %.3f timesteps.' % (self.stats.n, self.stats.mean, half_width))
+
+    # Runs simulations for the given seeds on a pool of worker processes,
+    # each of which loads the grid once. Outputs are written in seed order.
+    def run_parallel(self, seeds, workers):
+        if self.sim_params['visualization']:
+            print('Visualization is not available with multiple workers. Disabling it.')
+            self.sim_params['visualization'] = False
+
+        # With a stopping rule, only about one run per worker is queued at a
+        # time, so few runs are wasted once the rule says to stop. Runs are still
+        # added in seed order, so the batch stops after the same runs as it
+        # would with one worker.
+        window = workers if self.stopping_rule else len(seeds)
+
+        pool = multiprocessing.Pool(workers, init_worker, (self,))
+        pending = collections.deque()
+        next_seed = 0
+
+        try:
+            while pending or next_seed < len(seeds):
+                while len(pending) < window and next_seed < len(seeds):
+                    pending.append(pool.apply_async(run_worker, (seeds[next_seed],)))
+                    next_seed += 1
+
+                if self.add_outputs(pending.popleft().get()):
+                    break
+
+            # Drop any runs still queued once the rule says to stop.
+            if pending:
+                pool.terminate()
+            else:
+                pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    # Returns the state needed to rebuild this batch in a worker process that
+    # isn't forked from this one, leaving out the grid, which the worker loads
+    # itself, and the results store, which only the parent process writes to.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['grid'] = None
+        state['store'] = None
+
+        return state
 
     # Builds a filename including a timestamp.
     def filename_with_time(self, dirname, filename, ext):
@@ -151,6 +471,26 @@ class SimBatch:
 
         return dirname + filename + '_' + time_now() + ext
 
+# The SimBatch in use by a worker process.
+worker_batch = None
+
+# Initializes a worker process with the given batch. A worker forked from the
+# parent process shares the parent's grid. Otherwise, the grid is loaded from
+# the batch's paths file.
+def init_worker(batch):
+    global worker_batch
+
+    worker_batch = batch
+
+    if worker_batch.grid is None:
+        worker_batch.initialize_grid(batch.pickle_name, batch.routing)
+
+# Runs a single simulation in a worker process.
+def run_worker(seed):
+    worker_batch.grid.reset()
+
+    return worker_batch.run_one(seed)
+
 def main(argv):
     # Initialize some parameters.
     config_file = None
@@ -158,16 +498,44 @@ def main(argv):
     vis_boolean = False
     paths_file = None
     verification_logging = False
+    routing = 'pairs'
+    cache_dir = './routing_cache'
+    cache_size = 2048
+    workers = 1
+    master_seed = None
+    engine = 'objects'
+    detour_cache_size = 64
+    profile = False
+    record_trajectories = False
+    pedestrian_outputs = False
+    half_width = None
+    max_sims = None
+    variance_reduction = 'none'
 
     help_message = ('sim_batch.py -c <configJsonFile> -p <int numPeds> '
                     '-v <t/f vizBoolean> -f <pathsFile> '
-                    '-V <t/f verificationBoolean>')
+                    '-V <t/f verificationBoolean> -r <pairs/trees routing> '
+                    '-C <cacheDir> -S <int cacheSizeMB> -w <int workers> '
+                    '-s <int masterSeed> -e <objects/arrays engine> '
+                    '-D <int detourCacheMB> -P <t/f profileBoolean> '
+                    '-T <t/f recordTrajectoriesBoolean> '
+                    '-O <t/f pedestrianOutputsBoolean> '
+                    '-H <float ciHalfWidth> -M <int maxSims> '
+                    '-R <none/crn/antithetic varianceReduction>\n'
+                    'A batch makes at most 511 replications, of at most 1398101 '
+                    'pedestrians (524288 with -R crn/antithetic).')
 
     # Retrieve command line arguments.
     try:
-        opts, args = getopt.getopt(argv,'hc:p:v:f:V:',['help', 'config=',
-                                                      'peds=', 'viz=', 'pfile=',
-                                                      'verify='])
+        opts, args = getopt.getopt(argv,'hc:p:v:f:V:r:C:S:w:s:e:D:P:T:O:H:M:R:',['help', 'config=',
+                                                                        'peds=', 'viz=', 'pfile=',
+                                                                        'verify=', 'routing=',
+                                                                        'cache=', 'cache-size=',
+                                                                        'workers=', 'seed=',
+                                                                        'engine=', 'detour-cache=',
+                                                                        'profile=', 'record=',
+                                                                        'ped-outputs=', 'half-width=',
+                                                                        'max-sims=', 'reduction='])
     except getopt.GetoptError:
         print(help_message)
         sys.exit(2)
@@ -193,6 +561,41 @@ def main(argv):
                 verification_logging = True
             else:
                 verification_logging = False
+        elif opt in ('-r', '--routing'):
+            routing = arg
+        elif opt in ('-C', '--cache'):
+            cache_dir = arg
+        elif opt in ('-S', '--cache-size'):
+            cache_size = int(arg)
+        elif opt in ('-w', '--workers'):
+            workers = int(arg)
+        elif opt in ('-s', '--seed'):
+            master_seed = int(arg)
+        elif opt in ('-e', '--engine'):
+            engine = arg
+        elif opt in ('-D', '--detour-cache'):
+            detour_cache_size = int(arg)
+        elif opt in ('-P', '--profile'):
+            if arg == 't' or arg == 'T':
+                profile = True
+            else:
+                profile = False
+        elif opt in ('-T', '--record'):
+            if arg == 't' or arg == 'T':
+                record_trajectories = True
+            else:
+                record_trajectories = False
+        elif opt in ('-O', '--ped-outputs'):
+            if arg == 't' or arg == 'T':
+                pedestrian_outputs = True
+            else:
+                pedestrian_outputs = False
+        elif opt in ('-H', '--half-width'):
+            half_width = float(arg)
+        elif opt in ('-M', '--max-sims'):
+            max_sims = int(arg)
+        elif opt in ('-R', '--reduction'):
+            variance_reduction = arg
 
     if config_file == None:
         print 'config file was not given (json file)'
@@ -206,8 +609,33 @@ def main(argv):
         print 'visualization boolean was not given (t/f)'
         sys.exit(2)
 
+    if routing not in ('pairs', 'trees'):
+        print 'routing must be one of pairs or trees'
+        sys.exit(2)
+
+    if engine not in ('objects', 'arrays'):
+        print 'engine must be one of objects or arrays'
+        sys.exit(2)
+
+    if variance_reduction not in ('none', 'crn', 'antithetic'):
+        print 'variance reduction must be one of none, crn or antithetic'
+        sys.exit(2)
+
+    # Each run's seed starts its own substream of the generator, and there
+    # are only so many of them.
+    max_runs = CustomRandom.num_substreams()
+
+    if max_sims != None and max_sims > max_runs:
+        print 'maximum number of simulations must be at most %d' % max_runs
+        sys.exit(2)
+
+    # The array engine routes pedestrians from any node, so it needs trees.
+    if engine == 'arrays' and paths_file == None and routing != 'trees':
+        print 'the arrays engine needs trees routing. using trees.'
+        routing = 'trees'
+
     if paths_file == None:
-        print 'no paths file given. creating a new one for this simulation.'
+        print 'no paths file given. using the routing cache in %s.' % cache_dir
 
     # Initialize a new SimBatch.
     sb = SimBatch(config_file)
@@ -217,7 +645,20 @@ def main(argv):
         'num_pedestrians': num_peds,
         'visualization': vis_boolean,
         'paths_file': paths_file,
-        'verification_logging': verification_logging
+        'verification_logging': verification_logging,
+        'routing': routing,
+        'cache_dir': cache_dir,
+        'cache_max_bytes': cache_size * 2**20,
+        'workers': workers,
+        'seed': master_seed,
+        'engine': engine,
+        'detour_cache_bytes': detour_cache_size * 2**20,
+        'profile': profile,
+        'record_trajectories': record_trajectories,
+        'pedestrian_outputs': pedestrian_outputs,
+        'half_width': half_width,
+        'max_sims': max_sims,
+        'variance_reduction': variance_reduction
     }
 
     # Run the simulations.
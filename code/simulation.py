@@ -1,9 +1,13 @@
 from printer import Printer
-from pedestrian import Pedestrian
+from pedestrian_stream import PedestrianStream
 from custom_random import CustomRandom
-# Python's random module is only used for generating random seeds for our own
-# generator.
+from signal_scheduler import SignalPlan, SignalScheduler
+from profiler import Profiler
+from trajectory import TrajectoryWriter
+# Python's random module is used for generating random seeds for our own
+# generator, and for shuffling neighbors when pedestrians are blocked.
 import random
+import math
 # Numpy is used for drawing samples from a Poisson distribution for modeling
 # pedestrian arrivals.
 import numpy as np
@@ -20,6 +24,12 @@ class Simulation:
     CELL_WIDTH = 0.5
     PEDS_RATE = 0.81
 
+    # Substreams of a run's generator used with split random streams, in
+    # order, and the number of draws in each. Together they fit in the
+    # substream each run of a batch is given.
+    STREAMS = ['routes', 'speeds', 'arrivals', 'movement']
+    STREAM_LENGTH = CustomRandom.SUBSTREAM_LENGTH // 4
+
     # Initialize the simulation.
     def __init__(self, grid, params = {}):
         self.grid = grid
@@ -27,9 +37,34 @@ class Simulation:
         self.visualization = params.get('visualization', False)
         self.vis_image = params.get('vis_image', './map/map.png')
         self.seed = params.get('seed', random.randrange(1, 2**31-1))
+
+        # With split random streams, route choices, speeds, arrivals and
+        # movement each draw from their own substream of the generator, so
+        # they stay in step across runs of different scenarios with the same
+        # seed, and every draw but movement is antithetic in the run seeded
+        # with M - seed.
+        self.split_streams = params.get('random_streams', 'shared') == 'split'
         self.intersection_times = params.get('intersection_times', {})
+        self.signal_plans = params.get('signal_plans', None)
+
+        # Intersections given only a time change state every time timesteps.
+        if self.signal_plans is None:
+            self.signal_plans = dict((int_id, SignalPlan.from_period(int_time))
+                                     for int_id, int_time in self.intersection_times.iteritems())
         self.verification_logging = params.get('verification_logging', False)
 
+        # File to record pedestrian positions to for rendering after the
+        # run, and the number of timesteps between recorded steps.
+        self.trajectory_file = params.get('trajectory_file', None)
+        self.trajectory_interval = params.get('trajectory_interval', 1)
+
+        # Whether to collect the entry and egress timesteps and path length
+        # of every pedestrian.
+        self.collect_pedestrians = params.get('pedestrian_outputs', False)
+
+        # Profiler timing each phase of the simulation, if profiling.
+        self.profiler = Profiler() if params.get('profile', False) else None
+
         # Initialize the random number generators.
         self.initialize_rng()
 
@@ -40,36 +75,82 @@ class Simulation:
         # simulation.
         self.determine_peds_per_second()
 
+        # Create the stream of per-timestep pedestrian arrival counts.
+        self.arrival_counts = self.generate_arrival_counts()
+
     # Runs the simulation.
     def run(self):
         Printer.pp('Initializing simulation.')
 
         return self.run_simulation()
 
+    # Raises ValueError if runs with the given number of pedestrians would
+    # draw past the end of their random streams, into the numbers of another
+    # stream or of the next run of a batch. With a single stream, each
+    # pedestrian takes three draws from the run's substream. With split
+    # streams, each pedestrian takes two draws from the routes stream and one
+    # from the speeds stream; movement only takes its seed from its stream,
+    # and arrivals are checked as they are drawn.
+    @classmethod
+    def check_random_draws(cls, num_pedestrians, split_streams):
+        if split_streams and 2 * num_pedestrians > cls.STREAM_LENGTH:
+            raise ValueError('Split random streams hold %d draws each, enough for at most '
+                             '%d pedestrians, not %d.'
+                             % (cls.STREAM_LENGTH, cls.STREAM_LENGTH // 2, num_pedestrians))
+
+        if not split_streams and 3 * num_pedestrians > CustomRandom.SUBSTREAM_LENGTH:
+            raise ValueError('Each run draws from a substream of %d numbers, enough for at '
+                             'most %d pedestrians, not %d.'
+                             % (CustomRandom.SUBSTREAM_LENGTH,
+                                CustomRandom.SUBSTREAM_LENGTH // 3, num_pedestrians))
+
     # Initializes the random number generator.
     def initialize_rng(self):
+        if self.split_streams:
+            # A single run's draws can only overlap other runs' in a batch,
+            # which checks them itself, but its split streams can overlap
+            # each other.
+            self.check_random_draws(self.num_pedestrians, True)
+
+            generator = CustomRandom(self.seed)
+            streams = dict((name, generator.substream(i, self.STREAM_LENGTH))
+                           for i, name in enumerate(self.STREAMS))
+
+            self.rng = streams['routes']
+            self.speed_rng = streams['speeds']
+            self.arrival_rng = streams['arrivals']
+
+            # Movement shuffles neighbors with Python's generator, seeded
+            # from its own substream.
+            self.movement_seed = streams['movement'].seed
+            random.seed(self.movement_seed)
+
+            return
+
         # Initialize our custom random number generator.
         self.rng = CustomRandom(self.seed)
+        self.speed_rng = None
+        self.arrival_rng = None
+        self.movement_seed = self.seed
 
         # Seed numpy's random number generator, for sampling from the Poisson
         # distribution.
         np.random.seed(self.seed)
 
+        # Seed Python's random number generator too, so a simulation is fully
+        # determined by its seed.
+        random.seed(self.seed)
+
     # Seeds the simulation with pedestrians.
     def seed_pedestrians(self):
-        # Find the number of entrance, and destination nodes.
-        num_entrance_nodes = len(self.grid.entrance_nodes)
-        num_destination_nodes = len(self.grid.destination_nodes)
-
         # Create the speed distribution used for sampling from, to give
         # each pedestrian a random speed.
         speed_distribution = self.generate_speed_distribution()
 
-        # Create the queue of pedestrians (input stream).
-        self.ped_queue = [self.generate_pedestrian(num_entrance_nodes,
-                                                   num_destination_nodes,
-                                                   speed_distribution)
-                          for i in range(self.num_pedestrians)]
+        # Create the queue of pedestrians (input stream). Pedestrians are
+        # generated as they enter the simulation.
+        self.ped_queue = PedestrianStream(self.grid, self.rng, self.num_pedestrians,
+                                          speed_distribution, speed_rng=self.speed_rng)
 
     # Generates speed distribution for sampling from (see Blue & Adler, 2001).
     def generate_speed_distribution(self):
@@ -80,26 +161,82 @@ class Simulation:
         # Return the list, which corresponds to the distribution.
         return distribution
 
-    # Generate a new pedestrian.
-    def generate_pedestrian(self, num_entrance_nodes, num_destination_nodes, speed_distribution):
-        # Select an entrance node and destination node at random.
-        entrance_node = self.grid.entrance_nodes[self.rng.random_in_range(0, num_entrance_nodes-1)]
-        destination_node = self.grid.destination_nodes[self.rng.random_in_range(0, num_destination_nodes-1)]
+    # Generates the number of pedestrians arriving in each timestep, drawing
+    # them from the Poisson distribution in batches. Gives the same sequence
+    # as drawing one per timestep.
+    def generate_arrival_counts(self, batch_size=1024):
+        if self.arrival_rng:
+            # Invert the distribution function, so each count is a monotone
+            # function of one uniform draw.
+            cdf = self.poisson_cdf(self.entry_rate)
+            drawn = 0
+
+            while True:
+                # Each timestep takes one draw, and a run longer than the
+                # stream would run into the movement stream.
+                drawn += batch_size
+
+                if drawn > self.STREAM_LENGTH:
+                    raise ValueError('The run took more timesteps than its arrivals stream '
+                                     'holds draws (%d).' % self.STREAM_LENGTH)
+
+                for count in np.searchsorted(cdf, self.arrival_rng.uniform_batch(batch_size),
+                                             side='right'):
+                    yield count
+
+        while True:
+            for count in np.random.poisson(self.entry_rate, batch_size):
+                yield count
 
-        # Select a random speed from the speed distribution.
-        speed = speed_distribution[self.rng.random_in_range(0, 99)]
+    # Returns the cumulative distribution function of the Poisson
+    # distribution with the given rate, as an array over 0, 1, ... up to a
+    # count whose upper tail is negligible.
+    def poisson_cdf(self, rate):
+        if rate == 0:
+            return np.ones(1)
 
-        # Initialize a new Pedestrian object.
-        new_ped = Pedestrian(entrance_node, destination_node, speed, self.grid.node_dict)
+        counts = np.arange(int(rate + 12 * math.sqrt(rate) + 20))
+        log_pmf = counts * math.log(rate) - rate - np.array([math.lgamma(k + 1) for k in counts])
+        cdf = np.cumsum(np.exp(log_pmf))
+        cdf[-1] = 1.0
 
-        # Return the pedestrian.
-        return new_ped
+        return cdf
 
     # Determine the number of peds/s that will enter the simulation.
     def determine_peds_per_second(self):
         total_entrance_space = len(self.grid.entrance_nodes) * self.CELL_WIDTH
         self.entry_rate = int(total_entrance_space / self.PEDS_RATE)
 
+    # Creates the arrays holding the entry and egress timesteps and path
+    # length of each pedestrian, in the order they enter. -1 marks a
+    # pedestrian that hasn't entered or left.
+    def init_pedestrian_outputs(self):
+        self.ped_entry = np.empty(self.num_pedestrians, dtype=np.int32)
+        self.ped_entry.fill(-1)
+        self.ped_egress = np.empty(self.num_pedestrians, dtype=np.int32)
+        self.ped_egress.fill(-1)
+        self.ped_path_length = np.zeros(self.num_pedestrians, dtype=np.int32)
+
+    # Returns the per-pedestrian outputs of the simulation, if they were
+    # collected.
+    def pedestrian_outputs(self):
+        if not self.collect_pedestrians:
+            return None
+
+        return {
+            'entry': self.ped_entry,
+            'egress': self.ped_egress,
+            'path_length': self.ped_path_length,
+        }
+
+    # Creates the writer recording pedestrian positions, if recording.
+    def init_trajectory(self):
+        if self.trajectory_file:
+            return TrajectoryWriter(self.trajectory_file, self.grid.nodes,
+                                    self.trajectory_interval)
+
+        return None
+
     # Initialize the Visualization plot.
     def init_viz(self):
         # Set interactive plot on and create figure.
@@ -132,10 +269,33 @@ class Simulation:
         # Create a list to hold active pedestrians.
         active_peds = []
 
+        # Count detour cache lookups for this simulation only.
+        self.grid.detour_cache.reset_stats()
+
+        # Number of cells moved by pedestrians.
+        self.num_moves = 0
+
+        # Number of pedestrians that have entered the SUI.
+        num_entered = 0
+
+        if self.collect_pedestrians:
+            self.init_pedestrian_outputs()
+
+        profiler = self.profiler
+
+        if profiler:
+            start_time = profiler.clock()
+
         # If visualization has been selected, initialize the plot.
         if self.visualization:
             self.init_viz()
 
+        # If recording has been selected, open the trajectory file.
+        trajectory = self.init_trajectory()
+
+        # Create the calendar of signal changes.
+        signals = SignalScheduler(self.signal_plans)
+
         # Create a timestep counter.
         timesteps = 0
 
@@ -161,68 +321,106 @@ class Simulation:
                 print('Finished!')
                 break
 
+            if profiler:
+                phase_start = profiler.clock()
+
             # If there are pedestrians remaining in our queue,
             if ped_queue_length > 0:
                 # Add a number of pedestrians to our SUI corresponding to our
                 # computed entry rate.
-                for each_ped in range(0, np.random.poisson(self.entry_rate)):
+                for each_ped in range(0, next(self.arrival_counts)):
                     # If our queue is empty, break from the loop.
                     if len(self.ped_queue) == 0:
                         break
 
-                    # Retrieve the next pedestrian in the queue.
-                    next_ped = self.ped_queue[0]
-
                     # If we're doing extra verification, log the proposed
                     # addition of the ped to the simulation.
                     if self.verification_logging:
                         num_peds_entering_sim += 1
 
-                    # If her entry node is available, remove her from the queue
-                    # and add her to the SUI.
-                    if next_ped.current.available:
-                        active_peds.append(self.ped_queue.pop(0))
+                    # If the next pedestrian's entry node is available, remove
+                    # her from the queue and add her to the SUI.
+                    if self.ped_queue.next_entrance().available:
+                        ped = self.ped_queue.pop()
+                        active_peds.append(ped)
+
+                        if self.collect_pedestrians:
+                            ped.index = num_entered
+                            self.ped_entry[num_entered] = timesteps
+
+                        num_entered += 1
 
             active_peds_remaining = len(active_peds)
 
+            if profiler:
+                phase_start = profiler.add('arrivals', phase_start)
+
             # Print the remaining pedestrians, and pedestrian queue count.
             if timesteps % 10 == 0:
                 print('%d active peds remaining to evacuate. Ped queue count '
                       'is %d.' % (active_peds_remaining, len(self.ped_queue)))
 
-            # For every regular intersection,
-            for int_id, int_time in self.intersection_times.iteritems():
-                # If intersection change time is reached,
-                if timesteps % int_time == 0:
-                    intersection = self.grid.intersections_dict.get(int_id)
-                    # Change the intersection state.
-                    if intersection.is_open:
-                        intersection.close_me()
-                    else:
-                        intersection.open_me()
+            if profiler:
+                phase_start = profiler.add('printing', phase_start)
 
-            # For every active pedestrian,
-            for indx, ped in enumerate(active_peds):
-                # If the ped is finished,
-                if ped.egress_complete:
-                    # Remove her.
-                    del active_peds[indx]
-                    continue
+            # For every signalized intersection changing state this timestep,
+            for int_id, is_open in signals.due(timesteps):
+                intersection = self.grid.intersections_dict.get(int_id)
+                # Change the intersection state.
+                if is_open:
+                    intersection.open_me()
+                else:
+                    intersection.close_me()
 
+            if profiler:
+                phase_start = profiler.add('signals', phase_start)
+
+            # Record the peds who finished in the last step.
+            if self.collect_pedestrians:
+                for ped in active_peds:
+                    if ped.egress_complete:
+                        self.ped_egress[ped.index] = timesteps - 1
+                        self.ped_path_length[ped.index] = ped.cells_moved
+
+            # Remove the peds who finished in the last step, in a single pass
+            # over the list.
+            active_peds = [ped for ped in active_peds if not ped.egress_complete]
+
+            # For every active pedestrian,
+            for ped in active_peds:
                 # Move the ped.
                 for i in range(0, ped.speed):
-                    ped.move(ped.target_next, self.grid.node_dict,
-                             self.grid.type_map, self.grid.neighbors_dict)
+                    if ped.egress_complete:
+                        break
+
+                    if ped.move(ped.target_next, self.grid.node_dict,
+                                self.grid.type_map, self.grid.neighbors_dict,
+                                self.grid.detour_cache, profiler):
+                        self.num_moves += 1
 
                 # Get x,y values for viz.
                 if self.visualization and timesteps % 10 == 0:
                     x_vals.append(ped.current.pixx)
                     y_vals.append(ped.current.pixy)
 
+            if profiler:
+                phase_start = profiler.add('movement', phase_start)
+
+            # Record the positions of the peds still in the SUI.
+            if trajectory:
+                trajectory.record(timesteps, [ped.current.node_id for ped in active_peds
+                                              if not ped.egress_complete])
+
+                if profiler:
+                    phase_start = profiler.add('recording', phase_start)
+
             # Update viz.
             if self.visualization and timesteps % 10 == 0:
                 self.update_viz(x_vals, y_vals)
 
+                if profiler:
+                    profiler.add('visualization', phase_start)
+
             # If we are doing additional verification logging, append the number
             # of peds that entered the simulation that time step to the
             # list.
@@ -233,6 +431,18 @@ class Simulation:
             timesteps += 1
 
         print('Simulation completed in %d timesteps.' % timesteps)
+        self.grid.detour_cache.report()
+
+        if trajectory:
+            trajectory.close()
+
+        if profiler:
+            profiler.add('total', start_time)
+            profiler.count('moves', self.num_moves)
+            profiler.count('timesteps', timesteps)
+            profiler.count('detour_cache_hits', self.grid.detour_cache.hits)
+            profiler.count('detour_cache_misses', self.grid.detour_cache.misses)
+            profiler.report()
 
         # Close the plot.
         if self.visualization:
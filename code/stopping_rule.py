@@ -0,0 +1,184 @@
+import math
+
+class RunningStats(object):
+    """
+    Keeps the running mean and variance of a series of values, updated one
+    value at a time with Welford's method, so they stay accurate however many
+    values are added.
+    """
+
+    """
+    Creates a new RunningStats object, holding no values.
+
+    Returns:
+      A new RunningStats object.
+
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+
+        # Sum of squared differences from the running mean.
+        self.m2 = 0.0
+
+    # Adds a value.
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    # Returns the sample variance, or 0 with fewer than two values.
+    def variance(self):
+        if self.n < 2:
+            return 0.0
+
+        return self.m2 / (self.n - 1)
+
+    # Returns the sample standard deviation.
+    def std(self):
+        return math.sqrt(self.variance())
+
+    # Returns the half-width of the confidence interval for the mean at the
+    # given confidence level, using Student's t distribution. Infinite with
+    # fewer than two values.
+    def half_width(self, confidence):
+        if self.n < 2:
+            return float('inf')
+
+        t = t_quantile(1 - (1 - confidence) / 2, self.n - 1)
+
+        return t * self.std() / math.sqrt(self.n)
+
+class StoppingRule(object):
+    """
+    Decides when a batch of replications has estimated the mean precisely
+    enough: once the half-width of its confidence interval is at most a
+    target, after a minimum number of runs, or once a maximum number of runs
+    has been made.
+    """
+
+    """
+    Creates a new StoppingRule.
+
+    Args:
+      half_width: Float. Target half-width of the confidence interval.
+      confidence: Float. Confidence level of the interval.
+      min_sims: Integer. Number of runs made before the target is checked.
+      max_sims: Integer. Number of runs after which the batch stops anyway.
+
+    Returns:
+      A new StoppingRule object.
+
+    """
+    def __init__(self, half_width, confidence=0.95, min_sims=5, max_sims=500):
+        if min_sims < 2:
+            raise ValueError('At least 2 runs are needed to estimate a '
+                             'confidence interval.')
+
+        if max_sims < min_sims:
+            raise ValueError('The maximum number of runs (%d) is below the '
+                             'minimum (%d).' % (max_sims, min_sims))
+
+        self.half_width = half_width
+        self.confidence = confidence
+        self.min_sims = min_sims
+        self.max_sims = max_sims
+
+    # Builds a StoppingRule from a configuration's precision settings, with
+    # any of them overridden by the given keyword arguments that aren't None.
+    # Returns None if no target half-width is given.
+    @classmethod
+    def from_config(cls, precision, **overrides):
+        settings = dict(precision or {})
+        settings.update((key, value) for key, value in overrides.items()
+                        if value is not None)
+
+        if settings.get('half_width') is None:
+            return None
+
+        return cls(float(settings['half_width']),
+                   float(settings.get('confidence', 0.95)),
+                   int(settings.get('min_sims', 5)),
+                   int(settings.get('max_sims', 500)))
+
+    # Whether the target has been met.
+    def met(self, stats):
+        return stats.n >= self.min_sims and stats.half_width(self.confidence) <= self.half_width
+
+    # Whether to stop making runs.
+    def done(self, stats):
+        return self.met(stats) or stats.n >= self.max_sims
+
+# Returns the p-quantile of Student's t distribution with the given degrees
+# of freedom, by bisection.
+def t_quantile(p, dof):
+    low, high = -1000.0, 1000.0
+
+    for i in range(100):
+        middle = (low + high) / 2
+
+        if t_cdf(middle, dof) < p:
+            low = middle
+        else:
+            high = middle
+
+    return (low + high) / 2
+
+# Returns the cumulative distribution function of Student's t distribution
+# with the given degrees of freedom at t.
+def t_cdf(t, dof):
+    tail = 0.5 * incomplete_beta(dof / 2.0, 0.5, dof / (dof + t * t))
+
+    return 1 - tail if t > 0 else tail
+
+# Returns the regularized incomplete beta function I_x(a, b), evaluated
+# with its continued fraction (see Press et al., Numerical Recipes, 6.4).
+def incomplete_beta(a, b, x):
+    if x <= 0:
+        return 0.0
+
+    if x >= 1:
+        return 1.0
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                     + a * math.log(x) + b * math.log(1 - x))
+
+    # The continued fraction converges quickly for x below its mean.
+    if x < (a + 1) / (a + b + 2):
+        return front * beta_continued_fraction(a, b, x) / a
+
+    return 1 - front * beta_continued_fraction(b, a, 1 - x) / b
+
+# Evaluates the continued fraction of the incomplete beta function with
+# Lentz's method.
+def beta_continued_fraction(a, b, x, max_terms=200, eps=1e-15):
+    tiny = 1e-300
+
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+
+    for m in range(1, max_terms + 1):
+        # Even step.
+        numerator = m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m))
+        d = 1 + numerator * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        result *= d * c
+
+        # Odd step.
+        numerator = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))
+        d = 1 + numerator * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        result *= delta
+
+        if abs(delta - 1) < eps:
+            break
+
+    return result
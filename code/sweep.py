@@ -0,0 +1,442 @@
+import sys
+import copy
+import getopt
+import json
+import itertools
+import multiprocessing
+import numpy as np
+from sim_batch import SimBatch
+from stopping_rule import RunningStats, t_quantile
+
+class Sweep:
+    """
+    Runs a sweep of scenarios, each a configuration in the format of a
+    configuration file, in one process pool. Each map is loaded once, into
+    one grid shared by every scenario on it. Scenarios are grouped by road
+    topology (their set of closed intersections), so the paths of each
+    topology are built once, and the grid is set up for a topology's closed
+    intersections when a run of it follows a run of another.
+
+    Each scenario's outputs are written to its own results files, as
+    sim_batch.py writes them, and every run is also written to one
+    consolidated table for the sweep.
+    """
+
+    TABLE_FIELDS = ['scenario', 'topology', 'config_hash', 'replication', 'seed',
+                    'timesteps', 'num_pedestrians', 'wall_s', 'engine']
+    SUMMARY_FIELDS = ['scenario', 'topology', 'runs', 'mean_timesteps',
+                      'std_timesteps', 'min_timesteps', 'max_timesteps']
+    DIFFERENCE_FIELDS = ['scenario', 'baseline', 'replications', 'mean_difference',
+                         'std_difference', 'ci_half_width', 'unpaired_ci_half_width']
+
+    # Confidence level of the intervals for differences between scenarios.
+    CONFIDENCE = 0.95
+
+    """
+    Creates a new Sweep.
+
+    Args:
+      name: String. Name of the sweep, used for its results files.
+      scenarios: List. (config_path, config) of each scenario, where config
+        is a dict in the format of a configuration file.
+
+    Returns:
+      A new Sweep object.
+
+    """
+    def __init__(self, name, scenarios):
+        self.name = name
+        self.batches = [SimBatch(config_path, config) for config_path, config in scenarios]
+
+    # Builds the scenarios of a sweep over the given configuration files.
+    # Returns a list of (config_path, config).
+    @staticmethod
+    def scenarios_from_configs(config_paths):
+        scenarios = []
+
+        for config_path in config_paths:
+            with open(config_path) as config_json:
+                scenarios.append((config_path, json.load(config_json)))
+
+        return scenarios
+
+    # Builds the scenarios of a cartesian grid over the timings of a
+    # configuration's intersection_normal intersections. timings maps the id
+    # of an intersection to a list of timings, each a time in seconds or a
+    # dict with green, red and optionally offset. Returns a list of
+    # (config_path, config).
+    @staticmethod
+    def scenarios_from_grid(config_path, timings):
+        with open(config_path) as config_json:
+            base_config = json.load(config_json)
+
+        int_ids = sorted(int(int_id) for int_id in timings)
+        choices = [timings.get(str(int_id), timings.get(int_id)) for int_id in int_ids]
+        scenarios = []
+
+        for combination in itertools.product(*choices):
+            config = copy.deepcopy(base_config)
+            labels = []
+
+            for int_id, timing in zip(int_ids, combination):
+                if isinstance(timing, dict):
+                    entry = dict((key, str(value)) for key, value in timing.items())
+                    label = 'g%sr%so%s' % (entry['green'], entry['red'],
+                                           entry.get('offset', 0))
+                else:
+                    entry = { 'time': str(timing) }
+                    label = str(timing)
+
+                Sweep.set_timing(config, int_id, entry)
+                labels.append('i%d_%s' % (int_id, label))
+
+            config['name'] = '_'.join([base_config.get('name')] + labels)
+            scenarios.append((config_path, config))
+
+        return scenarios
+
+    # Replaces the timing of a normal intersection in a configuration.
+    @staticmethod
+    def set_timing(config, int_id, entry):
+        for param in config.get('parameters'):
+            if param.get('type') != 'intersection_normal':
+                continue
+
+            for x in param.get('data').get('intersections'):
+                if int(x.get('id')) == int_id:
+                    for key in ('time', 'green', 'red', 'offset'):
+                        x.pop(key, None)
+
+                    x.update(entry)
+                    return
+
+        raise ValueError('intersection %d is not a normal intersection in %s.'
+                         % (int_id, config.get('name')))
+
+    # Runs every scenario of the sweep. Takes the same parameters as
+    # SimBatch.run_sims, except for paths_file and precision targets: each
+    # scenario runs num_sims simulations.
+    def run(self, params = {}):
+        # Group the scenarios by topology, keeping the order they were given
+        # in within each group.
+        groups = {}
+
+        for indx, batch in enumerate(self.batches):
+            batch.configure(params)
+            batch.stopping_rule = None
+
+            # Scenarios share paths if they close the same intersections of
+            # the same map.
+            map_files = tuple(sorted(batch.map_files.items()))
+            groups.setdefault((map_files, batch.topology()), []).append(indx)
+
+        topologies = sorted(groups)
+
+        print('---> Sweeping %d scenarios over %d road topologies.'
+              % (len(self.batches), len(topologies)))
+
+        # Build the paths of each topology once, on the grid of its map,
+        # sharing them with every scenario in its group.
+        grids = {}
+
+        for topology in topologies:
+            map_files = topology[0]
+            first = self.batches[groups[topology][0]]
+            first.initialize_grid(None, first.routing, grids.get(map_files))
+            grids[map_files] = first.grid
+
+            for indx in groups[topology][1:]:
+                self.batches[indx].grid = first.grid
+                self.batches[indx].pickle_name = first.pickle_name
+
+        for batch in self.batches:
+            batch.open_results()
+
+        # Every scenario runs the same seeds for each replication, so their
+        # results can be compared replication by replication.
+        size = self.batches[0].replication_size
+        num_replications = max(batch.num_replications() for batch in self.batches)
+        seeds = self.batches[0].generate_seeds(num_replications, params.get('seed', None))
+
+        # Runs of the same topology are queued together, so each worker
+        # mostly reuses the grid it loaded last.
+        tasks = [(indx, run_num // size, seeds[run_num])
+                 for topology in topologies for indx in groups[topology]
+                 for run_num in range(self.batches[indx].num_replications() * size)]
+
+        # Rows of the sweep's table, and the timesteps of each scenario's
+        # runs, by replication.
+        self.rows = []
+        self.timesteps = [{} for batch in self.batches]
+
+        workers = params.get('workers', 1)
+
+        try:
+            if workers > 1:
+                self.run_parallel(tasks, workers)
+            else:
+                for indx, replication, seed in tasks:
+                    self.add(indx, replication, run_task(self.batches, indx, seed))
+        finally:
+            for batch in self.batches:
+                batch.store.close()
+
+        self.write_table()
+
+    # Runs tasks on a pool of worker processes. Outputs are added in the
+    # order the tasks were given.
+    def run_parallel(self, tasks, workers):
+        for batch in self.batches:
+            batch.sim_params['visualization'] = False
+
+        pool = multiprocessing.Pool(workers, init_worker, (self.batches,))
+
+        try:
+            runs = pool.imap(run_worker, [(indx, seed) for indx, replication, seed in tasks])
+
+            for (indx, replication, seed), outputs in zip(tasks, runs):
+                self.add(indx, replication, outputs)
+
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    # Adds the outputs of a run of the scenario with the given index to its
+    # results and to the sweep's table.
+    def add(self, indx, replication, outputs):
+        batch = self.batches[indx]
+        batch.store.add(outputs)
+
+        self.timesteps[indx].setdefault(replication, []).append(outputs['timesteps'])
+
+        self.rows.append({
+            'scenario': batch.name,
+            'topology': ' '.join(str(int_id) for int_id in batch.topology()),
+            'config_hash': batch.config_hash,
+            'replication': replication,
+            'seed': outputs['seed'],
+            'timesteps': outputs['timesteps'],
+            'num_pedestrians': outputs['num_pedestrians'],
+            'wall_s': '%.6f' % outputs['wall_s'],
+            'engine': batch.engine,
+        })
+
+    # Writes the table of every run in the sweep, a summary of each scenario
+    # and the differences between scenarios, and prints the summary and the
+    # differences.
+    def write_table(self):
+        base_path = self.batches[0].filename_with_time('./results/', self.name, '')
+
+        with open(base_path + '.sweep.csv', 'w') as table_file:
+            table_file.write(','.join(self.TABLE_FIELDS) + '\n')
+
+            for row in self.rows:
+                table_file.write(','.join(str(row[field]) for field in self.TABLE_FIELDS) + '\n')
+
+        print('Scenario results:')
+
+        with open(base_path + '.summary.csv', 'w') as summary_file:
+            summary_file.write(','.join(self.SUMMARY_FIELDS) + '\n')
+
+            for indx, batch in enumerate(self.batches):
+                timesteps = np.array(sum(self.timesteps[indx].values(), []), dtype=float)
+
+                if len(timesteps) == 0:
+                    continue
+
+                topology = ' '.join(str(int_id) for int_id in batch.topology())
+                summary = [batch.name, topology, len(timesteps),
+                           '%.3f' % timesteps.mean(), '%.3f' % timesteps.std(),
+                           int(timesteps.min()), int(timesteps.max())]
+                summary_file.write(','.join(str(value) for value in summary) + '\n')
+
+                print('  %-40s %4d runs, %9.3f +/- %8.3f timesteps'
+                      % (batch.name, len(timesteps), timesteps.mean(), timesteps.std()))
+
+        if len(self.batches) > 1:
+            self.write_differences(base_path + '.differences.csv')
+
+        print('Wrote %s.sweep.csv and %s.summary.csv.' % (base_path, base_path))
+
+    # Returns the mean number of timesteps of each replication of the
+    # scenario with the given index, by replication.
+    def replication_means(self, indx):
+        return dict((replication, float(sum(timesteps)) / len(timesteps))
+                    for replication, timesteps in self.timesteps[indx].items())
+
+    # Writes, and prints, the difference in mean timesteps between each
+    # scenario and the first, with a confidence interval computed from the
+    # differences of runs paired by replication. Since paired runs share
+    # their random numbers, this interval is narrower than the one for
+    # independent runs, also given for comparison.
+    def write_differences(self, filename):
+        baseline = self.replication_means(0)
+
+        print('Differences from %s (%g%% CI):' % (self.batches[0].name, 100 * self.CONFIDENCE))
+
+        with open(filename, 'w') as differences_file:
+            differences_file.write(','.join(self.DIFFERENCE_FIELDS) + '\n')
+
+            for indx in range(1, len(self.batches)):
+                means = self.replication_means(indx)
+                paired = sorted(set(means) & set(baseline))
+
+                differences = RunningStats()
+                scenario_stats = RunningStats()
+                baseline_stats = RunningStats()
+
+                for replication in paired:
+                    differences.add(means[replication] - baseline[replication])
+                    scenario_stats.add(means[replication])
+                    baseline_stats.add(baseline[replication])
+
+                n = differences.n
+
+                if n < 2:
+                    continue
+
+                half_width = differences.half_width(self.CONFIDENCE)
+                t = t_quantile(1 - (1 - self.CONFIDENCE) / 2, 2 * n - 2)
+                unpaired_half_width = t * np.sqrt((scenario_stats.variance()
+                                                   + baseline_stats.variance()) / n)
+
+                row = [self.batches[indx].name, self.batches[0].name, n,
+                       '%.3f' % differences.mean, '%.3f' % differences.std(),
+                       '%.3f' % half_width, '%.3f' % unpaired_half_width]
+                differences_file.write(','.join(str(value) for value in row) + '\n')
+
+                print('  %-40s %+9.3f +/- %8.3f timesteps (unpaired +/- %.3f)'
+                      % (self.batches[indx].name, differences.mean, half_width,
+                         unpaired_half_width))
+
+        print('Wrote %s.' % filename)
+
+# Runs one simulation of the scenario with the given index, on its grid,
+# setting the grid up for the scenario's topology first if it was last used
+# for another.
+def run_task(batches, indx, seed):
+    batch = batches[indx]
+
+    if batch.grid is None or batch.grid.paths_file != batch.pickle_name:
+        batch.initialize_grid(batch.pickle_name, batch.routing, batch.grid)
+
+    batch.grid.reset()
+
+    return batch.run_one(seed)
+
+# The scenarios in use by a worker process.
+worker_batches = None
+
+# Initializes a worker process with the scenarios of the sweep. A worker
+# forked from the parent process shares the parent's grids.
+def init_worker(batches):
+    global worker_batches
+
+    worker_batches = batches
+
+# Runs a single simulation in a worker process.
+def run_worker(task):
+    indx, seed = task
+
+    return run_task(worker_batches, indx, seed)
+
+def main(argv):
+    name = None
+    config_files = []
+    grid_file = None
+    num_peds = None
+    routing = 'trees'
+    cache_dir = './routing_cache'
+    workers = 1
+    master_seed = None
+    engine = 'objects'
+    variance_reduction = 'crn'
+
+    help_message = ('sweep.py -c <configJsonFiles, comma separated> '
+                    '-g <timingGridJsonFile> -n <sweepName> -p <int numPeds> '
+                    '-r <pairs/trees routing> -C <cacheDir> -w <int workers> '
+                    '-s <int masterSeed> -e <objects/arrays engine> '
+                    '-R <none/crn/antithetic varianceReduction>')
+
+    # Retrieve command line arguments.
+    try:
+        opts, args = getopt.getopt(argv,'hc:g:n:p:r:C:w:s:e:R:',['help', 'configs=', 'grid=',
+                                                                'name=', 'peds=', 'routing=',
+                                                                'cache=', 'workers=', 'seed=',
+                                                                'engine=', 'reduction='])
+    except getopt.GetoptError:
+        print(help_message)
+        sys.exit(2)
+
+    # Process command line arguments.
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            sys.exit()
+        elif opt in ('-c', '--configs'):
+            config_files = arg.split(',')
+        elif opt in ('-g', '--grid'):
+            grid_file = arg
+        elif opt in ('-n', '--name'):
+            name = arg
+        elif opt in ('-p', '--peds'):
+            num_peds = int(arg)
+        elif opt in ('-r', '--routing'):
+            routing = arg
+        elif opt in ('-C', '--cache'):
+            cache_dir = arg
+        elif opt in ('-w', '--workers'):
+            workers = int(arg)
+        elif opt in ('-s', '--seed'):
+            master_seed = int(arg)
+        elif opt in ('-e', '--engine'):
+            engine = arg
+        elif opt in ('-R', '--reduction'):
+            variance_reduction = arg
+
+    if not config_files and grid_file == None:
+        print('no configs (-c) or timing grid (-g) were given')
+        sys.exit(2)
+
+    if num_peds == None:
+        print('number of pedestrians was not given (integer)')
+        sys.exit(2)
+
+    if variance_reduction not in ('none', 'crn', 'antithetic'):
+        print('variance reduction must be one of none, crn or antithetic')
+        sys.exit(2)
+
+    if engine == 'arrays' and routing != 'trees':
+        print('the arrays engine needs trees routing. using trees.')
+        routing = 'trees'
+
+    scenarios = Sweep.scenarios_from_configs(config_files)
+
+    # A timing grid gives its base configuration and the timings to try for
+    # each intersection.
+    if grid_file:
+        with open(grid_file) as grid_json:
+            grid = json.load(grid_json)
+
+        scenarios.extend(Sweep.scenarios_from_grid(grid['config'], grid['timings']))
+
+        if name == None:
+            name = grid.get('name')
+
+    sweep = Sweep(name or 'sweep', scenarios)
+
+    sweep.run({
+        'num_pedestrians': num_peds,
+        'routing': routing,
+        'cache_dir': cache_dir,
+        'workers': workers,
+        'seed': master_seed,
+        'engine': engine,
+        'variance_reduction': variance_reduction,
+    })
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
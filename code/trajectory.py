@@ -0,0 +1,177 @@
+import struct
+import numpy as np
+
+class TrajectoryWriter(object):
+    """
+    Records the positions of pedestrians during a simulation to a compact,
+    chunked binary trajectory file, to be rendered after the run. Positions
+    are buffered in memory and written one chunk of timesteps at a time.
+
+    File layout (all values little-endian):
+
+      header:       8-byte magic, uint32 version, uint32 num_nodes,
+                    uint32 interval, 12 bytes padding.
+      node_ids:     int32[num_nodes], sorted.
+      pixx, pixy:   float32[num_nodes] each. Pixel coordinates of each node.
+      chunks, each:
+        chunk header: uint32 first_timestep, uint32 num_steps,
+                      uint32 num_points.
+        counts:       int32[num_steps]. Number of pedestrians in each step.
+        positions:    int32[num_points]. node_id of each pedestrian, step
+                      after step.
+    """
+
+    MAGIC = 'PEDTRAJ1'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIII12x')
+    CHUNK_HEADER = struct.Struct('<III')
+
+    """
+    Creates a new TrajectoryWriter, writing the file header.
+
+    Args:
+      filename: String. Path of the trajectory file.
+      nodes: List. Node objects of every node in the grid.
+      interval: Integer. Number of timesteps between recorded steps.
+      chunk_steps: Integer. Number of recorded steps in each chunk.
+
+    Returns:
+      A new TrajectoryWriter object.
+
+    """
+    def __init__(self, filename, nodes, interval=1, chunk_steps=256):
+        self.filename = filename
+        self.interval = interval
+        self.chunk_steps = chunk_steps
+
+        nodes = sorted(nodes, key=lambda node: node.node_id)
+
+        self.file = open(filename, 'wb')
+        self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(nodes), interval))
+        np.array([node.node_id for node in nodes], dtype='<i4').tofile(self.file)
+        np.array([node.pixx for node in nodes], dtype='<f4').tofile(self.file)
+        np.array([node.pixy for node in nodes], dtype='<f4').tofile(self.file)
+
+        self.start_chunk()
+
+    # Clears the buffer of steps for the next chunk.
+    def start_chunk(self):
+        self.first_timestep = None
+        self.counts = []
+        self.positions = []
+
+    # Records the node_ids of the pedestrians in the grid at a timestep, if
+    # it is one of the timesteps recorded.
+    def record(self, timestep, node_ids):
+        if timestep % self.interval != 0:
+            return
+
+        if not self.counts:
+            self.first_timestep = timestep
+
+        self.counts.append(len(node_ids))
+        self.positions.append(np.asarray(node_ids, dtype='<i4'))
+
+        if len(self.counts) == self.chunk_steps:
+            self.flush()
+
+    # Writes the buffered steps as a chunk.
+    def flush(self):
+        if not self.counts:
+            return
+
+        positions = np.concatenate(self.positions)
+
+        self.file.write(self.CHUNK_HEADER.pack(self.first_timestep, len(self.counts),
+                                               len(positions)))
+        np.array(self.counts, dtype='<i4').tofile(self.file)
+        positions.tofile(self.file)
+
+        self.start_chunk()
+
+    # Writes any buffered steps and closes the file.
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class TrajectoryReader(object):
+    """
+    Reads a trajectory file written by TrajectoryWriter. Chunks can be read
+    independently, so they can be handed to separate worker processes.
+    """
+
+
+    """
+    Opens a trajectory file, reading its node table and finding its chunks.
+
+    Args:
+      filename: String. Path of the trajectory file.
+
+    Returns:
+      A new TrajectoryReader object.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            data = f.read(TrajectoryWriter.HEADER.size)
+
+            if len(data) < TrajectoryWriter.HEADER.size:
+                raise ValueError('%s is not a trajectory file.' % filename)
+
+            magic, version, num_nodes, self.interval = TrajectoryWriter.HEADER.unpack(data)
+
+            if magic != TrajectoryWriter.MAGIC or version != TrajectoryWriter.VERSION:
+                raise ValueError('%s is not a version %d trajectory file.'
+                                 % (filename, TrajectoryWriter.VERSION))
+
+            self.node_ids = np.fromfile(f, dtype='<i4', count=num_nodes)
+            self.pixx = np.fromfile(f, dtype='<f4', count=num_nodes)
+            self.pixy = np.fromfile(f, dtype='<f4', count=num_nodes)
+
+            # Offsets of each chunk, and its first timestep and number of
+            # steps, found by skipping from one chunk header to the next.
+            self.chunks = []
+
+            while True:
+                offset = f.tell()
+                data = f.read(TrajectoryWriter.CHUNK_HEADER.size)
+
+                if len(data) < TrajectoryWriter.CHUNK_HEADER.size:
+                    break
+
+                first_timestep, num_steps, num_points = TrajectoryWriter.CHUNK_HEADER.unpack(data)
+                self.chunks.append((offset, first_timestep, num_steps))
+                f.seek(4 * (num_steps + num_points), 1)
+
+    # Total number of recorded steps.
+    def num_steps(self):
+        return sum(num_steps for offset, first_timestep, num_steps in self.chunks)
+
+    # Reads the chunk with the given index. Returns a list of (timestep,
+    # pixx array, pixy array) for each step in it.
+    def read_chunk(self, indx):
+        offset = self.chunks[indx][0]
+
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            first_timestep, num_steps, num_points = \
+                TrajectoryWriter.CHUNK_HEADER.unpack(f.read(TrajectoryWriter.CHUNK_HEADER.size))
+            counts = np.fromfile(f, dtype='<i4', count=num_steps)
+            positions = np.fromfile(f, dtype='<i4', count=num_points)
+
+        # Look up the coordinates of every position at once.
+        indexes = np.searchsorted(self.node_ids, positions)
+        pixx = self.pixx[indexes]
+        pixy = self.pixy[indexes]
+
+        steps = []
+        ends = np.cumsum(counts)
+
+        for step in range(num_steps):
+            start = ends[step] - counts[step]
+            steps.append((first_timestep + step * self.interval,
+                          pixx[start:ends[step]], pixy[start:ends[step]]))
+
+        return steps